@@ -1,30 +1,37 @@
 import os
 import csv
 
-def get_top_selling_products(limit=5):
+def get_top_selling_products(limit=5, start=None, end=None):
     """
     Show the top N selling products by total quantity sold.
-    Default = top 5.
+    Default = top 5, all time. Pass start/end (days, both included) for a window.
+    Comes straight out of the sales summary, so no re-reading the sales log.
+    All-time comes off the leaderboard that every sale keeps up to date.
     """
-    if not os.path.exists(SALES_FILE):
-        print("No sales recorded yet.")
-        return []
+    with metrics.timer('get_top_selling_products'):
+        return _top_selling(limit, start, end)
 
-    sales_count = {}
-    try:
-        with open(SALES_FILE, 'r', newline='') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if len(row) >= 3:
-                    pid, qty = row[1], int(row[2])
-                    sales_count[pid] = sales_count.get(pid, 0) + qty
-    except Exception as e:
-        print(f"Error reading sales file: {e}")
-        return []
+def _top_selling(limit, start, end):
+    with _summary_lock:
+        summary = get_sales_summary()
+        if not summary['days']:
+            print("No sales recorded yet.")
+            return []
+
+        if start is None and end is None:
+            if limit <= LEADERBOARD_SIZE:
+                return _get_leaderboard(summary)[:limit]
+            return heapq.nlargest(limit, summary['products'].items(), key=operator.itemgetter(1))
 
-    # Sort by quantity sold
-    top_products = sorted(sales_count.items(), key=lambda x: x[1], reverse=True)[:limit]
-    return top_products
+        # Add up the days in the window - the summary has per-day quantities already
+        start, end = _as_day(start), _as_day(end)
+        totals = {}
+        for day, entry in summary['days'].items():
+            if (start and day < start) or (end and day > end):
+                continue
+            for pid, qty in entry['products'].items():
+                totals[pid] = totals.get(pid, 0) + qty
+    return heapq.nlargest(limit, totals.items(), key=operator.itemgetter(1))
 # backend.py
 """
 Backend logic for my shop system.
@@ -32,29 +39,196 @@ I built this after I messed up counting inventory by hand too many times.
 Still using CSV files because databases seem complicated.
 """
 
+import atexit
+import contextlib
 import csv
+import functools
+import heapq
+import inspect
+import io
+import itertools
 import os
+import json
+import operator
+import socket
+import sys
+import threading
+import time
+import uuid
 from datetime import datetime
 
+from durable import GroupCommit, atomic_writer, repair_partial_line
+from inventory import Inventory
+from locking import FileLock
+import metrics
+from money import percent_of, spread, to_amount, to_cents
+from product_store import MappedInventory, create_store, import_products_csv
+from receipt_archive import ReceiptArchive, migrate_receipt_files
+from promotions import PromotionEngine, load_rules
+from receipts import Receipt, ReceiptWriter
+from reorder import SalesMatrix, analyze
+from search import SearchIndex
+from sqlite_store import SQLiteDatabase, SQLiteInventory, SQLiteSalesLog
+from stock_index import StockIndex
+from storage import CsvSalesLog, SaleRow   # SaleRow: what the report functions hand out
+
 # Where we store our data
 PRODUCTS_FILE = 'products.csv'
-SALES_FILE = 'sales.csv'
+PRODUCT_COLUMNS = ['Product ID', 'Name', 'Price', 'Stock Quantity']
+SALES_FILE = 'sales.csv'   # old single-file sales log, gets migrated into SALES_FOLDER
+SALES_FOLDER = 'sales'     # one file per day: sales/YYYY-MM-DD.csv
 BILLS_FOLDER = 'receipts'
+# Saved receipts go into a packed archive (BILLS_FOLDER/archive, see
+# receipt_archive.py) instead of a file each. 'files' = the old way.
+RECEIPT_STORE = 'archive'
+COMPRESS_RECEIPTS = True
+
+# How products are kept in memory: 'slots' (small record per product) or
+# 'arrays' (typed arrays, smallest for really big catalogs). See inventory.py
+INVENTORY_STORAGE = 'slots'
+
+# Where products live on disk: 'csv' (products.csv + journal), 'mmap'
+# (fixed-width products.dat, opened instantly and updated in place) or
+# 'sqlite' (the products table in SQLITE_FILE)
+PRODUCT_STORE = 'csv'
+PRODUCTS_STORE_FILE = 'products.dat'
+
+# Where the sales log lives: 'csv' (the day files in SALES_FOLDER) or
+# 'sqlite'. With both stores on SQLite a checkout is a single transaction.
+# See storage.py and sqlite_store.py
+SALES_STORE = 'csv'
+SQLITE_FILE = 'shop.db'
+
+# Running totals (revenue in cents per day, quantity per product) so the reports don't
+# have to re-read the whole sales log. Days whose file changed get re-read.
+SALES_SUMMARY_FILE = 'sales_summary.json'
+
+# Every product change gets appended here instead of rewriting products.csv.
+# The journal gets folded back into products.csv once it grows too long.
+JOURNAL_FILE = 'products.journal'
+JOURNAL_SYNC_EVERY = 16     # with sync=False, fsync after this many records (batched)
+JOURNAL_COMPACT_AT = 1000   # fold into products.csv after this many records
+
+RECOVER_DAYS = 2            # newest day files checked for half-written sales on startup
+
+# Day files older than this many days get compressed into SALES_FOLDER/cold
+# ('gzip' or 'lzma'), with a manifest saying what's in each, on startup (and
+# by the server when the day changes). Reports read them straight from there.
+# None = never.
+SALES_COMPRESS_AFTER_DAYS = 7
+SALES_COMPRESSION = 'gzip'
+
+# Full passes over the sales log (summary rebuilds, daily_totals() and
+# friends) get split up and parsed on several cores once there's at least
+# PARALLEL_SCAN_MIN_BYTES of day files to read. SCAN_WORKERS = 1 turns it off.
+SCAN_WORKERS = None         # None = one per CPU core
+PARALLEL_SCAN_MIN_BYTES = 32 * 1024 * 1024
+BULK_CHUNK_SIZE = 1000      # rows read and checked at a time by the bulk imports
+
+_journal_records = 0    # records sitting in the journal right now
+_unsynced_records = 0   # records written but not fsynced yet
+_journal_offset = 0     # how far into the journal this process has read
+_journal_gen = None     # changes every time somebody compacts the journal
+
+# Group commit: changes get written inside the data lock but fsynced after
+# it's let go, and threads that finish at about the same time share one
+# fsync. Calls still only return once their change is on disk.
+GROUP_COMMIT = False
+GROUP_COMMIT_WINDOW = 0.0   # seconds the first thread waits for others to join in
+_group_commits = {}         # id(inventory) -> (inventory, GroupCommit)
+_sync_lock = threading.Lock()   # guards _unsynced_records
+
+# Several tills can share one data folder. Every change happens while holding
+# LOCK_FILE, after catching up on what the other tills wrote to the journal.
+LOCK_FILE = 'shop.lock'
+RESERVATIONS_FILE = 'reservations.json'   # stock held by carts that are still open
+RESERVATION_TTL = 300                     # seconds before an abandoned cart lets go
+TERMINAL_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+# When to reorder: products at or below their reorder point count as low.
+# Only the ones that don't use the default are in the file.
+REORDER_POINTS_FILE = 'reorder_points.json'
+DEFAULT_REORDER_POINT = 5
 
-# Make sure the receipts folder exists
+# Markdowns, buy-X-get-Y and bulk prices, see promotions.py for the format.
+# Re-read whenever it changes, so edit it while the tills are running. It's
+# only looked at every PROMOTIONS_CHECK_INTERVAL seconds, not on every bill.
+PROMOTIONS_FILE = 'promotions.json'
+PROMOTIONS_CHECK_INTERVAL = 1.0
+
+# Reorder suggestions (reorder.py): how fast each product sold over the last
+# VELOCITY_DAYS days, and enough ordered to last the LEAD_TIME_DAYS until
+# the delivery shows up plus REORDER_COVER_DAYS after that
+VELOCITY_DAYS = 28
+LEAD_TIME_DAYS = 7
+REORDER_COVER_DAYS = 14
+
+_locks = {}      # lock file path -> FileLock
+_databases = {}  # SQLite file -> SQLiteDatabase
+_sales_logs = {}  # (SALES_STORE, where) -> SalesLog
+_versions = {}   # CSV store: product ID -> version token, changes whenever the product is edited
+
+# Search indexes we've built, keyed by id() of the inventory they belong to
+_search_indexes = {}
+_stock_indexes = {}          # same again for the low stock index
+_low_stock_callbacks = []    # see on_low_stock()
+_reorder_points = None       # cached copy of REORDER_POINTS_FILE
+_reorder_points_mtime = None
+_promotions = None           # PROMOTIONS_FILE, compiled
+_promotions_mtime = None
+_promotions_checked_at = 0.0
+
+_receipt_writer = ReceiptWriter()   # saves receipts off the checkout path
+_receipt_archives = {}              # archive folder -> ReceiptArchive
+atexit.register(_receipt_writer.flush)  # don't lose any that are still queued
+
+_sales_summary = None   # cached copy of SALES_SUMMARY_FILE
+# Report threads (the server) read the summary while checkouts add to it,
+# so everything that touches it holds this
+_summary_lock = threading.RLock()
+_summary_dirty = False  # summary changed but not saved yet
+_summary_saved_at = 0.0
+# The summary is only a cache (days whose version moved get re-read), so
+# sales save it at most this often instead of rewriting it every time
+SUMMARY_SAVE_INTERVAL = 5.0
+
+LEADERBOARD_SIZE = 20   # all-time best sellers kept ranked as sales come in
+_leaderboard = None     # [(pid, qty)] biggest first, None = work it out again
+
+# Make sure the receipts and sales folders exist
 os.makedirs(BILLS_FOLDER, exist_ok=True)
+os.makedirs(SALES_FOLDER, exist_ok=True)
 
+@metrics.timed('load_inventory')
 def load_inventory():
     """
     Load all our products from the CSV file.
     If the file doesn't exist or is messed up, we start fresh.
+    With PRODUCT_STORE = 'mmap' we open products.dat instead (made from
+    products.csv the first time), which doesn't read anything up front.
+    'sqlite' works the same way with the SQLite database.
+    Anything a crash left half-written gets cleaned up first.
     """
-    inventory = {}
+    with data_lock():
+        recover_files()
+        _compress_old_sales()
+        if PRODUCT_STORE == 'mmap':
+            return _open_product_store()
+        if PRODUCT_STORE == 'sqlite':
+            return _open_sqlite_store()
+        return _load_csv_inventory()
+
+def _load_csv_inventory(verbose=True):
+    inventory = Inventory(INVENTORY_STORAGE)
+    _versions.clear()   # they come back from the file and the journal
     
     if not os.path.exists(PRODUCTS_FILE):
-        print("(First time running? No products file found, starting fresh)")
+        if verbose:
+            print("(First time running? No products file found, starting fresh)")
+        replay_journal(inventory, verbose)
         return inventory
     
+    skipped = 0
     try:
         with open(PRODUCTS_FILE, 'r', newline='') as f:
             reader = csv.DictReader(f)
@@ -62,25 +236,226 @@ def load_inventory():
                 # Skip empty rows or messed up data
                 if not row.get('Product ID') or not row.get('Name'):
                     continue
-                    
-                inventory[row['Product ID']] = {
-                    'name': row['Name'],
-                    'price': float(row['Price']),
-                    'stock': int(row['Stock Quantity'])
-                }
+                try:
+                    inventory.put(row['Product ID'], row['Name'],
+                                  float(row['Price']), int(row['Stock Quantity']))
+                except (TypeError, ValueError):
+                    skipped += 1
+                    continue
+                if row.get('Version'):
+                    _versions[row['Product ID']] = row['Version']
+    except (OSError, csv.Error, UnicodeDecodeError) as e:
+        # Carrying on with an empty inventory would wipe the file on the next save
+        raise RuntimeError(f"Couldn't read {PRODUCTS_FILE} ({e}), not starting "
+                           f"so it doesn't get overwritten") from e
+    if skipped:
+        print(f"Warning: Skipped {skipped} broken rows in {PRODUCTS_FILE}")
+    if verbose:
         print(f"Loaded {len(inventory)} products from file")
-    except Exception as e:
-        print(f"Uh oh, had trouble reading the products file: {e}")
-        print("We'll start with an empty inventory")
     
+    replay_journal(inventory, verbose)
+    return inventory
+
+def _open_product_store():
+    if not os.path.exists(PRODUCTS_STORE_FILE):
+        if os.path.exists(PRODUCTS_FILE):
+            # Fold any journal changes in first so the new file is up to date
+            _compact_journal(_load_csv_inventory())
+            count = import_products_csv(PRODUCTS_FILE, PRODUCTS_STORE_FILE)
+            print(f"Built {PRODUCTS_STORE_FILE} from {PRODUCTS_FILE} ({count} products)")
+        else:
+            create_store(PRODUCTS_STORE_FILE)
+    
+    inventory = MappedInventory(PRODUCTS_STORE_FILE)
+    print(f"Opened {PRODUCTS_STORE_FILE} ({len(inventory)} products)")
     return inventory
 
+def _open_sqlite_store():
+    inventory = SQLiteInventory(_database())
+    if os.path.exists(PRODUCTS_FILE) and not len(inventory) and not SQLiteSalesLog(inventory.database).days():
+        # First time on SQLite, bring the CSV data along
+        migrate_to_sqlite()
+    print(f"Opened {SQLITE_FILE} ({len(inventory)} products)")
+    return inventory
+
+def _database():
+    """The SQLite database in SQLITE_FILE (one connection per file, shared)"""
+    database = _databases.get(SQLITE_FILE)
+    if database is None:
+        database = _databases[SQLITE_FILE] = SQLiteDatabase(SQLITE_FILE)
+    return database
+
+def _sales_log():
+    """The sales log SALES_STORE points at"""
+    where = SQLITE_FILE if SALES_STORE == 'sqlite' else SALES_FOLDER
+    log = _sales_logs.get((SALES_STORE, where))
+    if log is None:
+        if SALES_STORE == 'sqlite':
+            log = SQLiteSalesLog(_database())
+        elif SALES_STORE == 'csv':
+            log = CsvSalesLog(SALES_FOLDER, SALES_COMPRESS_AFTER_DAYS, SALES_COMPRESSION)
+        else:
+            raise ValueError(f"Unknown SALES_STORE '{SALES_STORE}', use 'csv' or 'sqlite'")
+        _sales_logs[(SALES_STORE, where)] = log
+    return log
+
+def replay_journal(inventory, verbose=True):
+    """
+    Apply any changes from the journal that haven't made it into products.csv yet.
+    Each record holds the full product, so replaying twice does no harm.
+    """
+    global _journal_records, _unsynced_records, _journal_offset, _journal_gen
+    _journal_records = 0
+    _unsynced_records = 0
+    _journal_offset = 0
+    _journal_gen = None
+    
+    if not os.path.exists(JOURNAL_FILE):
+        return 0
+    
+    try:
+        _journal_gen, _journal_offset, _ = _replay_journal_from(inventory, 0)
+    except Exception as e:
+        print(f"Couldn't replay the inventory journal: {e}")
+    
+    if _journal_records and verbose:
+        print(f"Replayed {_journal_records} unsaved changes from the journal")
+    return _journal_records
+
+def _replay_journal_from(inventory, offset):
+    """
+    Apply the journal records from a byte offset onwards.
+    Returns (journal generation, offset we got up to, product IDs that changed).
+    Only whole lines count - a half-written record at the end is left for next time.
+    """
+    global _journal_records
+    with open(JOURNAL_FILE, 'rb') as f:
+        first_line = f.readline()
+        gen = first_line[5:].strip().decode() if first_line.startswith(b'#gen,') else None
+        f.seek(offset)
+        data = f.read()
+    
+    end = data.rfind(b'\n') + 1
+    changed = []
+    for row in csv.reader(data[:end].decode('utf-8').splitlines()):
+        # Old records have no version column
+        if len(row) not in (5, 6) or row[0].startswith('#'):
+            continue
+        op, pid, name, price, stock = row[:5]
+        try:
+            if op == 'set':
+                inventory[pid] = {
+                    'name': name,
+                    'price': float(price),
+                    'stock': int(stock)
+                }
+            elif op == 'del':
+                inventory.pop(pid, None)
+            else:
+                continue
+        except ValueError:
+            continue
+        if len(row) == 6 and row[5]:
+            _versions[pid] = row[5]
+        changed.append(pid)
+        _journal_records += 1
+    
+    return gen, offset + end, changed
+
+def data_lock():
+    """The lock every till takes before changing anything in the data folder"""
+    lock = _locks.get(LOCK_FILE)
+    if lock is None:
+        lock = _locks[LOCK_FILE] = FileLock(LOCK_FILE)
+    return lock
+
+def with_latest_data(func):
+    """
+    Run func(inventory, ...) holding the data lock, after catching up on
+    whatever the other tills changed. All the functions that change stuff use this.
+    With GROUP_COMMIT on, the fsync happens after the lock is let go (unless
+    the call passed sync=False, then the caller flushes).
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(inventory, *args, **kwargs):
+        with data_lock():
+            refresh_inventory(inventory)
+            result = func(inventory, *args, **kwargs)
+        if _group_commit_on():
+            # sync can come in by position or by name
+            call = signature.bind(inventory, *args, **kwargs)
+            call.apply_defaults()
+            if call.arguments.get('sync', True):
+                _get_group_commit(inventory).commit()
+        return result
+    return wrapper
+
+def refresh_inventory(inventory):
+    """
+    Catch up on changes other tills made since we last looked.
+    Call this with data_lock() held, right before changing anything.
+    """
+    global _journal_offset, _journal_gen
+    if getattr(inventory, 'persists_in_place', False):
+        # The products themselves are always up to date, our indexes aren't
+        if inventory.refresh():
+            _rebuild_indexes(inventory)
+        return
+    
+    try:
+        with open(JOURNAL_FILE, 'rb') as f:
+            first_line = f.readline()
+            size = f.seek(0, os.SEEK_END)
+    except OSError:
+        first_line, size = b'', 0
+    gen = first_line[5:].strip().decode() if first_line.startswith(b'#gen,') else None
+    
+    if gen != _journal_gen or size < _journal_offset:
+        # Somebody folded the journal into products.csv - start over from there
+        fresh = _load_csv_inventory(verbose=False)
+        inventory.clear()
+        inventory.update(fresh)
+        _rebuild_indexes(inventory)
+    elif size > _journal_offset:
+        _journal_gen, _journal_offset, changed = _replay_journal_from(inventory, _journal_offset)
+        _update_indexes(inventory, changed)
+
+@with_latest_data
+def get_version(inventory, pid):
+    """
+    The product's current version. Grab it before editing and pass it back as
+    expected_version, and the edit gets refused if another till got there first.
+    """
+    return _product_version(inventory, pid)
+
+def _product_version(inventory, pid):
+    # The mmap and SQLite stores keep it in the product's record, so every
+    # till sees the same one; the CSV store has it in the journal and products.csv
+    if getattr(inventory, 'persists_in_place', False):
+        return inventory.version(pid) if pid in inventory else ''
+    return _versions.get(pid, '')
+
+def _new_version(inventory, pid):
+    version = uuid.uuid4().hex[:8]
+    if getattr(inventory, 'persists_in_place', False):
+        if pid in inventory:
+            inventory.set_version(pid, version)
+        return
+    _versions[pid] = version
+
+@metrics.timed('save_inventory')
 def save_inventory(inventory):
-    """Save our current inventory back to the CSV file"""
+    """
+    Save our current inventory back to the CSV file (returns True if it worked).
+    It's written to a temp file, fsynced and renamed over the old one, so a
+    crash halfway leaves the old file as it was. Each product's version goes
+    in the last column, so it survives the journal getting folded in.
+    """
     try:
-        with open(PRODUCTS_FILE, 'w', newline='') as f:
-            fieldnames = ['Product ID', 'Name', 'Price', 'Stock Quantity']
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
+        with atomic_writer(PRODUCTS_FILE, newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=PRODUCT_COLUMNS + ['Version'])
             writer.writeheader()
             
             for pid, item in inventory.items():
@@ -88,31 +463,181 @@ def save_inventory(inventory):
                     'Product ID': pid,
                     'Name': item['name'],
                     'Price': item['price'],
-                    'Stock Quantity': item['stock']
+                    'Stock Quantity': item['stock'],
+                    'Version': _versions.get(pid, '')
                 })
+            size = f.tell()
     except Exception as e:
         print(f"CRITICAL: Failed to save inventory! Error: {e}")
-        # In a real app I'd handle this better but for now... yolo
+        metrics.count('save_failures_total', file='products')
+        return False
+    metrics.count('saves_total', file='products')
+    metrics.count('bytes_written_total', size, file='products')
+    return True
+
+def _journal_record(inventory, pid):
+    """What the journal should say about this product right now"""
+    version = _versions.get(pid, '')
+    if pid in inventory:
+        item = inventory[pid]
+        return ['set', pid, item['name'], item['price'], item['stock'], version]
+    return ['del', pid, '', '', '', version]
+
+def _group_commit_on():
+    # SQLite commits have to happen inside the data lock, so it does its own thing
+    return GROUP_COMMIT and PRODUCT_STORE != 'sqlite' and SALES_STORE != 'sqlite'
+
+def _fsync_now(sync):
+    """With group commit on, fsyncs wait until the data lock is let go"""
+    return sync and not _group_commit_on()
 
+def _take_unsynced(changes, sync):
+    """Count changes that aren't on disk yet. True if it's time to fsync them."""
+    global _unsynced_records
+    with _sync_lock:
+        _unsynced_records += changes
+        if not (_fsync_now(sync) or
+                (not _group_commit_on() and _unsynced_records >= JOURNAL_SYNC_EVERY)):
+            return False
+        _unsynced_records = 0
+        return True
+
+def _append_journal(records, sync=False):
+    """
+    Append records to the journal. sync=False only fsyncs every few records.
+    If that fails the journal gets cut back to where it was, so a caller
+    putting things back (checkout) doesn't leave the records behind.
+    """
+    global _journal_records, _journal_offset
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(records)
+    
+    data = buffer.getvalue().encode('utf-8')
+    # Unbuffered, so nothing's left over to be written on close after a cut
+    with open(JOURNAL_FILE, 'ab', buffering=0) as f:
+        start = f.seek(0, os.SEEK_END)
+        try:
+            if f.write(data) != len(data):
+                raise OSError(f"only part of the change fit in {JOURNAL_FILE}")
+            if _take_unsynced(len(records), sync):
+                os.fsync(f.fileno())
+                metrics.count('fsyncs_total', file='journal')
+        except BaseException:
+            os.ftruncate(f.fileno(), start)
+            raise
+        if start == _journal_offset:
+            # We were all caught up, so no need to read our own records back
+            _journal_offset = f.tell()
+    _journal_records += len(records)
+    metrics.count('bytes_written_total', len(data), file='journal')
+
+@metrics.timed('record_changes')
+def record_changes(inventory, pids, sync=True):
+    """
+    Persist changes to the given products by appending to the journal.
+    Costs the same no matter how big the catalog is. Once the journal gets
+    long we compact it back into products.csv.
+    sync=False leaves the fsync for later (every JOURNAL_SYNC_EVERY records
+    or flush_pending_writes()), so the last few changes could be lost in a crash.
+    Also keeps the search and low stock indexes in step with the changes.
+    Inventories that write straight to disk (the mmap store) just get synced.
+    """
+    _update_indexes(inventory, pids)
+    if getattr(inventory, 'persists_in_place', False):
+        return _sync_in_place(inventory, len(pids), sync)
+    try:
+        _append_journal([_journal_record(inventory, pid) for pid in pids], sync)
+    except Exception as e:
+        print(f"Couldn't write to the journal ({e}), saving the whole file instead")
+        metrics.count('save_failures_total', file='journal')
+        return save_inventory(inventory)
+    
+    _maybe_compact(inventory)
+    return True
+
+def _sync_in_place(inventory, changes, sync=False):
+    """Same batching as the journal fsync, but for the mmap store"""
+    if _take_unsynced(changes, sync):
+        inventory.sync()
+    return True
+
+def _maybe_compact(inventory):
+    if _journal_records >= JOURNAL_COMPACT_AT:
+        _compact_journal(inventory)
+
+@metrics.timed('compact_journal')
+@with_latest_data
+def compact_journal(inventory):
+    """Fold the journal into products.csv and start a fresh journal"""
+    return _compact_journal(inventory)
+
+def _compact_journal(inventory):
+    global _journal_records, _unsynced_records, _journal_offset, _journal_gen
+    if getattr(inventory, 'persists_in_place', False):
+        # Nothing to fold, just make sure it's all on disk
+        inventory.sync()
+        _unsynced_records = 0
+        return True
+    
+    if not save_inventory(inventory):
+        # Keep the journal, it's the only copy of those changes now
+        return False
+    
+    # The new generation tells the other tills to reload from products.csv
+    gen = uuid.uuid4().hex
+    header = f"#gen,{gen}\n".encode('utf-8')
+    try:
+        with atomic_writer(JOURNAL_FILE, 'wb') as f:
+            f.write(header)
+    except Exception as e:
+        print(f"Warning: Couldn't clear the journal: {e}")
+        return False
+    
+    _journal_records = 0
+    _unsynced_records = 0
+    _journal_offset = len(header)
+    _journal_gen = gen
+    return True
+
+@metrics.timed('add_new_product')
+@with_latest_data
 def add_new_product(inventory, pid, name, price, stock):
     """Add a new product to our inventory"""
     if pid in inventory:
         return False, f"Oops! Product ID '{pid}' already exists. Use a different ID."
     
-    inventory[pid] = {
-        'name': name,
-        'price': price,
-        'stock': stock
-    }
+    try:
+        inventory[pid] = {
+            'name': name,
+            'price': price,
+            'stock': stock
+        }
+    except ValueError as e:
+        return False, f"Couldn't add that product: {e}"
     
-    save_inventory(inventory)
+    _new_version(inventory, pid)
+    record_changes(inventory, [pid])
     return True, f"Nice! Added '{name}' to inventory."
 
-def modify_product(inventory, pid, new_name=None, new_price=None, new_stock=None):
-    """Change details of an existing product"""
+@metrics.timed('modify_product')
+@with_latest_data
+def modify_product(inventory, pid, new_name=None, new_price=None, new_stock=None,
+                   expected_version=None, reorder_point=None):
+    """
+    Change details of an existing product.
+    Pass expected_version (from get_version) to make sure nobody on another
+    till changed it since you looked.
+    reorder_point sets when the product counts as running low.
+    """
     if pid not in inventory:
         return False, "Can't find that product. Wrong ID?"
     
+    if expected_version is not None and _product_version(inventory, pid) != expected_version:
+        return False, "Someone changed this product on another till while you were editing. Have another look and try again."
+    
+    if reorder_point is not None and reorder_point < 0:
+        return False, "The reorder point can't be negative."
+    
     product = inventory[pid]
     
     if new_name:
@@ -130,9 +655,16 @@ def modify_product(inventory, pid, new_name=None, new_price=None, new_stock=None
         product['stock'] = new_stock
         print(f"Changed stock from {old_stock} to {new_stock}")
     
-    save_inventory(inventory)
+    if reorder_point is not None:
+        _set_reorder_point(inventory, pid, reorder_point)
+        print(f"Reorder point is now {reorder_point}")
+    
+    _new_version(inventory, pid)
+    record_changes(inventory, [pid])
     return True, "Product updated successfully!"
 
+@metrics.timed('remove_product')
+@with_latest_data
 def remove_product(inventory, pid):
     """Completely remove a product from inventory"""
     if pid not in inventory:
@@ -141,11 +673,340 @@ def remove_product(inventory, pid):
     product_name = inventory[pid]['name']
     del inventory[pid]
     
-    save_inventory(inventory)
+    _new_version(inventory, pid)
+    record_changes(inventory, [pid])
+    if pid in _load_reorder_points():
+        _set_reorder_point(inventory, pid, None)
     return True, f"Removed '{product_name}' from inventory."
 
-def find_products(inventory, search_term):
-    """Search for products by name or ID"""
+def _open_bulk_file(path, mode):
+    """Open a CSV for bulk import/export, '-' means stdin/stdout"""
+    if path == '-':
+        stream = sys.stdin if mode == 'r' else sys.stdout
+        return contextlib.nullcontext(stream)
+    return open(path, mode, newline='')
+
+def _read_chunks(f, chunk_size):
+    """Stream a CSV as lists of (line number, row) so we never hold the whole file"""
+    reader = csv.DictReader(f)
+    rows = enumerate(reader, start=2)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield reader.fieldnames, chunk
+
+def _check_product_row(inventory, row, staged=None):
+    """
+    Turn one import row into (pid, name, price, stock) or raise ValueError saying why not.
+    staged holds rows a dry run has already checked but not merged.
+    """
+    pid = (row.get('Product ID') or '').strip()
+    if not pid:
+        raise ValueError("no Product ID")
+    if staged and pid in staged:
+        existing = staged[pid]
+    else:
+        existing = inventory[pid] if pid in inventory else None
+
+    # Blank columns keep what we have for products we already know
+    name = (row.get('Name') or '').strip()
+    price = (row.get('Price') or '').strip()
+    stock = (row.get('Stock Quantity') or '').strip()
+    if existing is None and not (name and price and stock):
+        raise ValueError("new products need a Name, Price and Stock Quantity")
+
+    try:
+        price = float(price) if price else existing['price']
+    except ValueError:
+        raise ValueError(f"price '{price}' isn't a number")
+    try:
+        stock = int(stock) if stock else existing['stock']
+    except ValueError:
+        raise ValueError(f"stock '{stock}' isn't a whole number")
+    if price < 0:
+        raise ValueError("price can't be negative")
+    if stock < 0:
+        raise ValueError("stock can't be negative")
+    return pid, name or existing['name'], price, stock
+
+def _save_bulk_changes(inventory, changed):
+    """
+    Write a bulk change in one go. Small ones go in the journal like normal
+    edits, big ones rewrite products.csv once instead of journaling every row.
+    """
+    for pid in changed:
+        _new_version(inventory, pid)
+    if getattr(inventory, 'persists_in_place', False) or _journal_records + len(changed) < JOURNAL_COMPACT_AT:
+        return record_changes(inventory, list(changed), sync=True)
+    _update_indexes(inventory, changed)
+    return _compact_journal(inventory)
+
+@metrics.timed('import_products')
+@with_latest_data
+def import_products(inventory, path, dry_run=False, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Add or update products from a CSV with the same columns as products.csv
+    (a supplier feed, a spreadsheet...). The file gets read a chunk at a
+    time, each good row merged in as soon as it's checked (so a later row
+    for the same product sees it) and everything saved once at the end -
+    bad rows are skipped and reported. Blank columns leave existing products alone.
+    dry_run=True only checks the file.
+    Returns (success, message, errors) where errors is a list of (line, problem).
+    """
+    errors = []
+    added = updated = 0
+    changed = {}   # used as an ordered set
+    staged = {}    # dry run only: what the rows so far would have done
+
+    try:
+        with _open_bulk_file(path, 'r') as f:
+            for columns, chunk in _read_chunks(f, chunk_size):
+                if 'Product ID' not in (columns or []):
+                    return False, f"{path} needs at least a 'Product ID' column", errors
+                for line, row in chunk:
+                    try:
+                        pid, name, price, stock = _check_product_row(inventory, row, staged)
+                    except ValueError as e:
+                        errors.append((line, str(e)))
+                        continue
+
+                    if dry_run:
+                        if pid in inventory or pid in staged:
+                            updated += 1
+                        else:
+                            added += 1
+                        staged[pid] = {'name': name, 'price': price, 'stock': stock}
+                        continue
+                    is_new = pid not in inventory
+                    try:
+                        inventory.put(pid, name, price, stock)
+                    except ValueError as e:   # e.g. ID too long for the mmap store
+                        errors.append((line, str(e)))
+                        continue
+                    if is_new:
+                        added += 1
+                    else:
+                        updated += 1
+                    changed[pid] = None
+    except (OSError, csv.Error, UnicodeDecodeError) as e:
+        if not changed:
+            return False, f"Couldn't read {path}: {e}", errors
+        # What we merged before the bad bit is in memory already, keep it
+        _save_bulk_changes(inventory, changed)
+        return False, f"Couldn't read all of {path} ({e}), {len(changed)} products were imported", errors
+
+    if dry_run:
+        return True, f"Checked {path}: {added} new, {updated} updates, {len(errors)} bad rows.", errors
+    if changed and not _save_bulk_changes(inventory, changed):
+        return False, "Imported, but saving the inventory failed!", errors
+    return True, f"Imported {path}: {added} added, {updated} updated, {len(errors)} rows skipped.", errors
+
+@metrics.timed('apply_stock_adjustments')
+@with_latest_data
+def apply_stock_adjustments(inventory, path, dry_run=False, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Bulk stock changes from a CSV with a 'Product ID' column and either
+    'Adjustment' (+/- amount, e.g. a delivery or breakage) or 'Stock Quantity'
+    (the count from a stocktake). Several rows for one product add up.
+    Rows for unknown products or that would take stock below zero are skipped
+    and reported. Everything gets saved once at the end.
+    Returns (success, message, errors) like import_products.
+    """
+    errors = []
+    new_stock = {}   # pid -> stock after the rows so far
+
+    try:
+        with _open_bulk_file(path, 'r') as f:
+            for columns, chunk in _read_chunks(f, chunk_size):
+                columns = columns or []
+                if 'Product ID' not in columns or not ('Adjustment' in columns or 'Stock Quantity' in columns):
+                    return False, f"{path} needs 'Product ID' and 'Adjustment' or 'Stock Quantity' columns", errors
+                for line, row in chunk:
+                    pid = (row.get('Product ID') or '').strip()
+                    adjustment = (row.get('Adjustment') or '').strip()
+                    count = (row.get('Stock Quantity') or '').strip()
+                    if pid not in inventory:
+                        errors.append((line, f"unknown product '{pid}'"))
+                        continue
+                    current = new_stock.get(pid, inventory[pid]['stock'])
+                    try:
+                        stock = int(count) if count else current + int(adjustment)
+                    except ValueError:
+                        errors.append((line, f"'{count or adjustment}' isn't a whole number"))
+                        continue
+                    if stock < 0:
+                        errors.append((line, f"would leave {pid} at {stock} in stock"))
+                        continue
+                    new_stock[pid] = stock
+    except (OSError, csv.Error, UnicodeDecodeError) as e:
+        return False, f"Couldn't read {path}: {e} - nothing changed", errors
+
+    if dry_run:
+        return True, f"Checked {path}: {len(new_stock)} products to adjust, {len(errors)} bad rows.", errors
+    for pid, stock in new_stock.items():
+        inventory[pid]['stock'] = stock
+    if new_stock and not _save_bulk_changes(inventory, new_stock):
+        return False, "Adjusted, but saving the inventory failed!", errors
+    return True, f"Adjusted stock for {len(new_stock)} products, {len(errors)} rows skipped.", errors
+
+@metrics.timed('export_products')
+@with_latest_data
+def export_products(inventory, path, search_term=None, min_stock=None, max_stock=None):
+    """
+    Write products to a CSV (same columns as products.csv), optionally only
+    the ones matching a search and/or a stock range. Rows are written as we
+    go, nothing gets collected first. Returns how many products went out.
+    """
+    if search_term:
+        pids = get_search_index(inventory).search(search_term)
+    else:
+        pids = iter(inventory)
+
+    count = 0
+    with _open_bulk_file(path, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(PRODUCT_COLUMNS)
+        for pid in pids:
+            item = inventory[pid]
+            stock = item['stock']
+            if (min_stock is not None and stock < min_stock) or (max_stock is not None and stock > max_stock):
+                continue
+            writer.writerow([pid, item['name'], item['price'], stock])
+            count += 1
+    return count
+
+def get_search_index(inventory):
+    """The search index for this inventory, built the first time we need it"""
+    entry = _search_indexes.get(id(inventory))
+    if entry is None or entry[0] is not inventory:
+        index = SearchIndex(inventory)
+        _search_indexes[id(inventory)] = (inventory, index)
+        return index
+    return entry[1]
+
+def _update_search_index(inventory, pids):
+    entry = _search_indexes.get(id(inventory))
+    if entry is None or entry[0] is not inventory:
+        return  # nobody has searched yet, it'll get built when they do
+    index = entry[1]
+    for pid in pids:
+        if pid in inventory:
+            index.update(pid, inventory[pid]['name'])
+        else:
+            index.remove(pid)
+
+def _update_indexes(inventory, pids):
+    _update_search_index(inventory, pids)
+    _update_stock_index(inventory, pids)
+
+def _rebuild_indexes(inventory):
+    """
+    Start the indexes over when we can't tell which products changed.
+    The search index gets rebuilt the next time somebody searches; the
+    stock index straight away, and the products that went low in the
+    meantime get their low stock alert.
+    """
+    _search_indexes.pop(id(inventory), None)
+    entry = _stock_indexes.pop(id(inventory), None)
+    if entry is None or entry[0] is not inventory:
+        return  # nobody is watching the stock yet, it'll get built when they do
+    was_low = set(entry[1].low())
+    index = get_stock_index(inventory)
+    for pid in index.low():
+        if pid not in was_low:
+            _alert_low_stock(index, pid, inventory[pid])
+
+def _load_reorder_points():
+    """The per-product reorder points, re-read when another till changed them"""
+    global _reorder_points, _reorder_points_mtime
+    try:
+        mtime = os.stat(REORDER_POINTS_FILE).st_mtime_ns
+    except OSError:
+        mtime = None
+    if _reorder_points is None or mtime != _reorder_points_mtime:
+        points = {}
+        if mtime is not None:
+            try:
+                with open(REORDER_POINTS_FILE, 'r') as f:
+                    points = {pid: int(point) for pid, point in json.load(f).items()}
+            except Exception as e:
+                print(f"Warning: Couldn't read the reorder points ({e}), using {DEFAULT_REORDER_POINT} for everything")
+        if _reorder_points is not None:
+            # Another till changed some, move those products in the indexes we have
+            # (throwing the indexes away would stop the low stock alerts)
+            for _, index in _stock_indexes.values():
+                index.set_reorder_points(points)
+        _reorder_points, _reorder_points_mtime = points, mtime
+    return _reorder_points
+
+def _set_reorder_point(inventory, pid, point):
+    """Save one product's reorder point (None = use the default again)"""
+    global _reorder_points_mtime
+    points = _load_reorder_points()
+    if point is None:
+        points.pop(pid, None)
+    else:
+        points[pid] = point
+    with atomic_writer(REORDER_POINTS_FILE) as f:
+        json.dump(points, f)
+    _reorder_points_mtime = os.stat(REORDER_POINTS_FILE).st_mtime_ns
+    
+    entry = _stock_indexes.get(id(inventory))
+    if entry is not None and entry[0] is inventory:
+        entry[1].set_reorder_point(pid, point)
+
+def get_stock_index(inventory):
+    """The low stock index for this inventory, built the first time we need it"""
+    points = _load_reorder_points()
+    entry = _stock_indexes.get(id(inventory))
+    if entry is None or entry[0] is not inventory:
+        index = StockIndex(inventory, points, DEFAULT_REORDER_POINT)
+        _stock_indexes[id(inventory)] = (inventory, index)
+        return index
+    return entry[1]
+
+def _update_stock_index(inventory, pids):
+    entry = _stock_indexes.get(id(inventory))
+    if entry is None or entry[0] is not inventory:
+        return  # nobody is watching the stock yet, it'll get built when they do
+    index = entry[1]
+    for pid in pids:
+        if pid not in inventory:
+            index.remove(pid)
+            continue
+        item = inventory[pid]
+        if index.update(pid, item['stock']):
+            _alert_low_stock(index, pid, item)
+
+def _alert_low_stock(index, pid, item):
+    for callback in _low_stock_callbacks:
+        try:
+            callback(pid, item, index.reorder_point(pid))
+        except Exception as e:
+            print(f"Warning: Low stock alert failed: {e}")
+            metrics.count('errors_total', operation='low_stock_alert')
+
+def on_low_stock(inventory, callback):
+    """
+    Call callback(pid, item, reorder_point) the moment a sale (or any other
+    change) takes a product down to its reorder point.
+    """
+    _low_stock_callbacks.append(callback)
+    get_stock_index(inventory)
+
+@metrics.timed('find_products')
+def find_products(inventory, search_term, limit=None, rank=False):
+    """
+    Search for products by name or ID.
+    Uses the search index so we don't have to look at every product.
+    rank=True puts exact/prefix matches first, limit caps the number of results.
+    """
+    index = get_search_index(inventory)
+    return [(pid, inventory[pid]) for pid in index.search(search_term, limit, rank)]
+
+def _scan_products(inventory, search_term):
+    """The old way: look at every single product (kept for benchmarking)"""
     search_term = search_term.lower()
     results = []
     
@@ -156,108 +1017,860 @@ def find_products(inventory, search_term):
     
     return results
 
+@with_latest_data
 def reduce_stock(inventory, pid, quantity):
     """Reduce stock when someone buys something"""
     if pid not in inventory:
         return False, "Product not found. This shouldn't happen..."
     
-    if inventory[pid]['stock'] < quantity:
+    if inventory[pid]['stock'] - _reserved_by_others(_load_reservations(), pid, TERMINAL_ID) < quantity:
         return False, f"Not enough {inventory[pid]['name']} in stock!"
     
     inventory[pid]['stock'] -= quantity
-    save_inventory(inventory)
+    record_changes(inventory, [pid])
     return True, f"Stock updated for {inventory[pid]['name']}"
 
-def log_sale(cart, total_amount):
+def new_bill_id(when=None):
+    """A bill ID that won't clash even if two bills happen in the same second"""
+    when = when or datetime.now()
+    return f"{when.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+def _sale_rows(inventory, cart, discount_percent, sale_time, bill_id, receipt=None):
+    """
+    One row per cart line: timestamp, bill ID, product ID, quantity, unit price, line total.
+    Money is in cents. Promotions come off their own line, and the discount
+    gets spread over the lines so the line totals add up to exactly what
+    the receipt says. Pass the sale's receipt if it's already made.
+    """
+    receipt = receipt or _build_receipt(inventory, cart, discount_percent, bill_id, sale_time)
+    timestamp = receipt.date
+    line_cents = [price * qty for _, _, qty, price in receipt.items]
+    if receipt.line_discounts:
+        line_cents = [cents - off for cents, (off, _) in zip(line_cents, receipt.line_discounts)]
+    
+    # Any rounding leftovers go on the last line
+    return [[timestamp, bill_id, pid, qty, price, line]
+            for (pid, _, qty, price), line in zip(receipt.items, spread(receipt.total_cents, line_cents))]
+
+@metrics.timed('log_sale')
+def log_sale(inventory, cart, discount_percent=0, bill_id=None):
     """
     Record a sale in our sales log.
-    TODO: This should probably track individual item totals instead of the whole bill total
-    for each item, but it works for now.
+    Each cart line gets its own row with its own total (after discount),
+    written to that day's part of the sales log.
     """
     sale_time = datetime.now()
-    
+    bill_id = bill_id or new_bill_id(sale_time)
+    rows = _sale_rows(inventory, cart, discount_percent, sale_time, bill_id)
     try:
-        with open(SALES_FILE, 'a', newline='') as f:
-            writer = csv.writer(f)
-            for pid, qty in cart.items():
-                writer.writerow([
-                    sale_time.strftime('%Y-%m-%d'),
-                    pid,
-                    qty,
-                    total_amount  # This is the whole bill total, not per item
-                ])
+        versions = _append_sale_rows(rows, sale_time)
     except Exception as e:
         print(f"Warning: Failed to log sale: {e}")
+        metrics.count('save_failures_total', file='sales')
+        return
+    _add_sale_to_summary(rows, sale_time, versions)
 
-def get_daily_sales(date_string):
-    """How much money did we make on a specific day?"""
-    total = 0.0
+def _append_sale_rows(rows, sale_time, sync=False):
+    """
+    Write all the rows for one sale in one go to the day's part of the sales log.
+    Returns the day's (version before, version after) - a failed checkout
+    hands the first one to _undo_sale_rows(). Raises if anything goes wrong.
+    """
+    versions = _sales_log().append(sale_time.strftime('%Y-%m-%d'), rows, _fsync_now(sync))
+    metrics.count('sale_rows_written_total', len(rows))
+    return versions
+
+@metrics.timed('flush_pending_writes')
+def flush_pending_writes(inventory=None):
+    """
+    fsync everything that got written with sync=False - the sales log first,
+    then the journal (or the mmap/SQLite store if you pass that inventory in).
+    Lets a busy caller like the server pay for one fsync per batch of orders.
+    The sales summary gets saved here too.
+    """
+    with data_lock():
+        if _summary_dirty:
+            _save_sales_summary()
+        _sync_pending(inventory)
+
+def _sync_pending(inventory=None):
+    """
+    The fsyncs themselves. Doesn't need the data lock, which is what lets
+    group commit run them while other threads carry on writing.
+    """
+    global _unsynced_records
+    _sales_log().sync()
+    with _sync_lock:
+        unsynced = _unsynced_records
+        _unsynced_records = 0
+    try:
+        if unsynced:
+            if getattr(inventory, 'persists_in_place', False):
+                inventory.sync()
+            elif os.path.exists(JOURNAL_FILE):
+                with open(JOURNAL_FILE, 'ab') as f:
+                    os.fsync(f.fileno())
+                metrics.count('fsyncs_total', file='journal')
+    except Exception:
+        # Still not on disk, leave them for the next try
+        with _sync_lock:
+            _unsynced_records += unsynced
+        raise
+
+def _get_group_commit(inventory):
+    with _sync_lock:
+        entry = _group_commits.get(id(inventory))
+        if entry is None or entry[0] is not inventory:
+            entry = _group_commits[id(inventory)] = (
+                inventory, GroupCommit(lambda: _sync_pending(inventory)))
+    entry[1].window = GROUP_COMMIT_WINDOW
+    return entry[1]
+
+def recover_files():
+    """
+    Clean up after a crash: cut sales that only half made it to disk off the
+    end of the newest day files, and a half-written record off the journal.
+    Call it with data_lock() held (load_inventory does, on startup).
+    Returns how many files needed fixing.
+    """
+    fixed = _sales_log().recover(RECOVER_DAYS)
     
-    if not os.path.exists(SALES_FILE):
-        return total
+    if os.path.exists(JOURNAL_FILE):
+        try:
+            cut = repair_partial_line(JOURNAL_FILE)
+        except OSError as e:
+            print(f"Warning: Couldn't check {JOURNAL_FILE}: {e}")
+            cut = 0
+        if cut:
+            print(f"Recovered {JOURNAL_FILE}: dropped a half-written change ({cut} bytes)")
+            fixed += 1
+    return fixed
+
+def _compress_old_sales():
+    """Move day files that are old enough into the sales log's cold tier"""
+    try:
+        days, before, after = _sales_log().rotate(datetime.now().strftime('%Y-%m-%d'))
+    except Exception as e:
+        print(f"Warning: Couldn't compress the old sales files: {e}")
+        return 0, 0, 0
+    if days:
+        print(f"Compressed {days} old days of sales ({before / 2**20:.1f} MiB -> {after / 2**20:.1f} MiB)")
+    return days, before, after
+
+def compress_sales_log():
+    """Compress the old day files now instead of waiting for the next startup. Returns (days, bytes before, bytes after)."""
+    with data_lock():
+        return _compress_old_sales()
+
+def _undo_sale_rows(sale_time, version):
+    """Take the day's sales back to how they were before a failed sale"""
+    _sales_log().undo(sale_time.strftime('%Y-%m-%d'), version)
+
+@metrics.timed('checkout')
+@with_latest_data
+def checkout(inventory, cart, discount=0, expected_versions=None, terminal=None, sync=True):
+    """
+    Sell the whole cart in one go.
+    Every line gets checked first, then stock is reduced, the sale rows are
+    written and the inventory is persisted exactly once. If anything fails
+    we put everything back the way it was, so it's all or nothing.
+    Stock held in other tills' carts doesn't count as available, and if
+    expected_versions is given, products edited since the cart was built
+    (e.g. a price change) cancel the order. This till's reservation gets
+    released once the sale goes through.
+    sync=False skips the fsyncs - only do that if you call flush_pending_writes()
+    before telling anyone the sale went through.
+    Returns (success, message, receipt) - receipt is None if it failed,
+    print it for the receipt text or hand it to save_receipt().
+    """
+    if not cart:
+        return False, "Cart is empty, nothing to checkout.", None
+    
+    terminal = terminal or TERMINAL_ID
+    reservations = _load_reservations()
+    
+    # Check every line before touching anything
+    for pid, qty in cart.items():
+        if pid not in inventory:
+            return False, f"Product '{pid}' not found. Order cancelled.", None
+        if qty <= 0:
+            return False, f"Quantity for {inventory[pid]['name']} has to be at least 1.", None
+        if inventory[pid]['stock'] - _reserved_by_others(reservations, pid, terminal) < qty:
+            return False, f"Not enough {inventory[pid]['name']} in stock! Order cancelled.", None
+        if expected_versions and pid in expected_versions and _product_version(inventory, pid) != expected_versions[pid]:
+            return False, f"{inventory[pid]['name']} was changed on another till. Please scan it again.", None
     
+    sale_time = datetime.now()
+    bill_id = new_bill_id(sale_time)
+    receipt = _build_receipt(inventory, cart, discount, bill_id, sale_time)
+    rows = _sale_rows(inventory, cart, discount, sale_time, bill_id, receipt)
+    
+    # Sale rows go first: if we crash after this the stock on disk is still
+    # the old one, so we never end up with stock reduced and no sale for it.
+    # When sales and stock share a SQLite database it's all one transaction,
+    # committed with the stock below.
+    same_transaction = getattr(inventory, 'database', None) is getattr(_sales_log(), 'database', False)
     try:
-        with open(SALES_FILE, 'r', newline='') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if row and row[0] == date_string:
-                    total += float(row[3])  # This counts the whole bill multiple times if multiple items
+        sales_versions = _append_sale_rows(rows, sale_time, sync and not same_transaction)
     except Exception as e:
-        print(f"Had trouble reading sales data: {e}")
+        metrics.count('save_failures_total', file='sales')
+        return False, f"Couldn't record the sale ({e}). Order cancelled.", None
     
-    return total
+    old_stock = {pid: inventory[pid]['stock'] for pid in cart}
+    try:
+        for pid, qty in cart.items():
+            inventory[pid]['stock'] -= qty
+        if getattr(inventory, 'persists_in_place', False):
+            _sync_in_place(inventory, len(cart), sync)
+        else:
+            _append_journal([_journal_record(inventory, pid) for pid in cart], sync)
+    except Exception as e:
+        _restore_stock(inventory, old_stock)
+        try:
+            _undo_sale_rows(sale_time, sales_versions[0])
+        except Exception as undo_error:
+            print(f"CRITICAL: Couldn't undo the sales log entry: {undo_error}")
+            metrics.count('save_failures_total', file='sales_undo')
+        metrics.count('save_failures_total', file='products')
+        return False, f"Couldn't update the inventory ({e}). Order cancelled.", None
+    
+    _add_sale_to_summary(rows, sale_time, sales_versions, save=sync)
+    _update_stock_index(inventory, cart)
+    if terminal in reservations:
+        del reservations[terminal]
+        _save_reservations(reservations)
+    _maybe_compact(inventory)
+    metrics.count('checkouts_total')
+    return True, "Sale recorded!", receipt
 
-def get_low_stock_products(inventory, threshold=5):
-    """Find products that are running low"""
-    low_stock = []
-    for pid, item in inventory.items():
-        if item['stock'] <= threshold:
-            low_stock.append((pid, item))
+def _restore_stock(inventory, old_stock):
+    for pid, stock in old_stock.items():
+        inventory[pid]['stock'] = stock
+
+def _load_reservations():
+    """Open carts from every till, minus the ones that timed out"""
+    try:
+        with open(RESERVATIONS_FILE, 'r') as f:
+            reservations = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    now = time.time()
+    return {terminal: held for terminal, held in reservations.items()
+            if held.get('expires', 0) > now}
+
+def _save_reservations(reservations):
+    # No fsync: after a crash the carts are gone anyway
+    with atomic_writer(RESERVATIONS_FILE, sync=False) as f:
+        json.dump(reservations, f)
+
+def _reserved_by_others(reservations, pid, terminal):
+    return sum(held['items'].get(pid, 0) for other, held in reservations.items()
+               if other != terminal)
+
+@with_latest_data
+def available_stock(inventory, pid, terminal=None):
+    """How many we can still sell - stock minus what's sitting in other tills' carts"""
+    if pid not in inventory:
+        return 0
+    held = _reserved_by_others(_load_reservations(), pid, terminal or TERMINAL_ID)
+    return max(inventory[pid]['stock'] - held, 0)
+
+@with_latest_data
+def reserve_stock(inventory, pid, quantity, terminal=None):
+    """
+    Hold some stock for this till's cart so other tills can't sell it meanwhile.
+    The hold lasts RESERVATION_TTL seconds (renewed each time we add to the cart)
+    and goes away on checkout or release_reservations().
+    Returns (success, message).
+    """
+    if pid not in inventory:
+        return False, "Product not found."
     
-    return low_stock
+    terminal = terminal or TERMINAL_ID
+    reservations = _load_reservations()
+    mine = reservations.setdefault(terminal, {'expires': 0, 'items': {}})
+    free = (inventory[pid]['stock'] - _reserved_by_others(reservations, pid, terminal)
+            - mine['items'].get(pid, 0))
+    if quantity > free:
+        return False, f"Only {max(free, 0)} {inventory[pid]['name']} free right now (the rest is in other carts)."
+    
+    mine['items'][pid] = mine['items'].get(pid, 0) + quantity
+    mine['expires'] = time.time() + RESERVATION_TTL
+    try:
+        _save_reservations(reservations)
+    except Exception as e:
+        return False, f"Couldn't reserve stock: {e}"
+    return True, f"Holding {mine['items'][pid]} {inventory[pid]['name']} for this cart."
 
-def create_bill_text(inventory, cart, discount_percent=0):
-    """Generate a nice-looking receipt"""
-    now = datetime.now()
-    lines = []
+def release_reservations(terminal=None):
+    """Let go of everything this till's cart was holding"""
+    terminal = terminal or TERMINAL_ID
+    with data_lock():
+        reservations = _load_reservations()
+        if reservations.pop(terminal, None) is not None:
+            _save_reservations(reservations)
+
+@metrics.timed('migrate_sales_log')
+def migrate_sales_log(inventory=None):
+    """
+    Move the old single sales.csv (date, product, qty, whole bill total) into
+    the per-day files. Consecutive rows with the same date and total were one
+    bill, so we split that total over its lines - by current price if we know
+    all of them, otherwise by quantity. The old file is kept as sales.csv.migrated.
+    Returns how many rows got moved.
+    """
+    if not os.path.exists(SALES_FILE):
+        return 0
     
-    lines.append("RECEIPT")
-    lines.append("=" * 50)
-    lines.append(f"Date: {now.strftime('%Y-%m-%d %H:%M:%S')}")
-    lines.append("")
-    lines.append(f"{'Item':20} {'Qty':>4} {'Price':>9} {'Total':>10}")
-    lines.append("-" * 50)
+    bills = []
+    with open(SALES_FILE, 'r', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 4:
+                continue
+            try:
+                day, pid, qty, total = row[0], row[1], int(row[2]), to_cents(row[3])
+            except (ValueError, ArithmeticError):
+                continue
+            if bills and bills[-1][0] == day and bills[-1][1] == total:
+                bills[-1][2].append((pid, qty))
+            else:
+                bills.append((day, total, [(pid, qty)]))
+    
+    by_day = {}
+    for number, (day, total, lines) in enumerate(bills, start=1):
+        if inventory is not None and all(pid in inventory for pid, _ in lines):
+            weights = [to_cents(inventory[pid]['price']) * qty for pid, qty in lines]
+        else:
+            weights = [qty for _, qty in lines]
+        
+        rows = []
+        for (pid, qty), line_total in zip(lines, spread(total, weights)):
+            unit_price = (line_total * 2 + qty) // (qty * 2) if qty else 0
+            rows.append([f"{day} 00:00:00", f"legacy-{number:06d}", pid, qty, unit_price, line_total])
+        by_day.setdefault(day, []).append(rows)
     
-    subtotal = 0.0
+    moved = 0
+    log = _sales_log()
+    for day, day_bills in by_day.items():
+        for rows in day_bills:
+            log.append(day, rows, sync=False)
+            moved += len(rows)
+    log.sync()
     
-    for pid, quantity in cart.items():
-        product = inventory[pid]
-        item_total = product['price'] * quantity
-        subtotal += item_total
+    os.replace(SALES_FILE, SALES_FILE + '.migrated')
+    print(f"Moved {moved} old sales rows into the sales log")
+    return moved
+
+@metrics.timed('migrate_to_sqlite')
+def migrate_to_sqlite():
+    """
+    Copy the products (products.csv + journal, or products.dat) and every
+    sale from the day files into SQLITE_FILE. Then set PRODUCT_STORE and
+    SALES_STORE to 'sqlite' to use it. The CSV files are left alone.
+    Returns (products, sale rows) copied, or None if the database already
+    has data in it.
+    """
+    with data_lock():
+        database = _database()
+        target = SQLiteInventory(database)
+        sales = SQLiteSalesLog(database)
+        if len(target) or sales.days():
+            print(f"{SQLITE_FILE} already has data in it, not copying anything")
+            return None
         
-        # Truncate long names
-        name = product['name']
-        if len(name) > 20:
-            name = name[:17] + "..."
+        if PRODUCT_STORE == 'mmap' and os.path.exists(PRODUCTS_STORE_FILE):
+            source = MappedInventory(PRODUCTS_STORE_FILE)
+        else:
+            source = _load_csv_inventory(verbose=False)
+        try:
+            target.put_many((pid, item['name'], item['price'], item['stock'])
+                            for pid, item in source.items())
+            product_count = len(source)
+        finally:
+            if isinstance(source, MappedInventory):
+                source.close()
         
-        lines.append(f"{name:20} {quantity:4} {product['price']:9.2f} {item_total:10.2f}")
+        # One day at a time, a bill's rows kept together
+        row_count = 0
+        csv_log = CsvSalesLog(SALES_FOLDER)
+        for day, path in sorted(csv_log.partitions().items()):
+            bills = []
+            for row in csv_log.rows(day, day):
+                if bills and bills[-1][-1][1] == row.bill_id:
+                    bills[-1].append(row)
+                else:
+                    bills.append([row])
+                row_count += 1
+            if bills:
+                sales.append_many(day, bills, sync=False)
+        database.commit()
+    print(f"Copied {product_count} products and {row_count} sale rows into {SQLITE_FILE}")
+    return product_count, row_count
+
+# --- Report engine ---
+# Reports are chains of generators, so only one sale row is in memory at a
+# time however long the history gets:
+#     sales_rows(start, end) -> where(...) -> total_by(...) -> top(...)
+# sales_rows only reads the days inside the date range, the rest of the
+# history doesn't even get touched.
+
+def _as_day(value):
+    """A date, datetime or 'YYYY-MM-DD' string as 'YYYY-MM-DD' (None stays None)"""
+    if value is None or isinstance(value, str):
+        if value is not None:
+            datetime.strptime(value, '%Y-%m-%d')  # complain about bad dates
+        return value
+    return value.strftime('%Y-%m-%d')
+
+def sale_day(row):
+    return row.timestamp[:10]
+
+def sales_rows(start=None, end=None):
+    """Every sale line between start and end (days, both included), oldest day first"""
+    start, end = _as_day(start), _as_day(end)
+    yield from _sales_log().rows(start, end)
+
+def where(rows, product_id=None, bill_id=None, predicate=None):
+    """Only the rows for one product / one bill / that predicate(row) likes"""
+    for row in rows:
+        if product_id is not None and row.product_id != product_id:
+            continue
+        if bill_id is not None and row.bill_id != bill_id:
+            continue
+        if predicate is not None and not predicate(row):
+            continue
+        yield row
+
+def total_by(rows, key, value='line_cents'):
+    """
+    Group rows and add up one field per group, e.g.
+    total_by(rows, 'product_id', 'quantity') or total_by(rows, sale_day).
+    key and value are field names or functions of the row.
+    Only the totals are kept, so memory goes with the number of groups.
+    """
+    get_key = operator.attrgetter(key) if isinstance(key, str) else key
+    get_value = operator.attrgetter(value) if isinstance(value, str) else value
+    totals = {}
+    for row in rows:
+        group = get_key(row)
+        totals[group] = totals.get(group, 0) + get_value(row)
+    return totals
+
+def top(totals, limit):
+    """The `limit` biggest (key, total) pairs, biggest first"""
+    return heapq.nlargest(limit, totals.items(), key=operator.itemgetter(1))
+
+def _amounts(totals):
+    return {key: to_amount(cents) for key, cents in totals.items()}
+
+def _scan_workers():
+    return SCAN_WORKERS or os.cpu_count() or 1
+
+def _day_summaries(start=None, end=None):
+    """
+    (day, {'size', 'cents', 'products'}) for every day with sales from
+    start to end, oldest first, read straight from the sales log (in
+    parallel when it's big).
+    """
+    start, end = _as_day(start), _as_day(end)
+    log = _sales_log()
+    days = [day for day in sorted(log.days())
+            if (not start or day >= start) and (not end or day <= end)]
+    for day, summary in log.summarize_days(days, _scan_workers(), PARALLEL_SCAN_MIN_BYTES):
+        if summary['products']:
+            yield day, summary
+
+@metrics.timed('sales_between')
+def sales_between(start=None, end=None):
+    """Total revenue from start to end (days, both included)"""
+    return to_amount(sum(summary['cents'] for _, summary in _day_summaries(start, end)))
+
+@metrics.timed('daily_totals')
+def daily_totals(start=None, end=None):
+    """Revenue per day, {'YYYY-MM-DD': total}"""
+    return {day: to_amount(summary['cents']) for day, summary in _day_summaries(start, end)}
+
+@metrics.timed('product_revenue')
+def product_revenue(start=None, end=None):
+    """Revenue per product, {product ID: total}"""
+    return _amounts(total_by(sales_rows(start, end), 'product_id'))
+
+@metrics.timed('top_products')
+def top_products(limit=5, start=None, end=None):
+    """Best sellers by quantity in a window, [(product ID, quantity)]"""
+    totals = {}
+    for _, summary in _day_summaries(start, end):
+        for pid, qty in summary['products'].items():
+            totals[pid] = totals.get(pid, 0) + qty
+    return top(totals, limit)
+
+def _empty_sales_summary():
+    # 'size' in each day is the sales log's version of that day, which only
+    # means something to the store that wrote it
+    return {'store': SALES_STORE, 'days': {}, 'products': {}}
+
+def _refresh_sales_summary(summary):
+    """
+    Re-read any days that changed behind our back (their version doesn't
+    match what the summary saw) and drop days that are gone.
+    Returns True if anything changed.
+    """
+    days = summary['days']
+    totals = summary['products']
+    log = _sales_log()
+    versions = log.days()
+    changed = False
+    
+    for day in list(days):
+        if day not in versions:
+            _subtract_products(totals, days.pop(day)['products'])
+            changed = True
+    
+    stale = [day for day, version in versions.items()
+             if day not in days or days[day]['size'] != version]
+    for day, fresh in log.summarize_days(stale, _scan_workers(), PARALLEL_SCAN_MIN_BYTES):
+        if day in days:
+            _subtract_products(totals, days[day]['products'])
+        for pid, qty in fresh['products'].items():
+            totals[pid] = totals.get(pid, 0) + qty
+        days[day] = fresh
+        changed = True
     
-    lines.append("-" * 50)
-    lines.append(f"{'Subtotal:':>43} {subtotal:10.2f}")
+    return changed
+
+def _subtract_products(totals, products):
+    for pid, qty in products.items():
+        left = totals.get(pid, 0) - qty
+        if left > 0:
+            totals[pid] = left
+        else:
+            totals.pop(pid, None)
+
+@metrics.timed('rebuild_sales_summary')
+def rebuild_sales_summary():
+    """
+    Work out the sales summary from scratch by reading every day's file.
+    Use this if the summary file gets lost or messed up.
+    """
+    global _sales_summary, _leaderboard
+    with _summary_lock:
+        _sales_summary = _empty_sales_summary()
+        _leaderboard = None
+        _refresh_sales_summary(_sales_summary)
+        _save_sales_summary()
+        return _sales_summary
+
+def _save_sales_summary():
+    global _summary_dirty, _summary_saved_at
+    try:
+        # One thread at a time, they'd all be writing the same temp file
+        with _summary_lock:
+            _summary_dirty = False
+            _summary_saved_at = time.monotonic()
+            # No fsync, it's only a cache - if it's lost it gets rebuilt from the sales files
+            with atomic_writer(SALES_SUMMARY_FILE, sync=False) as f:
+                # dumps() goes through the C encoder, dump() doesn't
+                size = f.write(json.dumps(_sales_summary, separators=(',', ':')))
+    except Exception as e:
+        print(f"Warning: Couldn't save the sales summary: {e}")
+        metrics.count('save_failures_total', file='summary')
+        return
+    metrics.count('saves_total', file='summary')
+    metrics.count('bytes_written_total', size, file='summary')
+
+@atexit.register
+def _save_summary_if_dirty():
+    if _summary_dirty:
+        _save_sales_summary()
+
+def get_sales_summary():
+    """
+    Per-day revenue and per-product quantity totals.
+    Only the day files that changed behind our back get re-read.
+    """
+    global _sales_summary, _leaderboard
+    with _summary_lock:
+        if _sales_summary is None or _sales_summary.get('store', 'csv') != SALES_STORE:
+            _sales_summary = _empty_sales_summary()
+            _leaderboard = None
+            if os.path.exists(SALES_SUMMARY_FILE):
+                try:
+                    with open(SALES_SUMMARY_FILE, 'r') as f:
+                        loaded = json.load(f)
+                    # Summaries from before money went to cents get rebuilt, and
+                    # so do ones from the other sales store
+                    if ('days' in loaded and 'products' in loaded
+                            and loaded.get('store', 'csv') == SALES_STORE
+                            and all('cents' in entry for entry in loaded['days'].values())):
+                        loaded['store'] = SALES_STORE
+                        _sales_summary = loaded
+                except Exception as e:
+                    print(f"Sales summary looks broken ({e}), rebuilding it")
     
-    if discount_percent > 0:
-        discount_amount = subtotal * (discount_percent / 100)
-        final_total = subtotal - discount_amount
-        lines.append(f"{'Discount (' + str(discount_percent) + '%):':>43} -{discount_amount:10.2f}")
-        lines.append(f"{'Total:':>43} {final_total:10.2f}")
+        if _refresh_sales_summary(_sales_summary):
+            # Totals can go down here (a day file got removed), so rank from scratch
+            _leaderboard = None
+            _save_sales_summary()
+        return _sales_summary
+
+def _get_leaderboard(summary):
+    global _leaderboard
+    if _leaderboard is None:
+        _leaderboard = heapq.nlargest(LEADERBOARD_SIZE, summary['products'].items(),
+                                      key=operator.itemgetter(1))
+    return _leaderboard
+
+def _bump_leaderboard(pid, qty):
+    """
+    A product's all-time quantity just went up to qty, move it up the board.
+    Quantities only go up between rebuilds, so anything off the board can
+    never be ahead of the last one on it.
+    """
+    board = _leaderboard
+    if board is None:
+        return
+    for i, (other, _) in enumerate(board):
+        if other == pid:
+            del board[i]
+            break
     else:
-        final_total = subtotal
-        lines.append(f"{'Total:':>43} {final_total:10.2f}")
+        if len(board) >= LEADERBOARD_SIZE:
+            if qty <= board[-1][1]:
+                return
+            board.pop()
+    i = 0
+    while i < len(board) and board[i][1] >= qty:
+        i += 1
+    board.insert(i, (pid, qty))
+
+def _add_sale_to_summary(rows, sale_time, versions, save=True):
+    """
+    Fold one sale into the summary (versions = the day's version before and
+    after the sale, from the sales log).
+    The file gets saved at most every SUMMARY_SAVE_INTERVAL seconds;
+    save=False leaves it to flush_pending_writes().
+    """
+    global _summary_dirty
+    with _summary_lock:
+        summary = get_sales_summary() if _sales_summary is None else _sales_summary
+        day = sale_time.strftime('%Y-%m-%d')
+        entry = summary['days'].get(day)
     
-    lines.append("=" * 50)
-    lines.append("Thank you for your business!")
+        if (entry['size'] if entry else 0) != versions[0]:
+            # Either we just re-read the file (so the sale is already in there) or
+            # the summary was behind anyway - the next report will catch up
+            return
+        if entry is None:
+            entry = summary['days'][day] = {'size': 0, 'cents': 0, 'products': {}}
     
-    return "\n".join(lines), final_total
+        totals = summary['products']
+        for row in rows:
+            pid, qty = row[2], row[3]
+            entry['cents'] += row[5]
+            entry['products'][pid] = entry['products'].get(pid, 0) + qty
+            totals[pid] = totals.get(pid, 0) + qty
+            _bump_leaderboard(pid, totals[pid])
+        entry['size'] = versions[1]
+        if save and time.monotonic() - _summary_saved_at >= SUMMARY_SAVE_INTERVAL:
+            _save_sales_summary()
+        else:
+            _summary_dirty = True
+
+@metrics.timed('get_daily_sales')
+def get_daily_sales(date_string):
+    """
+    How much money did we make on a specific day?
+    Comes from the summary; sales_between(day, day) reads the file instead.
+    """
+    with _summary_lock:
+        entry = get_sales_summary()['days'].get(date_string)
+        return to_amount(entry['cents']) if entry else 0.0
+
+@metrics.timed('get_low_stock_products')
+def get_low_stock_products(inventory, threshold=5):
+    """Find products with stock at or below threshold, lowest first"""
+    index = get_stock_index(inventory)
+    return [(pid, inventory[pid]) for pid in index.at_or_below(threshold)]
+
+@metrics.timed('get_reorder_list')
+def get_reorder_list(inventory):
+    """Products at or below their own reorder point, lowest stock first"""
+    index = get_stock_index(inventory)
+    return [(pid, inventory[pid]) for pid in index.low()]
+
+@metrics.timed('reorder_analysis')
+def reorder_analysis(inventory, end=None, window=None):
+    """
+    Sales velocity, days of cover and a suggested order for every product
+    (see reorder.py), going by the `window` days of sales up to end
+    (default VELOCITY_DAYS up to today). Comes from the sales summary.
+    """
+    end = _as_day(end) or datetime.now().strftime('%Y-%m-%d')
+    window = window or VELOCITY_DAYS
+    products = []
+    stock = []
+    for pid, item in inventory.items():
+        products.append(pid)
+        stock.append(item['stock'])
+    with _summary_lock:
+        summary_days = get_sales_summary()['days']
+        matrix = SalesMatrix.from_summary(summary_days, products, end, window)
+        # A shop that's only been selling for a week shouldn't have its sales spread over 4 weeks
+        first = min((day for day in summary_days if day <= end), default=end)
+    selling_days = (datetime.strptime(end, '%Y-%m-%d') - datetime.strptime(first, '%Y-%m-%d')).days + 1
+    return analyze(matrix, stock, window, LEAD_TIME_DAYS, REORDER_COVER_DAYS, selling_days)
+
+def get_reorder_suggestions(inventory, limit=None):
+    """
+    [(pid, stock, units/day, days of cover, suggested order)] for what
+    should be ordered now, the products running out soonest first
+    """
+    return reorder_analysis(inventory).needing_order(limit)
+
+def get_reorder_point(pid):
+    return _load_reorder_points().get(pid, DEFAULT_REORDER_POINT)
+
+def _load_promotions():
+    """The promotions in PROMOTIONS_FILE, compiled - re-read when somebody changes the file"""
+    global _promotions, _promotions_mtime, _promotions_checked_at
+    now = time.monotonic()
+    if _promotions is not None and now - _promotions_checked_at < PROMOTIONS_CHECK_INTERVAL:
+        return _promotions
+    _promotions_checked_at = now
+    try:
+        mtime = os.stat(PROMOTIONS_FILE).st_mtime_ns
+    except OSError:
+        mtime = None
+    if _promotions is None or mtime != _promotions_mtime:
+        rules = []
+        if mtime is not None:
+            try:
+                rules = load_rules(PROMOTIONS_FILE)
+            except Exception as e:
+                print(f"Warning: Couldn't read the promotions ({e}), selling at full price")
+        engine = PromotionEngine(rules, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        for n, rule_id, problem in engine.errors:
+            print(f"Warning: Skipping promotion {rule_id or f'#{n}'} in {PROMOTIONS_FILE}: {problem}")
+        _promotions, _promotions_mtime = engine, mtime
+    return _promotions
+
+def get_active_promotions(when=None):
+    """The promotions that are on right now (or at `when`)"""
+    return _load_promotions().active(when or datetime.now())
+
+def _build_receipt(inventory, cart, discount_percent=0, bill_id=None, when=None):
+    when = when or datetime.now()
+    items = []
+    for pid, qty in cart.items():
+        item = inventory[pid]
+        items.append((pid, item['name'], qty, to_cents(item['price'])))
+    promotions = _load_promotions()
+    line_discounts = None
+    if promotions.rules:
+        line_discounts = promotions.price_cart([(pid, qty, price) for pid, _, qty, price in items], when)
+    return Receipt(bill_id, when, items, discount_percent, line_discounts=line_discounts)
+
+@metrics.timed('create_bill_text')
+def create_bill_text(inventory, cart, discount_percent=0, bill_id=None):
+    """Generate a nice-looking receipt, promotions and all (the layout lives in receipts.py)"""
+    receipt = _build_receipt(inventory, cart, discount_percent, bill_id)
+    return receipt.text, to_amount(receipt.total_cents)
+
+def receipts_from_log(inventory, start=None, end=None):
+    """
+    Rebuild the receipts for past bills from the sales log, one at a time.
+    Names come from the current inventory, since the log only has IDs, and
+    the discount % is worked back out from the totals (on small bills it
+    can come out a hundredth off, the totals are always right). The log
+    doesn't say which promotions there were, so they're in that % too.
+    """
+    bill_id, rows = None, []
+    for row in itertools.chain(sales_rows(start, end), [None]):
+        if row is not None and row.bill_id == bill_id:
+            rows.append(row)
+            continue
+        if rows:
+            yield _receipt_from_rows(inventory, rows)
+        if row is not None:
+            bill_id, rows = row.bill_id, [row]
+
+def _receipt_from_rows(inventory, rows):
+    items = [(row.product_id,
+              inventory[row.product_id]['name'] if row.product_id in inventory else "(deleted product)",
+              row.quantity, row.unit_cents)
+             for row in rows]
+    subtotal = sum(row.unit_cents * row.quantity for row in rows)
+    total = sum(row.line_cents for row in rows)
+    # The log has the line totals after the discount, so work the % back out -
+    # the simplest one that gives the same total is the one the cashier typed
+    discount_percent = 0
+    if subtotal and total < subtotal:
+        exact = (subtotal - total) / subtotal * 100
+        for places in (0, 1, 2):
+            guess = round(exact, places)
+            if percent_of(subtotal, guess) == subtotal - total:
+                discount_percent = int(guess) if places == 0 else guess
+                total = None   # spot on, so work the numbers out exactly like checkout did
+                break
+        else:
+            discount_percent = round(exact, 2)
+    when = datetime.strptime(rows[0].timestamp, '%Y-%m-%d %H:%M:%S')
+    return Receipt(rows[0].bill_id, when, items, discount_percent, total)
+
+def receipt_archive():
+    """The receipt archive in BILLS_FOLDER (opened once, shared)"""
+    folder = os.path.join(BILLS_FOLDER, 'archive')
+    archive = _receipt_archives.get(folder)
+    if archive is None:
+        archive = _receipt_archives[folder] = ReceiptArchive(folder, compress=COMPRESS_RECEIPTS)
+    return archive
+
+def save_receipt(receipt, fmt='txt'):
+    """
+    Save a receipt as 'txt', 'csv' (one row per item) or 'json' under its
+    bill ID - into the receipt archive, or with RECEIPT_STORE = 'files' as
+    its own file. It gets written in the background; returns where it went.
+    """
+    if RECEIPT_STORE == 'archive':
+        return _receipt_writer.archive(receipt, receipt_archive(), fmt)
+    return _receipt_writer.save(receipt, BILLS_FOLDER, fmt)
+
+def get_saved_receipt(bill_id, fmt=None):
+    """A saved receipt's text (from the archive, else its file), or None"""
+    content = receipt_archive().get(bill_id, fmt)
+    if content is not None:
+        return content
+    for name in ([fmt] if fmt else ['txt', 'csv', 'json']):
+        path = os.path.join(BILLS_FOLDER, f"receipt_{bill_id}.{name}")
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                return f.read()
+    return None
+
+def list_saved_receipts(start=None, end=None):
+    """[(date, bill ID, format)] in the archive between start and end (days, both included)"""
+    return receipt_archive().list(_as_day(start), _as_day(end))
+
+def migrate_receipts(delete=False):
+    """
+    Pack the receipt files in BILLS_FOLDER into the archive. delete=True
+    removes the files once they're safely in. Returns (archived, skipped).
+    """
+    flush_receipts()
+    return migrate_receipt_files(BILLS_FOLDER, receipt_archive(), delete)
+
+def flush_receipts():
+    """Wait until every receipt handed to save_receipt() is on disk"""
+    _receipt_writer.flush()
+
+def rerender_receipts(inventory, fmt='txt', start=None, end=None):
+    """Write the receipt file for every bill in the sales log between start and end"""
+    count = 0
+    for receipt in receipts_from_log(inventory, start, end):
+        save_receipt(receipt, fmt)
+        count += 1
+    flush_receipts()
+    return count
 
 def save_bill_file(filename, content):
     """Save a bill/receipt to a file"""
@@ -265,4 +1878,5 @@ def save_bill_file(filename, content):
         with open(filename, 'w', encoding='utf-8') as f:
             f.write(content)
     except Exception as e:
-        print(f"Failed to save receipt: {e}")
\ No newline at end of file
+        print(f"Failed to save receipt: {e}")
+        metrics.count('save_failures_total', file='receipt')
\ No newline at end of file
@@ -0,0 +1,153 @@
+# batch.py
+"""
+Headless mode: orders come in as a stream instead of through the menus -
+from a barcode queue, a script, or a day's sales replayed for load
+testing. `python main.py --batch orders.jsonl` (or `--batch -` for stdin).
+
+One order per line as JSON:
+
+    {"cart": {"P001": 2, "P002": 1}, "discount": 10, "ref": "till-3/0042"}
+
+or CSV with a row per item, where rows next to each other with the same
+Order make up one order (Bill ID works too, so a sales log day file
+replays as it is - pick an older day, today's file grows while it's read):
+
+    Order,Product ID,Quantity,Discount
+
+Every order goes through backend.checkout(), same checks as at the till,
+on the one inventory that stays loaded. They're done BATCH_SIZE at a time
+with one fsync per batch, like the server does, and a batch's results
+only get written out once it's on disk.
+
+The output is a JSON line per order (stdout unless told otherwise) and
+run_batch() hands back the totals, orders/sec included. Anything else
+backend prints on the way (warnings) goes to stderr, so the results
+can be piped straight into something that reads them.
+"""
+
+import contextlib
+import csv
+import itertools
+import json
+import sys
+import time
+
+import backend
+from money import to_amount
+
+BATCH_SIZE = 64   # orders per fsync
+
+def _open_input(path):
+    if path == '-':
+        return contextlib.nullcontext(sys.stdin)
+    return open(path, 'r', newline='', encoding='utf-8')
+
+def _parse_order(data):
+    """An order dict from the input -> (cart, discount). Raises ValueError if it's no good."""
+    cart = data.get('cart')
+    if not isinstance(cart, dict) or not cart:
+        raise ValueError("no cart")
+    cart = {str(pid): int(qty) for pid, qty in cart.items()}
+    discount = float(data.get('discount') or 0)
+    if not 0 <= discount <= 100:
+        raise ValueError("discount has to be between 0 and 100")
+    return cart, discount
+
+def read_json_orders(f):
+    """(line number, ref, cart, discount, error) for each line of JSON lines"""
+    for line_no, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError("expected a JSON object")
+            cart, discount = _parse_order(data)
+        except (ValueError, TypeError, AttributeError) as e:
+            yield line_no, None, None, 0, f"Bad order: {e}"
+            continue
+        yield line_no, data.get('ref'), cart, discount, None
+
+def read_csv_orders(f):
+    """Same as read_json_orders(), for CSV with a row per item"""
+    reader = csv.DictReader(f)
+    fields = reader.fieldnames or []
+    order_column = 'Order' if 'Order' in fields else 'Bill ID'
+    if order_column not in fields or 'Product ID' not in fields or 'Quantity' not in fields:
+        yield 1, None, None, 0, "Bad header: needs Order (or Bill ID), Product ID and Quantity"
+        return
+    rows = enumerate(reader, start=2)
+    for ref, group in itertools.groupby(rows, key=lambda item: item[1][order_column]):
+        group = list(group)
+        line_no = group[0][0]
+        cart = {}
+        try:
+            for _, row in group:
+                pid = (row['Product ID'] or '').strip()
+                if not pid:
+                    raise ValueError("missing Product ID")
+                cart[pid] = cart.get(pid, 0) + int(row['Quantity'])
+            cart, discount = _parse_order({'cart': cart, 'discount': group[0][1].get('Discount')})
+        except (ValueError, TypeError) as e:
+            yield line_no, ref, None, 0, f"Bad order: {e}"
+            continue
+        yield line_no, ref, cart, discount, None
+
+def _run_orders(inventory, batch):
+    """Check out one batch while holding the data lock, then fsync it once"""
+    results = []
+    with backend.data_lock():
+        for line_no, ref, cart, discount, error in batch:
+            result = {'line': line_no, 'ref': ref}
+            if error:
+                result.update(ok=False, error=error)
+                results.append(result)
+                continue
+            try:
+                success, message, receipt = backend.checkout(inventory, cart, discount, sync=False)
+            except Exception as e:
+                success, message, receipt = False, f"Checkout failed: {e}", None
+            result.update(ok=success, message=message)
+            if receipt:
+                result.update(bill_id=receipt.bill_id, total=to_amount(receipt.total_cents))
+            results.append(result)
+        try:
+            backend.flush_pending_writes(inventory)
+        except Exception as e:
+            # Not on disk, so none of them count as done
+            for result in results:
+                if result['ok']:
+                    result.update(ok=False, message=f"Couldn't save the sale: {e}")
+                    result.pop('bill_id', None)
+                    result.pop('total', None)
+    return results
+
+def run_batch(inventory, path, fmt=None, out=None, batch_size=BATCH_SIZE):
+    """
+    Run every order in path ('-' = stdin) and write the results to out
+    (default stdout). fmt is 'jsonl' or 'csv', by default going by the
+    file's extension. Returns the totals as a dict. While it runs, stdout
+    is stderr for everybody else.
+    """
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+    out = out or sys.stdout
+    totals = {'orders': 0, 'ok': 0, 'refused': 0, 'bad_lines': 0}
+    start = time.perf_counter()
+    with _open_input(path) as f, contextlib.redirect_stdout(sys.stderr):
+        orders = read_csv_orders(f) if fmt == 'csv' else read_json_orders(f)
+        while True:
+            batch = list(itertools.islice(orders, batch_size))
+            if not batch:
+                break
+            for result in _run_orders(inventory, batch):
+                if 'error' in result:
+                    totals['bad_lines'] += 1
+                else:
+                    totals['orders'] += 1
+                    totals['ok' if result['ok'] else 'refused'] += 1
+                out.write(json.dumps(result) + '\n')
+    out.flush()
+    elapsed = time.perf_counter() - start
+    totals['seconds'] = round(elapsed, 3)
+    totals['orders_per_sec'] = round(totals['orders'] / elapsed, 1) if elapsed else 0.0
+    return totals
@@ -0,0 +1,1803 @@
+# benchmark.py
+"""
+Quick benchmarks for the slow bits of the shop system.
+Run e.g. `python benchmark.py search --products 100000`
+Everything runs on made-up data, nothing touches the real shop files.
+"""
+
+import argparse
+import contextlib
+import csv
+import http.client
+import io
+import json
+import math
+import multiprocessing
+import os
+import random
+import socket
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import backend
+import batch
+import frontend
+import metrics
+from inventory import Inventory
+from money import to_cents
+from product_store import MappedInventory, import_products_csv
+from receipt_archive import ReceiptArchive, migrate_receipt_files
+from receipts import Receipt, render_text
+import reorder
+from promotions import PromotionEngine
+from server import ShopService
+from storage import SALES_HEADER, CsvSalesLog
+
+WORDS = ['apple', 'banana', 'cable', 'charger', 'laptop', 'phone', 'case',
+         'mouse', 'keyboard', 'monitor', 'desk', 'lamp', 'pen', 'paper',
+         'bottle', 'water', 'juice', 'coffee', 'tea', 'rice', 'soap', 'towel']
+
+def fake_products(count, seed=42):
+    """(product ID, name, price, stock) for `count` made-up products, one at a time"""
+    rng = random.Random(seed)
+    for i in range(count):
+        name = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+        yield (f"P{i:07d}", f"{name} {rng.choice(string.ascii_uppercase)}{rng.randint(1, 999)}",
+               round(rng.uniform(0.5, 500), 2), rng.randint(0, 200))
+
+def make_inventory(count, seed=42):
+    """A fake inventory with `count` products"""
+    return {pid: {'name': name, 'price': price, 'stock': stock}
+            for pid, name, price, stock in fake_products(count, seed)}
+
+def write_products_csv(path, count, seed=42):
+    """products.csv with `count` made-up products, written as they're made up"""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(backend.PRODUCT_COLUMNS)
+        writer.writerows(fake_products(count, seed))
+
+def use_folder(folder):
+    """Point all of backend's files into a scratch folder"""
+    backend.PRODUCTS_FILE = os.path.join(folder, 'products.csv')
+    backend.PRODUCTS_STORE_FILE = os.path.join(folder, 'products.dat')
+    backend.JOURNAL_FILE = os.path.join(folder, 'products.journal')
+    backend.SALES_FILE = os.path.join(folder, 'sales.csv')
+    backend.SALES_FOLDER = os.path.join(folder, 'sales')
+    backend.SALES_SUMMARY_FILE = os.path.join(folder, 'sales_summary.json')
+    backend.LOCK_FILE = os.path.join(folder, 'shop.lock')
+    backend.RESERVATIONS_FILE = os.path.join(folder, 'reservations.json')
+    backend.REORDER_POINTS_FILE = os.path.join(folder, 'reorder_points.json')
+    backend.PROMOTIONS_FILE = os.path.join(folder, 'promotions.json')
+    backend.SQLITE_FILE = os.path.join(folder, 'shop.db')
+    backend.BILLS_FOLDER = os.path.join(folder, 'receipts')
+    os.makedirs(backend.SALES_FOLDER, exist_ok=True)
+    os.makedirs(backend.BILLS_FOLDER, exist_ok=True)
+
+def _time_it(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+def bench_search(args):
+    inventory = make_inventory(args.products)
+    rng = random.Random(1)
+    query_sets = {
+        'word': [rng.choice(WORDS)[:rng.randint(3, 6)] for _ in range(args.queries)],
+        'word + code': [f"{rng.choice(WORDS)} {rng.choice(string.ascii_uppercase)}{rng.randint(1, 99)}"
+                        for _ in range(args.queries)],
+        'product ID': [f"P{rng.randrange(args.products):07d}" for _ in range(args.queries)],
+    }
+
+    start = time.perf_counter()
+    backend.get_search_index(inventory)
+    build_time = time.perf_counter() - start
+
+    print(f"{args.products} products, {args.queries} queries per kind")
+    print(f"  index build: {build_time * 1000:.1f} ms")
+    print(f"  {'query kind':14} {'scan ms':>10} {'index ms':>10} {'top 20 ms':>10} {'speedup':>8}")
+    for kind, queries in query_sets.items():
+        # Make sure we didn't change what the search finds
+        for q in queries:
+            assert backend.find_products(inventory, q) == backend._scan_products(inventory, q), q
+
+        per_query = 1000 / len(queries)
+        scan = _time_it(lambda: [backend._scan_products(inventory, q) for q in queries], 1)
+        indexed = _time_it(lambda: [backend.find_products(inventory, q) for q in queries], 1)
+        limited = _time_it(lambda: [backend.find_products(inventory, q, limit=20, rank=True)
+                                    for q in queries], 1)
+        print(f"  {kind:14} {scan * per_query:10.3f} {indexed * per_query:10.3f} "
+              f"{limited * per_query:10.3f} {scan / indexed:7.1f}x")
+
+def bench_memory(args):
+    source = make_inventory(args.products)
+    # Same ID/name strings in every version, so we only measure what differs.
+    # Prices and stock stay as text and get converted like load_inventory does.
+    rows = [(pid, item['name'], str(item['price']), str(item['stock']))
+            for pid, item in source.items()]
+    del source
+
+    def build_dicts():
+        return {pid: {'name': name, 'price': float(price), 'stock': int(stock)}
+                for pid, name, price, stock in rows}
+
+    def build(storage):
+        def go():
+            inventory = Inventory(storage)
+            for pid, name, price, stock in rows:
+                inventory.put(pid, name, float(price), int(stock))
+            return inventory
+        return go
+
+    print(f"{args.products} products (names/IDs not counted, they're the same everywhere)")
+    print(f"  {'storage':16} {'bytes/SKU':>10} {'lookup ns':>10}")
+    pids = [row[0] for row in rows[::max(1, len(rows) // 10000)]]
+    for label, builder in [('dict of dicts', build_dicts),
+                           ('slots', build('slots')),
+                           ('arrays', build('arrays'))]:
+        tracemalloc.start()
+        inventory = builder()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        lookup = _time_it(lambda: [inventory[pid]['stock'] for pid in pids], 5)
+        print(f"  {label:16} {size / len(rows):10.1f} {lookup / len(pids) * 1e9:10.1f}")
+        del inventory
+
+def bench_startup(args):
+    with tempfile.TemporaryDirectory() as folder:
+        use_folder(folder)
+        csv_path = backend.PRODUCTS_FILE
+        dat_path = backend.PRODUCTS_STORE_FILE
+        backend.save_inventory(make_inventory(args.products))
+        import_products_csv(csv_path, dat_path)
+        some_pid = f"P{args.products // 2:07d}"
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            inventory = backend.load_inventory()
+            csv_load = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store = MappedInventory(dat_path)
+        mmap_open = time.perf_counter() - start
+        start = time.perf_counter()
+        store[some_pid]['stock']
+        first_lookup = time.perf_counter() - start
+        start = time.perf_counter()
+        store[some_pid]['stock'] -= 1
+        store.sync()
+        stock_write = time.perf_counter() - start
+        store.close()
+
+        start = time.perf_counter()
+        inventory[some_pid]['stock'] -= 1
+        backend.save_inventory(inventory)
+        csv_write = time.perf_counter() - start
+
+    print(f"{args.products} products")
+    print(f"  products.csv load:             {csv_load * 1000:10.2f} ms")
+    print(f"  products.dat open:             {mmap_open * 1000:10.2f} ms")
+    print(f"  products.dat first lookup:     {first_lookup * 1000:10.2f} ms (builds the ID index)")
+    print(f"  stock update, full csv save:   {csv_write * 1000:10.2f} ms")
+    print(f"  stock update, in place + sync: {stock_write * 1000:10.2f} ms")
+
+def _stress_worker(folder, terminal, orders, products, seed, results):
+    """One till hammering the shared data folder with orders"""
+    try:
+        results.put(_stress_orders(folder, terminal, orders, products, seed))
+    except Exception as e:
+        results.put(e)
+
+def _stress_orders(folder, terminal, orders, products, seed):
+    use_folder(folder)
+    backend.TERMINAL_ID = terminal
+    rng = random.Random(seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        inventory = backend.load_inventory()
+        sold = {}
+        done = refused = 0
+        for _ in range(orders):
+            cart = {}
+            for pid in rng.sample(products, rng.randint(1, 3)):
+                qty = rng.randint(1, 3)
+                # Half the orders go through the reserve-then-checkout flow
+                if rng.random() < 0.5 and not backend.reserve_stock(inventory, pid, qty)[0]:
+                    continue
+                cart[pid] = qty
+            ok, _, _ = backend.checkout(inventory, cart)
+            if ok:
+                done += 1
+                for pid, qty in cart.items():
+                    sold[pid] = sold.get(pid, 0) + qty
+            else:
+                refused += 1
+                backend.release_reservations()
+    return done, refused, sold
+
+def bench_stress(args):
+    """Several processes checking out against the same files - nothing may go missing"""
+    with tempfile.TemporaryDirectory() as folder:
+        use_folder(folder)
+        backend.PRODUCT_STORE = backend.SALES_STORE = args.storage
+        backend.JOURNAL_COMPACT_AT = args.compact_at
+        # Little stock on purpose, so the tills fight over the last few items
+        inventory = {f"S{i:03d}": {'name': f"item {i}", 'price': 1.0 + i, 'stock': args.stock}
+                     for i in range(args.products)}
+        backend.save_inventory(inventory)
+        products = list(inventory)
+
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_stress_worker,
+                                           args=(folder, f"till-{n}", args.orders, products, n, results))
+                   for n in range(args.tills)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        outcomes = [results.get(timeout=600) for _ in workers]
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        errors = [o for o in outcomes if isinstance(o, Exception)]
+        if errors:
+            print(f"FAILED - {len(errors)} tills crashed: {errors[0]!r}")
+            raise SystemExit(1)
+
+        sold = {}
+        for _, _, worker_sold in outcomes:
+            for pid, qty in worker_sold.items():
+                sold[pid] = sold.get(pid, 0) + qty
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            final = backend.load_inventory()
+        logged = {}
+        for row in backend.sales_rows():
+            logged[row.product_id] = logged.get(row.product_id, 0) + row.quantity
+
+        problems = []
+        for pid in products:
+            if final[pid]['stock'] < 0:
+                problems.append(f"{pid} oversold: stock {final[pid]['stock']}")
+            if final[pid]['stock'] + sold.get(pid, 0) != args.stock:
+                problems.append(f"{pid} lost an update: {final[pid]['stock']} left, {sold.get(pid, 0)} sold")
+            if logged.get(pid, 0) != sold.get(pid, 0):
+                problems.append(f"{pid} sales log says {logged.get(pid, 0)}, tills say {sold.get(pid, 0)}")
+
+    done = sum(o[0] for o in outcomes)
+    refused = sum(o[1] for o in outcomes)
+    print(f"{args.tills} tills x {args.orders} orders on {args.products} products ({args.storage})")
+    print(f"  checkouts: {done} ok, {refused} refused (out of stock / held by another till)")
+    print(f"  throughput: {done / elapsed:.1f} checkouts/s over {elapsed:.2f} s")
+    if problems:
+        print(f"  FAILED - {len(problems)} problems:")
+        for problem in problems[:20]:
+            print(f"    {problem}")
+        raise SystemExit(1)
+    print("  OK - no oversells, no lost updates, sales log matches stock")
+
+def make_sales_log(rows, days, products, seed=7):
+    """Fill backend.SALES_FOLDER with `rows` made-up sale lines spread over `days` days"""
+    rng = random.Random(seed)
+    log = CsvSalesLog(backend.SALES_FOLDER)
+    # Every (product, quantity) line ending made up front, it's 10M rows...
+    endings = []
+    for i in range(products):
+        price = round(rng.uniform(0.5, 500), 2)
+        endings.extend(f"P{i:07d},{qty},{price},{round(price * qty, 2)}\n" for qty in range(1, 6))
+    first = datetime(2024, 1, 1)
+    per_day = rows // days
+    for d in range(days):
+        day = first + timedelta(days=d)
+        count = per_day + (1 if d < rows % days else 0)
+        stamps = [f"{day:%Y-%m-%d} {hour:02d}:00:00" for hour in range(24)]
+        lines = [f"{stamps[n * 24 // count]},B{d}-{n // 3},{endings[int(rng.random() * len(endings))]}"
+                 for n in range(count)]
+        with open(log.path(f"{day:%Y-%m-%d}"), 'w', newline='') as f:
+            # No checksum column, like the files from before sales got checksummed
+            f.write(','.join(SALES_HEADER[:6]) + '\n')
+            f.writelines(lines)
+    return first, first + timedelta(days=days - 1)
+
+def bench_reports(args):
+    """The generator report engine over a big made-up sales log"""
+    with tempfile.TemporaryDirectory() as folder:
+        use_folder(folder)
+        start = time.perf_counter()
+        first, last = make_sales_log(args.rows, args.days, args.products)
+        print(f"{args.rows} sale rows over {args.days} days, {args.products} products "
+              f"(generated in {time.perf_counter() - start:.1f} s)")
+
+        week = (last - timedelta(days=6), last)
+        reports = [
+            ('daily totals, all days', lambda: backend.daily_totals()),
+            ('revenue per product', lambda: backend.product_revenue()),
+            ('top 10, all days', lambda: backend.top_products(10)),
+            ('top 10, last 7 days', lambda: backend.top_products(10, *week)),
+            ('total, last 7 days', lambda: backend.sales_between(*week)),
+            ('one day', lambda: backend.sales_between(last, last)),
+        ]
+        print(f"  {'report':24} {'seconds':>9} {'rows/s':>12}")
+        for label, report in reports:
+            start = time.perf_counter()
+            report()
+            elapsed = time.perf_counter() - start
+            if 'last 7' in label:
+                rows = args.rows * 7 // args.days
+            elif label == 'one day':
+                rows = args.rows // args.days
+            else:
+                rows = args.rows
+            print(f"  {label:24} {elapsed:9.3f} {rows / elapsed:12,.0f}")
+
+        # Memory mustn't grow with the log: the peak should be about the
+        # same for a tenth of the days as for all of them
+        for label, end in [('a tenth of the days', first + timedelta(days=max(1, args.days // 10) - 1)),
+                           ('all days', last)]:
+            tracemalloc.start()
+            backend.daily_totals(first, end)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"  peak memory, daily totals over {label}: {peak / 1024:.0f} KiB")
+
+def _float_bill_text(inventory, cart, discount_percent, bill_id):
+    """How create_bill_text did the money before money.py (floats all the way)"""
+    lines = ["RECEIPT", "=" * 50, f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+             f"Bill: {bill_id}", "", f"{'Item':20} {'Qty':>4} {'Price':>9} {'Total':>10}", "-" * 50]
+    subtotal = 0.0
+    for pid, quantity in cart.items():
+        product = inventory[pid]
+        item_total = product['price'] * quantity
+        subtotal += item_total
+        name = product['name']
+        if len(name) > 20:
+            name = name[:17] + "..."
+        lines.append(f"{name:20} {quantity:4} {product['price']:9.2f} {item_total:10.2f}")
+    lines.append("-" * 50)
+    lines.append(f"{'Subtotal:':>43} {subtotal:10.2f}")
+    if discount_percent > 0:
+        discount_amount = subtotal * (discount_percent / 100)
+        final_total = subtotal - discount_amount
+        lines.append(f"{'Discount (' + str(discount_percent) + '%):':>43} -{discount_amount:10.2f}")
+    else:
+        final_total = subtotal
+    lines.append(f"{'Total:':>43} {final_total:10.2f}")
+    lines.append("=" * 50)
+    lines.append("Thank you for your business!")
+    return "\n".join(lines), final_total
+
+def _float_sale_rows(inventory, cart, discount_percent, sale_time, bill_id):
+    """The old float version of backend._sale_rows"""
+    timestamp = sale_time.strftime('%Y-%m-%d %H:%M:%S')
+    factor = 1 - discount_percent / 100
+    rows = [[timestamp, bill_id, pid, qty, inventory[pid]['price'],
+             round(inventory[pid]['price'] * qty * factor, 2)] for pid, qty in cart.items()]
+    subtotal = sum(inventory[pid]['price'] * qty for pid, qty in cart.items())
+    total = round(subtotal * factor, 2)
+    rows[-1][5] = round(total - sum(row[5] for row in rows[:-1]), 2)
+    return rows
+
+def _float_summarize(path):
+    """The old float version of CsvSalesLog.summarize_day"""
+    revenue = 0.0
+    products = {}
+    with open(path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) < 6:
+                continue
+            try:
+                qty = int(row[3])
+                line_total = float(row[5])
+            except ValueError:
+                continue
+            revenue += line_total
+            products[row[2]] = products.get(row[2], 0) + qty
+    return round(revenue, 2)
+
+def bench_money(args):
+    """Integer cents vs the old float code, for checkout and for adding up the log"""
+    inventory = make_inventory(1000)
+    pids = list(inventory)
+    rng = random.Random(3)
+    carts = [({pid: rng.randint(1, 5) for pid in rng.sample(pids, rng.randint(1, 6))},
+              rng.choice([0, 0, 5, 10, 12.5]))
+             for _ in range(args.bills)]
+    now = datetime.now()
+
+    def old_checkout():
+        for cart, discount in carts:
+            _float_bill_text(inventory, cart, discount, 'B1')
+            _float_sale_rows(inventory, cart, discount, now, 'B1')
+
+    def new_checkout():
+        # Like checkout(): one receipt, its text, and the sale rows from it
+        for cart, discount in carts:
+            receipt = backend._build_receipt(inventory, cart, discount, 'B1', now)
+            receipt.text
+            backend._sale_rows(inventory, cart, discount, now, 'B1', receipt)
+
+    old = min(_time_it(old_checkout, 1) for _ in range(3))
+    new = min(_time_it(new_checkout, 1) for _ in range(3))
+    print(f"{args.bills} bills (receipt + sale rows)")
+    print(f"  floats: {old / args.bills * 1e6:8.2f} us/bill")
+    print(f"  cents:  {new / args.bills * 1e6:8.2f} us/bill  ({old / new:.2f}x)")
+
+    with tempfile.TemporaryDirectory() as folder:
+        use_folder(folder)
+        make_sales_log(args.rows, 1, 5000)
+        log = CsvSalesLog(backend.SALES_FOLDER)
+        day, path = next(iter(log.partitions().items()))
+        old = min(_time_it(lambda: _float_summarize(path), 1) for _ in range(3))
+        new = min(_time_it(lambda: log.summarize_day(day), 1) for _ in range(3))
+
+        # How far the float running total (the old summary added up one sale
+        # at a time) ends up from the exact one
+        exact = log.summarize_day(day)['cents']
+        running = 0.0
+        with open(path, newline='') as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in reader:
+                running += float(row[5])
+    print(f"{args.rows} sales log rows (day total + per-product quantities)")
+    print(f"  floats: {old:8.3f} s")
+    print(f"  cents:  {new:8.3f} s  ({old / new:.2f}x)")
+    print(f"  float total off by {abs(running * 100 - exact):.6f} cents before rounding")
+
+def _reset_backend():
+    """Forget everything backend has cached, as if it just started"""
+    backend._sales_summary = None
+    backend._summary_dirty = False
+    backend._leaderboard = None
+    backend._search_indexes.clear()
+    backend._stock_indexes.clear()
+    backend._receipt_archives.clear()
+    backend._promotions = None
+    backend._reorder_points = None
+    if os.path.exists(backend.SALES_SUMMARY_FILE):
+        os.remove(backend.SALES_SUMMARY_FILE)
+
+def _save_in_place(inventory):
+    """How save_inventory wrote products.csv before it went through a temp file"""
+    with open(backend.PRODUCTS_FILE, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(backend.PRODUCT_COLUMNS)
+        for pid, item in inventory.items():
+            writer.writerow([pid, item['name'], item['price'], item['stock']])
+
+def _checkout_threads(inventory, pids, threads, orders):
+    """threads threads doing `orders` checkouts each. Returns the seconds it took."""
+    def till(seed):
+        rng = random.Random(seed)
+        for _ in range(orders):
+            ok, message, _ = backend.checkout(inventory, {rng.choice(pids): 1})
+            if not ok:
+                raise RuntimeError(message)
+    workers = [threading.Thread(target=till, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+def bench_durability(args):
+    """What the crash-safe writes cost, and how much group commit wins back"""
+    with tempfile.TemporaryDirectory() as folder:
+        use_folder(folder)
+        inventory = make_inventory(args.products)
+        in_place = min(_time_it(lambda: _save_in_place(inventory), 1) for _ in range(3))
+        atomic = min(_time_it(lambda: backend.save_inventory(inventory), 1) for _ in range(3))
+        print(f"products.csv save, {args.products} products")
+        print(f"  in place (old):            {in_place * 1000:8.1f} ms")
+        print(f"  temp + fsync + rename:     {atomic * 1000:8.1f} ms")
+
+        # Group commit only pays off when an fsync is slow next to the rest of a checkout
+        with open(os.path.join(folder, 'fsync.test'), 'ab') as f:
+            def write_and_sync():
+                f.write(b'x' * 100)
+                f.flush()
+                os.fsync(f.fileno())
+            fsync = _time_it(write_and_sync, 200)
+        print(f"one small append + fsync on this disk: {fsync * 1e6:.0f} us")
+
+        # Small catalog and no compaction, so it's the checkouts that get timed
+        inventory = make_inventory(1000)
+        for item in inventory.values():
+            item['stock'] = 10 ** 6
+        backend.save_inventory(inventory)
+        backend.JOURNAL_COMPACT_AT = 10 ** 9
+        with contextlib.redirect_stdout(io.StringIO()):
+            inventory = backend.load_inventory()
+        pids = list(inventory)
+        total = args.threads * args.orders
+        print(f"{args.threads} threads x {args.orders} checkouts, every one on disk before it returns")
+        backend.GROUP_COMMIT_WINDOW = args.window
+        for group in (False, True):
+            backend.GROUP_COMMIT = group
+            elapsed = _checkout_threads(inventory, pids, args.threads, args.orders)
+            line = f"  group commit {'on ' if group else 'off'}:  {total / elapsed:8.1f} checkouts/s"
+            if group:
+                syncs = backend._get_group_commit(inventory).syncs
+                line += f"  ({syncs} fsync rounds for {total} checkouts)"
+            print(line)
+        backend.GROUP_COMMIT = False
+
+        # A sale cut off half way, then the check the next startup does
+        path = next(iter(CsvSalesLog(backend.SALES_FOLDER).partitions().values()))
+        with open(path, 'ab') as f:
+            f.write(b'2024-01-01 12:00:00,B1,P0000001,2,1.00,2.00,\r\n2024-01-01 12:00:00,B1,P00')
+        start = time.perf_counter()
+        with backend.data_lock(), contextlib.redirect_stdout(io.StringIO()):
+            fixed = backend.recover_files()
+        print(f"startup recovery: fixed {fixed} file(s) in {(time.perf_counter() - start) * 1000:.2f} ms")
+        _reset_backend()
+
+def _storage_round(args, pids, queries, last):
+    """Load, search, checkout and reports against whatever backend is set up for"""
+    _reset_backend()
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        inventory = backend.load_inventory()
+        results['load'] = time.perf_counter() - start
+        inventory[pids[0]]['stock']   # make sure it's really usable
+
+    some = random.Random(3).sample(pids, min(len(pids), 10000))
+    start = time.perf_counter()
+    for pid in some:
+        inventory[pid]['stock']
+    results['lookup'] = (time.perf_counter() - start) / len(some)
+
+    start = time.perf_counter()
+    for query in queries:
+        backend.find_products(inventory, query, limit=20)
+    results['search'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    backend.get_daily_sales(f"{last:%Y-%m-%d}")   # builds the summary from scratch
+    results['summary'] = time.perf_counter() - start
+    start = time.perf_counter()
+    backend.daily_totals()
+    results['daily'] = time.perf_counter() - start
+    week = (last - timedelta(days=6), last)
+    start = time.perf_counter()
+    backend.product_revenue(*week)
+    results['week'] = time.perf_counter() - start
+
+    rng = random.Random(5)
+    start = time.perf_counter()
+    for _ in range(args.checkouts):
+        cart = {pid: 1 for pid in rng.sample(pids, 3)}
+        ok, message, _ = backend.checkout(inventory, cart)
+        if not ok:
+            raise RuntimeError(message)
+    results['checkout'] = (time.perf_counter() - start) / args.checkouts
+
+    if hasattr(inventory, 'close'):
+        inventory.close()
+    return results
+
+def bench_storage(args):
+    """The CSV files vs SQLite, same data and the same work on both"""
+    with tempfile.TemporaryDirectory() as folder:
+        use_folder(folder)
+        inventory = make_inventory(args.products)
+        for item in inventory.values():
+            item['stock'] = 10 ** 6
+        backend.save_inventory(inventory)
+        _, last = make_sales_log(args.rows, args.days, args.products)
+        pids = list(inventory)
+        rng = random.Random(9)
+        queries = [rng.choice(WORDS)[:rng.randint(3, 5)] for _ in range(args.queries)]
+        del inventory
+
+        backend.PRODUCT_STORE = backend.SALES_STORE = 'csv'
+        csv_results = _storage_round(args, pids, queries, last)
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            backend.migrate_to_sqlite()
+        migrate = time.perf_counter() - start
+        backend.PRODUCT_STORE = backend.SALES_STORE = 'sqlite'
+        sqlite_results = _storage_round(args, pids, queries, last)
+        backend.PRODUCT_STORE = backend.SALES_STORE = 'csv'
+        size = os.path.getsize(backend.SQLITE_FILE)
+        _reset_backend()
+
+    print(f"{args.products} products, {args.rows} sale rows over {args.days} days")
+    print(f"  migration to SQLite: {migrate:.2f} s ({size / 2 ** 20:.0f} MiB database)")
+    print(f"  {'':34} {'csv':>10} {'sqlite':>10}")
+    lines = [
+        ('catalog load', 'load', 1000, 'ms'),
+        ('product lookup by ID', 'lookup', 1e6, 'us'),
+        (f"{args.queries} searches (incl. index build)", 'search', 1000, 'ms'),
+        ('checkout, on disk when it returns', 'checkout', 1000, 'ms'),
+        ('sales summary from scratch', 'summary', 1000, 'ms'),
+        ('daily totals, all days', 'daily', 1000, 'ms'),
+        ('revenue per product, last 7 days', 'week', 1000, 'ms'),
+    ]
+    for label, key, scale, unit in lines:
+        print(f"  {label:34} {csv_results[key] * scale:8.2f}{unit} {sqlite_results[key] * scale:8.2f}{unit}")
+
+def bench_metrics(args):
+    """What the timers cost: an empty function, and a real checkout, with metrics on and off"""
+    def bare():
+        pass
+    wrapped = metrics.timed('bench')(bare)
+
+    print(f"  {'':28} {'plain':>9} {'metrics off':>12} {'metrics on':>11}")
+    calls = args.calls
+    plain = _time_it(lambda: [bare() for _ in range(calls)], 3) / calls
+    costs = []
+    for enabled in (False, True):
+        metrics.ENABLED = enabled
+        costs.append(_time_it(lambda: [wrapped() for _ in range(calls)], 3) / calls)
+    print(f"  {'empty function call (ns)':28} {plain * 1e9:9.0f} {costs[0] * 1e9:12.0f} {costs[1] * 1e9:11.0f}")
+
+    with tempfile.TemporaryDirectory() as folder:
+        use_folder(folder)
+        backend.save_inventory(make_inventory(args.products))
+        with contextlib.redirect_stdout(io.StringIO()):
+            inventory = backend.load_inventory()
+        pids = list(inventory)
+        rng = random.Random(9)
+        times = [0.0, 0.0]
+        # Off and on take turns, so warming up doesn't count against either
+        for _ in range(4):
+            for enabled in (False, True):
+                metrics.ENABLED = enabled
+                carts = [{rng.choice(pids): 1} for _ in range(args.checkouts // 4)]
+                start = time.perf_counter()
+                for cart in carts:
+                    backend.checkout(inventory, cart, sync=False)
+                times[enabled] += (time.perf_counter() - start) / args.checkouts
+        backend.flush_pending_writes(inventory)
+        print(f"  {'checkout, no fsync (us)':28} {'':>9} {times[0] * 1e6:12.1f} {times[1] * 1e6:11.1f}")
+        _reset_backend()
+    metrics.ENABLED = True
+    print()
+    print(metrics.prometheus_text().split('# HELP')[0].rstrip())
+
+def bench_batch(args):
+    """Headless batch mode (batch.py): orders/sec with one fsync per order vs per batch"""
+    rng = random.Random(4)
+    pids = [f"P{i:07d}" for i in range(args.products)]
+    lines = [json.dumps({'cart': {pid: rng.randint(1, 3) for pid in rng.sample(pids, rng.randint(1, 4))},
+                         'discount': rng.choice([0, 0, 5, 10])})
+             for _ in range(args.orders)]
+    print(f"{args.orders} orders on {args.products} products")
+    print(f"  {'batch size':>10} {'orders/s':>10} {'ok':>7} {'refused':>8}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            use_folder(folder)
+            backend.save_inventory(make_inventory(args.products))
+            path = os.path.join(folder, 'orders.jsonl')
+            with open(path, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            with contextlib.redirect_stdout(io.StringIO()):
+                inventory = backend.load_inventory()
+            totals = batch.run_batch(inventory, path, out=io.StringIO(), batch_size=size)
+            print(f"  {size:10} {totals['orders_per_sec']:10,.0f} {totals['ok']:7} {totals['refused']:8}")
+            _reset_backend()
+
+def bench_scan(args):
+    """Parallel sales log scan: summary of every day with 1, 2, 4... worker processes"""
+    with tempfile.TemporaryDirectory() as folder:
+        use_folder(folder)
+        start = time.perf_counter()
+        make_sales_log(args.rows, args.days, args.products)
+        log = CsvSalesLog(backend.SALES_FOLDER)
+        days = sorted(log.days())
+        size = sum(log.days().values())
+        print(f"{args.rows} sale rows over {args.days} days, {size / 2**20:.0f} MiB "
+              f"(generated in {time.perf_counter() - start:.1f} s), {os.cpu_count()} CPU cores")
+        print(f"  {'workers':>8} {'seconds':>9} {'MiB/s':>8} {'speedup':>8}")
+        serial = None
+        for workers in args.workers:
+            start = time.perf_counter()
+            summaries = dict(log.summarize_days(days, workers, 0))
+            elapsed = time.perf_counter() - start
+            if serial is None:
+                serial, expected = elapsed, summaries
+            elif summaries != expected:
+                print(f"  FAILED - {workers} workers came up with different totals")
+                raise SystemExit(1)
+            print(f"  {workers:8} {elapsed:9.2f} {size / 2**20 / elapsed:8.1f} {serial / elapsed:7.2f}x")
+
+def _disk_usage(folder):
+    """(files, bytes of disk they take up) under a folder - whole blocks, not file sizes"""
+    files = size = 0
+    for root, _, names in os.walk(folder):
+        for name in names:
+            files += 1
+            size += os.stat(os.path.join(root, name)).st_blocks * 512
+    return files, size
+
+def bench_archive(args):
+    """A file per receipt vs the receipt archive: writing, looking one up, files and disk used"""
+    rng = random.Random(6)
+    start_day = datetime(2025, 1, 1, 9)
+    receipts = []
+    for n in range(args.receipts):
+        items = [(f"P{i:07d}", f"{rng.choice(WORDS)} {rng.choice(WORDS)}", rng.randint(1, 5), rng.randint(50, 20000))
+                 for i in rng.sample(range(100000), rng.randint(1, 6))]
+        when = start_day + timedelta(seconds=n * 86400 * args.days // args.receipts)
+        receipts.append(Receipt(f"B{n:07d}", when, items, rng.choice([0, 0, 5, 10])))
+    texts = [(r.bill_id, 'txt', r.date, render_text(r)) for r in receipts]
+    lookups = [rng.choice(texts)[0] for _ in range(args.lookups)]
+    print(f"{args.receipts} receipts over {args.days} days, {args.lookups} lookups")
+    print(f"  {'':18} {'write s':>8} {'lookup us':>10} {'files':>7} {'disk MiB':>9}")
+
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        for bill_id, _, _, content in texts:
+            with open(os.path.join(folder, f"receipt_{bill_id}.txt"), 'w', encoding='utf-8') as f:
+                f.write(content)
+        written = time.perf_counter() - start
+        start = time.perf_counter()
+        walks = lookups[:20]   # these are slow
+        for bill_id in walks:
+            # What finding one meant before: go through the folder for it
+            name = next(entry.path for entry in os.scandir(folder) if entry.name == f"receipt_{bill_id}.txt")
+            with open(name, encoding='utf-8') as f:
+                f.read()
+        lookup = (time.perf_counter() - start) / len(walks)
+        files, size = _disk_usage(folder)
+        print(f"  {'files':18} {written:8.2f} {lookup * 1e6:10.0f} {files:7} {size / 2**20:9.1f}")
+
+        archive_folder = os.path.join(folder, 'archive')
+        start = time.perf_counter()
+        migrated, _ = migrate_receipt_files(folder, ReceiptArchive(archive_folder), delete=False)
+        migrate = time.perf_counter() - start
+        assert migrated == len(texts)
+
+    for compress in (False, True):
+        with tempfile.TemporaryDirectory() as folder:
+            archive = ReceiptArchive(folder, compress=compress)
+            start = time.perf_counter()
+            for n in range(0, len(texts), 256):   # the receipt writer's batches
+                archive.add_many(texts[n:n + 256])
+            written = time.perf_counter() - start
+            start = time.perf_counter()
+            archive = ReceiptArchive(folder, compress=compress)
+            opened = time.perf_counter() - start
+            start = time.perf_counter()
+            for bill_id in lookups:
+                archive.get(bill_id)
+            lookup = (time.perf_counter() - start) / len(lookups)
+            start = time.perf_counter()
+            day = archive.list('2025-01-15', '2025-01-15')
+            listed = time.perf_counter() - start
+            files, size = _disk_usage(folder)
+            name = 'archive, zlib' if compress else 'archive'
+            print(f"  {name:18} {written:8.2f} {lookup * 1e6:10.0f} {files:7} {size / 2**20:9.1f}"
+                  f"   (open {opened * 1000:.0f} ms, one day's {len(day)} listed in {listed * 1000:.1f} ms)")
+    print(f"Migrating the {len(texts)} files into an archive took {migrate:.2f} s")
+
+def _fake_summary_days(products, days, per_day, seed=7):
+    """Sales summary 'days' with per_day products sold each day, some selling much faster than others"""
+    rng = random.Random(seed)
+    end = datetime(2025, 12, 31)
+    summary = {}
+    for n in range(days):
+        day = (end - timedelta(days=n)).strftime('%Y-%m-%d')
+        sold = {}
+        for _ in range(per_day):
+            pid = f"P{int(products * rng.random() ** 3):07d}"   # low IDs are the best sellers
+            sold[pid] = sold.get(pid, 0) + rng.randint(1, 4)
+        summary[day] = {'size': 0, 'cents': 0, 'products': sold}
+    return summary, end.strftime('%Y-%m-%d')
+
+def _reorder_by_product(summary_days, products, stock, end, window):
+    """What reorder.analyze() works out, the per-product loop way"""
+    day_list = reorder._day_range(end, window)
+    suggested = []
+    for pid, left in zip(products, stock):
+        sold = [summary_days.get(day, {}).get('products', {}).get(pid, 0) for day in day_list]
+        velocity = sum(sold) / window
+        spread = math.sqrt(max(sum(q * q for q in sold) / window - velocity * velocity, 0.0))
+        point = velocity * backend.LEAD_TIME_DAYS + reorder.SERVICE_Z * spread * math.sqrt(backend.LEAD_TIME_DAYS)
+        wanted = math.ceil(point + velocity * backend.REORDER_COVER_DAYS - left)
+        suggested.append(max(wanted, 0) if velocity > 0 and left <= point else 0)
+    return suggested
+
+def bench_reorder(args):
+    """Reorder analytics over the whole catalog: NumPy, typed arrays, and a loop per product"""
+    start = time.perf_counter()
+    summary_days, end = _fake_summary_days(args.products, args.days, args.per_day)
+    rng = random.Random(8)
+    products = [f"P{i:07d}" for i in range(args.products)]
+    stock = [rng.randint(0, 200) for _ in products]
+    entries = sum(len(entry['products']) for entry in summary_days.values())
+    print(f"{args.products} products x {args.days} days ({entries} product-days with sales, "
+          f"generated in {time.perf_counter() - start:.1f} s)")
+    print(f"  {'':14} {'load s':>8} {'analyze s':>10} {'to order':>9} {'matrix MiB':>11}")
+    has_numpy = reorder.numpy
+    results = {}
+    for name, module in (('numpy', has_numpy), ('typed arrays', None)):
+        if name == 'numpy' and module is None:
+            print(f"  {name:14} (not installed)")
+            continue
+        reorder.numpy = module
+        try:
+            start = time.perf_counter()
+            matrix = reorder.SalesMatrix.from_summary(summary_days, products, end, args.days)
+            loaded = time.perf_counter() - start
+            size = (matrix.rows.nbytes if module else
+                    sum(row.buffer_info()[1] * row.itemsize for row in matrix.rows))
+            start = time.perf_counter()
+            analysis = reorder.analyze(matrix, stock, args.days, backend.LEAD_TIME_DAYS,
+                                       backend.REORDER_COVER_DAYS)
+            to_order = analysis.needing_order()
+            analyzed = time.perf_counter() - start
+        finally:
+            reorder.numpy = has_numpy
+        results[name] = [int(qty) for qty in analysis.suggested]
+        print(f"  {name:14} {loaded:8.2f} {analyzed:10.2f} {len(to_order):9} {size / 2**20:11.0f}")
+        del matrix, analysis
+    if args.loop:
+        start = time.perf_counter()
+        suggested = _reorder_by_product(summary_days, products, stock, end, args.days)
+        elapsed = time.perf_counter() - start
+        print(f"  {'per product':14} {'':8} {elapsed:10.2f} {sum(1 for q in suggested if q):9}")
+        results['per product'] = suggested
+    if len({tuple(r) for r in results.values()}) > 1:
+        print("  FAILED - the suggested orders don't all match")
+        raise SystemExit(1)
+
+def bench_coldlog(args):
+    """Sales log with and without the compressed cold tier: disk used and range query times"""
+    with tempfile.TemporaryDirectory() as folder:
+        use_folder(folder)
+        start = time.perf_counter()
+        first, last = make_sales_log(args.rows, args.days, args.products)
+        print(f"{args.rows} sale rows over {args.days} days (generated in {time.perf_counter() - start:.1f} s)")
+        windows = [('1 day', last, last), ('7 days', last - timedelta(days=6), last),
+                   ('30 days', last - timedelta(days=29), last), ('all time', None, None)]
+        print(f"  {'':16} {'disk MiB':>9}" + ''.join(f" {name + ' ms':>12}" for name, _, _ in windows))
+
+        def measure(name, log):
+            backend._sales_logs.clear()
+            backend._sales_logs[('csv', backend.SALES_FOLDER)] = log
+            expected = []
+            times = []
+            for _, start_day, end_day in windows:
+                begin = time.perf_counter()
+                expected.append(backend.sales_between(start_day, end_day))
+                times.append((time.perf_counter() - begin) * 1000)
+            _, size = _disk_usage(backend.SALES_FOLDER)
+            print(f"  {name:16} {size / 2**20:9.1f}" + ''.join(f" {ms:12.1f}" for ms in times))
+            return expected
+
+        hot = measure('plain day files', CsvSalesLog(backend.SALES_FOLDER))
+        log = CsvSalesLog(backend.SALES_FOLDER, args.keep_days, args.compression)
+        start = time.perf_counter()
+        moved, _, _ = log.rotate(f"{last:%Y-%m-%d}")
+        rotated = time.perf_counter() - start
+        cold = measure(f"{args.compression} cold tier", log)
+        print(f"Compressing {moved} days took {rotated:.1f} s")
+        backend._sales_logs.clear()
+        if hot != cold:
+            print("  FAILED - the totals changed after compressing")
+            raise SystemExit(1)
+
+def fake_promotions(count, products, seed=9):
+    """count made-up promotion rules over the first `products` product IDs, a mix of every kind"""
+    rng = random.Random(seed)
+    rules = []
+    for n in range(count):
+        pids = [f"P{rng.randrange(products):07d}" for _ in range(rng.randint(1, 3))]
+        kind = rng.choice(['markdown', 'markdown', 'bogo', 'bulk'])
+        rule = {'id': f"PROMO-{n}", 'kind': kind, 'products': pids,
+                'start': '2025-01-01', 'end': '2099-12-31'}
+        if kind == 'markdown':
+            rule['percent'] = rng.choice([5, 10, 15, 20, 25])
+        elif kind == 'bogo':
+            rule.update(buy=rng.randint(1, 3), get=1)
+        else:
+            rule['tiers'] = [[5, round(rng.uniform(1, 50), 2)], [10, round(rng.uniform(0.5, 40), 2)]]
+        if rng.random() < 0.2:
+            rule['hours'] = '00:00-23:59'
+        rules.append(rule)
+    return rules
+
+def _price_by_scanning(engine, lines, stamp):
+    """What the engine does, but going through every rule for every line"""
+    discounts = []
+    for pid, qty, unit_cents in lines:
+        unit, best = unit_cents, 0
+        for rule in engine.rules:
+            if rule.kind != 'bogo' and pid in rule.products and rule.active(stamp):
+                unit = min(unit, rule.unit_price(unit_cents, qty))
+        for rule in engine.rules:
+            if rule.kind == 'bogo' and pid in rule.products and rule.active(stamp):
+                best = max(best, rule.free_discount(unit, qty))
+        discounts.append((unit_cents - unit) * qty + best)
+    return discounts
+
+def bench_promotions(args):
+    """Pricing carts against lots of active promotions: the indexed engine vs checking every rule"""
+    rules = fake_promotions(args.rules, args.products)
+    start = time.perf_counter()
+    engine = PromotionEngine(rules)
+    compiled = time.perf_counter() - start
+    rng = random.Random(10)
+    carts = [[(f"P{rng.randrange(args.products):07d}", rng.randint(1, 12), rng.randint(50, 20000))
+              for _ in range(rng.randint(1, 8))] for _ in range(args.carts)]
+    when = datetime(2025, 6, 1, 12)
+    stamp = when.strftime('%Y-%m-%d %H:%M:%S')
+    print(f"{len(engine)} active rules on {args.products} products (compiled in {compiled * 1000:.0f} ms), "
+          f"{args.carts} carts")
+
+    start = time.perf_counter()
+    priced = [engine.price_cart(lines, when) for lines in carts]
+    indexed = (time.perf_counter() - start) / len(carts)
+    print(f"  indexed:        {indexed * 1e6:10.1f} us per cart")
+    scanned_carts = carts[:args.scan_carts]
+    start = time.perf_counter()
+    scanned = [_price_by_scanning(engine, lines, stamp) for lines in scanned_carts]
+    scan = (time.perf_counter() - start) / len(scanned_carts)
+    print(f"  every rule:     {scan * 1e6:10.1f} us per cart ({indexed and scan / indexed:.0f}x slower)")
+    for lines, mine, theirs in zip(scanned_carts, priced, scanned):
+        if [off for off, _ in mine or [(0, None)] * len(lines)] != theirs:
+            print("  FAILED - the two came up with different prices")
+            raise SystemExit(1)
+    touched = sum(1 for discounts in priced if discounts)
+    print(f"  {touched} of {len(carts)} carts got a promotion")
+
+    # The whole create_bill_text with the rules in a promotions file, vs none
+    with tempfile.TemporaryDirectory() as folder:
+        use_folder(folder)
+        inventory = make_inventory(args.products)
+        bills = [{pid: qty for pid, qty, _ in lines} for lines in carts[:1000]]
+        for label, promotions in (('no promotions', []), (f"{len(rules)} rules", rules)):
+            with open(backend.PROMOTIONS_FILE, 'w') as f:
+                json.dump(promotions, f)
+            backend._promotions = None
+            backend._load_promotions()
+            start = time.perf_counter()
+            for cart in bills:
+                backend.create_bill_text(inventory, cart, 5)
+            elapsed = (time.perf_counter() - start) / len(bills)
+            print(f"  create_bill_text, {label + ':':18} {elapsed * 1e6:8.1f} us per bill")
+        _reset_backend()
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _wait_for_server(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/products?limit=1')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server didn't come up")
+
+def _server_client(port, requests, pids, seed, latencies, errors):
+    """One client on a keep-alive connection sending a mix of requests"""
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    today = time.strftime('%Y-%m-%d')
+    for _ in range(requests):
+        roll = rng.random()
+        body = None
+        if roll < 0.35:
+            method, path = 'GET', f"/search?q={rng.choice(WORDS)[:4]}&limit=20&rank=1"
+        elif roll < 0.65:
+            method, path = 'GET', f"/products/{rng.choice(pids)}"
+        elif roll < 0.90:
+            method, path = 'POST', '/checkout'
+            body = json.dumps({'cart': {pid: 1 for pid in rng.sample(pids, rng.randint(1, 3))}})
+        else:
+            method, path = 'GET', rng.choice([f"/reports/daily?date={today}",
+                                               '/reports/low-stock?threshold=5',
+                                               '/reports/top?limit=5'])
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body, {'Content-Type': 'application/json'} if body else {})
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors.append(f"{method} {path}: HTTP {response.status}")
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(f"{method} {path}: {e!r}")
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+def bench_server(args):
+    """Start `main.py --serve` on localhost and throw a mix of requests at it"""
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    with tempfile.TemporaryDirectory() as folder:
+        use_folder(folder)
+        inventory = make_inventory(args.products)
+        for item in inventory.values():
+            item['stock'] = 10 ** 6   # don't run out half way
+        backend.save_inventory(inventory)
+        pids = list(inventory)
+
+        port = _free_port()
+        server = subprocess.Popen([sys.executable, main_py, '--serve', '--port', str(port)],
+                                  cwd=folder, stdout=subprocess.DEVNULL)
+        try:
+            _wait_for_server(port)
+            latencies, errors = [], []
+            clients = [threading.Thread(target=_server_client,
+                                        args=(port, args.requests, pids, n, latencies, errors))
+                       for n in range(args.clients)]
+            start = time.perf_counter()
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print(f"{args.clients} clients x {args.requests} requests, {args.products} products")
+    print(f"  throughput: {len(latencies) / elapsed:.1f} req/s over {elapsed:.2f} s")
+    print(f"  latency:    p50 {percentile(0.50):.2f} ms, p99 {percentile(0.99):.2f} ms, "
+          f"max {latencies[-1] * 1000:.2f} ms")
+    if errors:
+        print(f"  FAILED - {len(errors)} errors, first: {errors[0]}")
+        raise SystemExit(1)
+
+def _get_json(conn, path):
+    conn.request('GET', path)
+    response = conn.getresponse()
+    body = response.read()
+    if response.status != 200:
+        raise RuntimeError(f"GET {path}: HTTP {response.status} {body[:200]!r}")
+    return json.loads(body)
+
+def _stress_buyer(port, orders, pids, seed, sold, errors):
+    """Checkouts one after another, remembering what went through"""
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        for _ in range(orders):
+            cart = {pid: rng.randint(1, 3) for pid in rng.sample(pids, rng.randint(1, 3))}
+            conn.request('POST', '/checkout', json.dumps({'cart': cart}), {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            result = json.loads(response.read())
+            if not result['ok']:
+                errors.append(f"checkout refused: {result['message']}")
+                continue
+            receipt = result['receipt']
+            sold.append((receipt['date'][:10], to_cents(receipt['total']), cart))
+    except Exception as e:
+        errors.append(f"buyer: {e!r}")
+    finally:
+        conn.close()
+
+def _stress_reader(port, limit, stop, errors):
+    """Daily and top reports over and over - the totals must only ever go up"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    last_total = 0
+    last_top = {}
+    try:
+        while not stop.is_set():
+            total = to_cents(_get_json(conn, f"/reports/daily?date={time.strftime('%Y-%m-%d')}")['total'])
+            if total < last_total:
+                errors.append(f"daily total went down from {last_total} to {total} cents")
+            last_total = total
+            top = {p['id']: p['quantity'] for p in _get_json(conn, f"/reports/top?limit={limit}")['products']}
+            for pid, qty in last_top.items():
+                if top.get(pid, 0) < qty:
+                    errors.append(f"{pid} went down from {qty} to {top.get(pid, 0)} sold")
+            last_top = top
+    except Exception as e:
+        errors.append(f"reader: {e!r}")
+    finally:
+        conn.close()
+
+_BAD_REQUESTS = [
+    ('POST', '/checkout', {'cart': {'P1': None}}),
+    ('POST', '/checkout', {'cart': {'P1': 1}, 'discount': None}),
+    ('GET', '/reports/top?limit=-3', None),
+    ('GET', '/search?q=a&limit=-1', None),
+]
+
+def _check_bad_requests(port, errors):
+    """Each of _BAD_REQUESTS gets a 400 (not a dropped connection, or an answer)"""
+    for method, path, order in _BAD_REQUESTS:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        try:
+            conn.request(method, path, json.dumps(order) if order else None,
+                         {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            if response.status != 400:
+                errors.append(f"{method} {path} {order or ''}: HTTP {response.status}, not 400")
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(f"{method} {path} {order or ''}: {e!r}")
+        finally:
+            conn.close()
+
+def bench_server_stress(args):
+    """
+    Checkouts and report requests against one server at the same time. The
+    reports must add up to exactly what got sold, and the server mustn't
+    complain about anything (it used to trip over its own summary file).
+    """
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    with tempfile.TemporaryDirectory() as folder:
+        use_folder(folder)
+        inventory = make_inventory(args.products)
+        for item in inventory.values():
+            item['stock'] = 10 ** 6
+        backend.save_inventory(inventory)
+        pids = list(inventory)
+
+        port = _free_port()
+        log_path = os.path.join(folder, 'server.log')
+        with open(log_path, 'w') as log:
+            server = subprocess.Popen([sys.executable, main_py, '--serve', '--port', str(port)],
+                                      cwd=folder, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            _wait_for_server(port)
+            sold, errors = [], []
+            stop = threading.Event()
+            buyers = [threading.Thread(target=_stress_buyer, args=(port, args.orders, pids, n, sold, errors))
+                      for n in range(args.buyers)]
+            readers = [threading.Thread(target=_stress_reader, args=(port, args.products, stop, errors))
+                       for _ in range(args.readers)]
+            start = time.perf_counter()
+            for thread in buyers + readers:
+                thread.start()
+            for thread in buyers:
+                thread.join()
+            stop.set()
+            for thread in readers:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            by_day, quantities = {}, {}
+            for day, cents, cart in sold:
+                by_day[day] = by_day.get(day, 0) + cents
+                for pid, qty in cart.items():
+                    quantities[pid] = quantities.get(pid, 0) + qty
+            for day, cents in by_day.items():
+                reported = to_cents(_get_json(conn, f"/reports/daily?date={day}")['total'])
+                if reported != cents:
+                    errors.append(f"daily report for {day} says {reported} cents, receipts add up to {cents}")
+            top = {p['id']: p['quantity'] for p in
+                   _get_json(conn, f"/reports/top?limit={args.products}")['products']}
+            if top != quantities:
+                wrong = [pid for pid in set(top) | set(quantities) if top.get(pid) != quantities.get(pid)]
+                errors.append(f"top sellers are off for {len(wrong)} products, e.g. {wrong[0]}: "
+                              f"report {top.get(wrong[0])}, sold {quantities.get(wrong[0])}")
+            conn.close()
+            _check_bad_requests(port, errors)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        with open(log_path) as log:
+            complaints = [line.strip() for line in log if "Couldn't" in line or 'Warning' in line]
+
+    print(f"{args.buyers} buyers x {args.orders} orders with {args.readers} report readers, "
+          f"{args.products} products")
+    print(f"  checkouts: {len(sold)} ok in {elapsed:.2f} s")
+    problems = errors + [f"server said: {line}" for line in complaints]
+    if problems:
+        print(f"  FAILED - {len(problems)} problems:")
+        for problem in problems[:20]:
+            print(f"    {problem}")
+        raise SystemExit(1)
+    print("  OK - reports match the receipts, nothing went down, bad requests refused, no errors from the server")
+
+# --- Correctness checks ---
+# Small scenarios that went wrong once, each on made-up data in its own
+# scratch folder. `python benchmark.py check` runs them all. A check
+# returns None when everything's fine, otherwise what went wrong.
+
+def check_reorder_points_from_another_till():
+    """Low stock alerts keep firing after another till edits reorder_points.json"""
+    inventory = backend.load_inventory()
+    for pid in 'ABC':
+        backend.add_new_product(inventory, pid, f"item {pid}", 1.0, 20)
+    alerts = []
+    backend.on_low_stock(inventory, lambda pid, item, point: alerts.append(pid))
+
+    # Another till gives C a reorder point of 10 (and a new mtime, however coarse the clock)
+    with open(backend.REORDER_POINTS_FILE, 'w') as f:
+        json.dump({'C': 10}, f)
+    stamp = time.time() + 5
+    os.utime(backend.REORDER_POINTS_FILE, (stamp, stamp))
+
+    # Anything but get_stock_index() first, so nothing would rebuild a dropped index
+    backend.remove_product(inventory, 'B')
+    ok, message, _ = backend.checkout(inventory, {'C': 12})
+    if not ok:
+        return f"checkout failed: {message}"
+    if alerts != ['C']:
+        return f"C went from 20 to 8 with reorder point 10, alerts: {alerts}"
+    if [pid for pid, _ in backend.get_reorder_list(inventory)] != ['C']:
+        return "C isn't on the reorder list"
+    return None
+
+def _other_till(folder, store, compact):
+    """Another till process: change P1's price (and fold the journal in after, if compact)"""
+    use_folder(folder)
+    backend.PRODUCT_STORE = store
+    with contextlib.redirect_stdout(io.StringIO()):
+        inventory = backend.load_inventory()
+        backend.modify_product(inventory, 'P1', new_price=2.0)
+        if compact:
+            backend.compact_journal(inventory)
+
+def _version_check(store, compact=False):
+    backend.PRODUCT_STORE = store
+    folder = os.path.dirname(backend.PRODUCTS_FILE)
+    backend.save_inventory({'P1': {'name': 'item 1', 'price': 1.0, 'stock': 10},
+                            'P2': {'name': 'item 2', 'price': 1.0, 'stock': 10}})
+    inventory = backend.load_inventory()
+    for pid in ('P1', 'P2'):
+        backend.modify_product(inventory, pid, new_stock=9)   # so they have a version to start with
+    seen = backend.get_version(inventory, 'P1')
+    untouched = backend.get_version(inventory, 'P2')
+
+    till = multiprocessing.Process(target=_other_till, args=(folder, store, compact))
+    till.start()
+    till.join()
+    if till.exitcode:
+        return "the other till crashed"
+    ok, _ = backend.modify_product(inventory, 'P1', new_price=3.0, expected_version=seen)
+    if ok:
+        return f"{store}: an edit based on the old version went through"
+    if backend.checkout(inventory, {'P1': 1}, 0, {'P1': seen})[0]:
+        return f"{store}: a checkout at the old price went through"
+    ok, message = backend.modify_product(inventory, 'P1', new_price=3.0,
+                                         expected_version=backend.get_version(inventory, 'P1'))
+    if not ok:
+        return f"{store}: an edit based on the latest version got refused: {message}"
+    ok, message = backend.modify_product(inventory, 'P2', new_price=3.0, expected_version=untouched)
+    if not ok:
+        return f"{store}: an edit to a product nobody else touched got refused: {message}"
+    return None
+
+def check_versions_csv():
+    """expected_version catches another till's edit (CSV store)"""
+    return _version_check('csv')
+
+def check_versions_csv_compacted():
+    """...even when the other till folded the journal into products.csv right after"""
+    return _version_check('csv', compact=True)
+
+def check_versions_mmap():
+    """...and on the mmap store"""
+    return _version_check('mmap')
+
+def check_versions_sqlite():
+    """...and on the SQLite store"""
+    return _version_check('sqlite')
+
+def _other_till_sells(folder, store):
+    """Another till process: add a product and sell A1 down to 1"""
+    use_folder(folder)
+    backend.PRODUCT_STORE = store
+    with contextlib.redirect_stdout(io.StringIO()):
+        inventory = backend.load_inventory()
+        backend.add_new_product(inventory, 'N1', 'new widget', 1.0, 10)
+        backend.checkout(inventory, {'A1': 9})
+
+def _indexes_check(store):
+    backend.PRODUCT_STORE = store
+    folder = os.path.dirname(backend.PRODUCTS_FILE)
+    backend.save_inventory({'A1': {'name': 'item 1', 'price': 1.0, 'stock': 10}})
+    inventory = backend.load_inventory()
+    alerts = []
+    backend.on_low_stock(inventory, lambda pid, item, point: alerts.append(pid))
+    backend.find_products(inventory, 'widget')   # so there's a search index to go stale
+
+    till = multiprocessing.Process(target=_other_till_sells, args=(folder, store))
+    till.start()
+    till.join()
+    if till.exitcode:
+        return "the other till crashed"
+    backend.get_version(inventory, 'A1')   # anything that catches up with the other tills
+    if [pid for pid, _ in backend.find_products(inventory, 'widget')] != ['N1']:
+        return f"{store}: the other till's new product doesn't turn up in a search"
+    if [pid for pid, _ in backend.get_low_stock_products(inventory)] != ['A1']:
+        return f"{store}: A1 is down to {inventory['A1']['stock']} but not on the low stock report"
+    if [pid for pid, _ in backend.get_reorder_list(inventory)] != ['A1']:
+        return f"{store}: A1 isn't on the reorder list"
+    if alerts != ['A1']:
+        return f"{store}: low stock alerts: {alerts}"
+    return None
+
+def check_other_tills_changes_csv():
+    """Search and low stock keep up with another till's changes (CSV store)"""
+    return _indexes_check('csv')
+
+def check_other_tills_changes_mmap():
+    """...and on the mmap store"""
+    return _indexes_check('mmap')
+
+def check_other_tills_changes_sqlite():
+    """...and on the SQLite store"""
+    return _indexes_check('sqlite')
+
+def check_group_commit_sync_by_position():
+    """checkout(..., False) skips the group commit fsync just like sync=False"""
+    inventory = backend.load_inventory()
+    backend.add_new_product(inventory, 'P1', 'item 1', 1.0, 10)
+    commits = []
+    real = backend._get_group_commit
+    backend.GROUP_COMMIT = True
+    backend._get_group_commit = lambda inv: commits.append(inv) or real(inv)
+    try:
+        backend.checkout(inventory, {'P1': 1}, 0, None, None, False)
+        backend.flush_pending_writes(inventory)
+        by_position = len(commits)
+        backend.checkout(inventory, {'P1': 1})
+    finally:
+        backend.GROUP_COMMIT = False
+        backend._get_group_commit = real
+    if by_position:
+        return "sync=False passed by position still did the group commit"
+    if len(commits) != 1:
+        return "a normal checkout didn't do the group commit"
+    return None
+
+def check_no_compressing_on_checkout():
+    """The first sale of a day doesn't compress old days, only startup and compress_sales_log do"""
+    inventory = backend.load_inventory()
+    backend.add_new_product(inventory, 'P1', 'item 1', 1.0, 10)
+    backend.checkout(inventory, {'P1': 1})
+    log = backend._sales_log()
+    today = datetime.now().strftime('%Y-%m-%d')
+    old = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+    os.replace(log.path(today), log.path(old))   # so today's next sale starts a new file
+
+    ok, message, _ = backend.checkout(inventory, {'P1': 1})
+    if not ok:
+        return f"checkout failed: {message}"
+    if log.manifest():
+        return f"the checkout compressed {sorted(log.manifest())}"
+    if backend.compress_sales_log()[0] != 1 or old not in log.manifest():
+        return "compress_sales_log didn't compress the old day"
+    return None
+
+def check_import_same_product_twice():
+    """A new product's second row in an import is an update, however big the chunks"""
+    inventory = backend.load_inventory()
+    path = os.path.join(os.path.dirname(backend.PRODUCTS_FILE), 'feed.csv')
+    with open(path, 'w', newline='') as f:
+        f.write("Product ID,Name,Price,Stock Quantity\n"
+                "N1,new item,2.50,10\n"
+                "N1,,,25\n")
+    results = {}
+    for chunk_size in (1, 1000):
+        ok, message, errors = backend.import_products(inventory, path, dry_run=True, chunk_size=chunk_size)
+        results[chunk_size] = message
+        if errors:
+            return f"dry run with chunks of {chunk_size} refused: {errors}"
+    if len(set(results.values())) != 1:
+        return f"dry runs depend on the chunk size: {results}"
+    ok, message, errors = backend.import_products(inventory, path, chunk_size=1000)
+    if errors or not ok:
+        return f"the import refused: {errors or message}"
+    if 'N1' not in inventory or inventory['N1']['stock'] != 25:
+        return "N1 didn't end up with the second row's stock"
+    return None
+
+def check_failed_journal_write_undone():
+    """A checkout whose journal fsync fails leaves neither the sale nor the stock change behind"""
+    inventory = backend.load_inventory()
+    backend.add_new_product(inventory, 'P1', 'item 1', 1.0, 10)
+    real = backend._take_unsynced
+    def failing_fsync(changes, sync):
+        raise OSError("disk on fire")
+    backend._take_unsynced = failing_fsync
+    try:
+        ok, _, _ = backend.checkout(inventory, {'P1': 3})
+    finally:
+        backend._take_unsynced = real
+    if ok:
+        return "the checkout went through anyway"
+
+    _reset_backend()
+    inventory = backend.load_inventory()
+    sold = backend.get_daily_sales(datetime.now().strftime('%Y-%m-%d'))
+    if inventory['P1']['stock'] != 10:
+        return f"after a restart P1 has {inventory['P1']['stock']} in stock, not 10"
+    if sold:
+        return f"after a restart the sales log has {sold} for today"
+    return None
+
+def check_unconfirmed_server_checkout():
+    """A server checkout whose fsync fails doesn't get reported as not sold (it was)"""
+    inventory = backend.load_inventory()
+    backend.add_new_product(inventory, 'P1', 'item 1', 1.0, 10)
+    service = ShopService(inventory)
+    real = backend.flush_pending_writes
+    def failing_flush(inventory=None):
+        raise OSError("disk on fire")
+    backend.flush_pending_writes = failing_flush
+    try:
+        success, message, receipt = service.checkout({'P1': 3}, 0)
+    finally:
+        backend.flush_pending_writes = real
+        service.close()
+    if success is not None:
+        return f"the server answered {success!r}: {message}"
+    if receipt is None or inventory['P1']['stock'] != 7:
+        return "the sale didn't come with its receipt, or the stock isn't down"
+    return None
+
+def check_batch_output_only_results():
+    """Warnings backend prints during a batch don't end up among its JSON lines"""
+    inventory = backend.load_inventory()
+    backend.add_new_product(inventory, 'P1', 'item 1', 1.0, 10)
+    with open(backend.PROMOTIONS_FILE, 'w') as f:
+        f.write("not JSON")   # the first checkout warns about it
+    path = os.path.join(os.path.dirname(backend.PRODUCTS_FILE), 'orders.jsonl')
+    with open(path, 'w') as f:
+        f.write('{"cart": {"P1": 1}}\n{"cart": {"P1": 2}}\n')
+
+    with contextlib.redirect_stdout(io.StringIO()) as out, contextlib.redirect_stderr(io.StringIO()) as err:
+        batch.run_batch(inventory, path)
+    for line in out.getvalue().splitlines():
+        try:
+            json.loads(line)
+        except ValueError:
+            return f"not a result in the output: {line!r}"
+    if 'promotions' not in err.getvalue():
+        return "the promotions warning didn't go to stderr"
+    return None
+
+def check_reorder_point_typos():
+    """A typo'd or negative reorder point gets asked for again, not a crash or a saved -2"""
+    answers = iter(['5a', '-2', '', '7'])
+    frontend.input = lambda prompt: next(answers)   # in front of the builtin, for frontend only
+    try:
+        kept = frontend.get_optional_count_input("Reorder at: ")
+        point = frontend.get_optional_count_input("Reorder at: ")
+    finally:
+        del frontend.input
+    if (kept, point) != (None, 7):
+        return f"the answers came back as {kept!r} and {point!r}"
+
+    inventory = backend.load_inventory()
+    backend.add_new_product(inventory, 'P1', 'item 1', 1.0, 10)
+    if backend.modify_product(inventory, 'P1', reorder_point=-2)[0]:
+        return "modify_product took a reorder point of -2"
+    return None
+
+CHECKS = [check_reorder_points_from_another_till, check_versions_csv, check_versions_csv_compacted,
+          check_versions_mmap, check_versions_sqlite, check_other_tills_changes_csv,
+          check_other_tills_changes_mmap, check_other_tills_changes_sqlite, check_group_commit_sync_by_position,
+          check_no_compressing_on_checkout, check_import_same_product_twice,
+          check_failed_journal_write_undone, check_unconfirmed_server_checkout,
+          check_batch_output_only_results, check_reorder_point_typos]
+
+def bench_check(args):
+    """Run every check in CHECKS"""
+    failed = 0
+    for check in CHECKS:
+        with tempfile.TemporaryDirectory() as folder:
+            use_folder(folder)
+            _reset_backend()
+            backend._low_stock_callbacks.clear()
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    problem = check()
+            except Exception as e:
+                problem = f"crashed: {e!r}"
+            _reset_backend()
+            backend.PRODUCT_STORE = 'csv'
+            for database in backend._databases.values():
+                database.close()
+            backend._databases.clear()
+            backend._sales_logs.clear()
+        name = check.__name__[len('check_'):]
+        if problem:
+            failed += 1
+            print(f"  FAILED {name}: {problem}")
+        else:
+            print(f"  ok     {name}")
+    if failed:
+        raise SystemExit(1)
+
+# --- The regression suite ---
+# `python benchmark.py suite --save before.json`, change something, then
+# `python benchmark.py suite --compare before.json`: every backend
+# operation that got slower by more than --threshold gets flagged and the
+# exit code is 1, so a script can catch it.
+
+SUITE_SCALES = {            # products, sale rows
+    'small': (1000, 10000),
+    'medium': (100000, 1000000),
+    'large': (1000000, 10000000),
+}
+SUITE_THRESHOLD = 0.20      # 20% slower than the saved run counts as a regression
+
+def _suite_case(results, name, func, items, repeat):
+    """
+    Time func (best of `repeat` runs, untraced - the best run is the one
+    with the least noise from everything else on the machine) and then run
+    it once more under tracemalloc for the peak memory. items is how many
+    things one run handles, for the throughput.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    seconds = times[0]
+    results[name] = {
+        'seconds': seconds,
+        'median': times[len(times) // 2],
+        'items': items,
+        'per_second': items / seconds if seconds else None,
+        'peak_kib': peak / 1024,
+    }
+    print(f"  {name:28} {seconds * 1000:11.2f} {items / seconds if seconds else 0:14,.0f} {peak / 1024:11,.0f}")
+
+def run_suite(products, rows, days, queries, bills, repeat):
+    """Every timed backend operation on made-up data, as {name: numbers}"""
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        use_folder(folder)
+        _reset_backend()
+        start = time.perf_counter()
+        write_products_csv(backend.PRODUCTS_FILE, products)
+        first, last = make_sales_log(rows, days, products)
+        print(f"{products} products, {rows} sale rows over {days} days "
+              f"(generated in {time.perf_counter() - start:.1f} s)")
+        print(f"  {'operation':28} {'ms':>11} {'items/s':>14} {'peak KiB':>11}")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            inventory = backend.load_inventory()
+        rng = random.Random(5)
+        pids = list(inventory)
+        terms = [rng.choice(WORDS)[:rng.randint(3, 6)] for _ in range(queries)]
+        carts = [{pid: rng.randint(1, 3) for pid in rng.sample(pids, min(len(pids), rng.randint(1, 5)))}
+                 for _ in range(bills)]
+        days_list = [f"{first + timedelta(days=d):%Y-%m-%d}" for d in range(days)]
+        week = (last - timedelta(days=6), last)
+
+        def load():
+            with contextlib.redirect_stdout(io.StringIO()):
+                backend.load_inventory()
+
+        def build_index():
+            backend._search_indexes.clear()
+            backend.get_search_index(inventory)
+
+        def build_summary():
+            backend.rebuild_sales_summary()
+
+        _suite_case(results, 'load_inventory', load, products, repeat)
+        _suite_case(results, 'save_inventory', lambda: backend.save_inventory(inventory), products, repeat)
+        _suite_case(results, 'search index build', build_index, products, repeat)
+        _suite_case(results, 'find_products',
+                    lambda: [backend.find_products(inventory, term) for term in terms], queries, repeat)
+        _suite_case(results, 'create_bill_text',
+                    lambda: [backend.create_bill_text(inventory, cart, 10) for cart in carts], bills, repeat)
+        _suite_case(results, 'sales summary rebuild', build_summary, rows, repeat)
+        _suite_case(results, 'get_daily_sales',
+                    lambda: [backend.get_daily_sales(day) for day in days_list], days, repeat)
+        _suite_case(results, 'get_top_selling_products',
+                    lambda: backend.get_top_selling_products(10), 1, repeat)
+        _suite_case(results, 'top sellers, last 7 days',
+                    lambda: backend.get_top_selling_products(10, *week), 1, repeat)
+        _reset_backend()
+    return results
+
+def compare_results(old, new, threshold):
+    """Print old vs new per operation. Returns the names that got slower than threshold allows."""
+    if old.get('scale') != new['scale']:
+        print(f"Note: the saved run used {old.get('scale')}, this one {new['scale']} - "
+              f"the numbers won't line up")
+    print(f"  {'operation':28} {'before ms':>11} {'now ms':>11} {'change':>8}")
+    slower = []
+    for name, now in new['results'].items():
+        before = old.get('results', {}).get(name)
+        if before is None:
+            print(f"  {name:28} {'-':>11} {now['seconds'] * 1000:11.2f}      new")
+            continue
+        change = now['seconds'] / before['seconds'] - 1 if before['seconds'] else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  SLOWER'
+            slower.append(name)
+        print(f"  {name:28} {before['seconds'] * 1000:11.2f} {now['seconds'] * 1000:11.2f} "
+              f"{change:+8.1%}{flag}")
+    return slower
+
+def bench_suite(args):
+    products, rows = SUITE_SCALES[args.scale]
+    products = args.products or products
+    rows = args.rows or rows
+    results = run_suite(products, rows, args.days, args.queries, args.bills, args.repeat)
+    run = {
+        'when': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'scale': {'products': products, 'rows': rows, 'days': args.days,
+                  'queries': args.queries, 'bills': args.bills},
+        'results': results,
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f"Saved to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print(f"Compared with {args.compare} ({old.get('when', '?')}), threshold {args.threshold:.0%}:")
+        slower = compare_results(old, run, args.threshold)
+        if slower:
+            print(f"  REGRESSION - slower: {', '.join(slower)}")
+            raise SystemExit(1)
+        print("  OK - nothing got slower than the threshold")
+
+def main():
+    parser = argparse.ArgumentParser(description="Shop system benchmarks")
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    p = sub.add_parser('search', help="indexed search vs the old linear scan")
+    p.add_argument('--products', type=int, default=100000)
+    p.add_argument('--queries', type=int, default=200)
+    p.set_defaults(func=bench_search)
+
+    p = sub.add_parser('memory', help="memory per product for each inventory storage")
+    p.add_argument('--products', type=int, default=100000)
+    p.set_defaults(func=bench_memory)
+
+    p = sub.add_parser('startup', help="products.csv load vs opening the mmap product file")
+    p.add_argument('--products', type=int, default=100000)
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser('stress', help="several till processes checking out at once")
+    p.add_argument('--tills', type=int, default=4)
+    p.add_argument('--orders', type=int, default=200)
+    p.add_argument('--products', type=int, default=20)
+    p.add_argument('--stock', type=int, default=100)
+    p.add_argument('--compact-at', type=int, default=50,
+                   help="compact the journal this often, so tills have to reload mid-run")
+    p.add_argument('--storage', choices=['csv', 'sqlite'], default='csv')
+    p.set_defaults(func=bench_stress)
+
+    p = sub.add_parser('reports', help="streaming sales reports over a big sales log")
+    p.add_argument('--rows', type=int, default=10000000)
+    p.add_argument('--days', type=int, default=365)
+    p.add_argument('--products', type=int, default=5000)
+    p.set_defaults(func=bench_reports)
+
+    p = sub.add_parser('scan', help="parallel sales log scan: how it scales with worker processes")
+    p.add_argument('--rows', type=int, default=2000000)
+    p.add_argument('--days', type=int, default=30)
+    p.add_argument('--products', type=int, default=5000)
+    p.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    p.set_defaults(func=bench_scan)
+
+    p = sub.add_parser('archive', help="a file per receipt vs the packed receipt archive")
+    p.add_argument('--receipts', type=int, default=50000)
+    p.add_argument('--days', type=int, default=90)
+    p.add_argument('--lookups', type=int, default=200)
+    p.set_defaults(func=bench_archive)
+
+    p = sub.add_parser('reorder', help="reorder analytics (velocity, days of cover) over the whole catalog")
+    p.add_argument('--products', type=int, default=100000)
+    p.add_argument('--days', type=int, default=365)
+    p.add_argument('--per-day', type=int, default=5000, help="products sold each day")
+    p.add_argument('--loop', action='store_true', help="also time the same thing as a loop per product (slow)")
+    p.set_defaults(func=bench_reorder)
+
+    p = sub.add_parser('coldlog', help="sales log disk use and query time with old days compressed")
+    p.add_argument('--rows', type=int, default=2000000)
+    p.add_argument('--days', type=int, default=365)
+    p.add_argument('--products', type=int, default=10000)
+    p.add_argument('--keep-days', type=int, default=7, help="days left uncompressed")
+    p.add_argument('--compression', choices=['gzip', 'lzma'], default='gzip')
+    p.set_defaults(func=bench_coldlog)
+
+    p = sub.add_parser('promotions', help="pricing carts against 10k active promotion rules")
+    p.add_argument('--rules', type=int, default=10000)
+    p.add_argument('--products', type=int, default=20000)
+    p.add_argument('--carts', type=int, default=10000)
+    p.add_argument('--scan-carts', type=int, default=200, help="carts priced the slow way, for comparison")
+    p.set_defaults(func=bench_promotions)
+
+    p = sub.add_parser('money', help="integer cents vs floats for checkout and totals")
+    p.add_argument('--bills', type=int, default=50000)
+    p.add_argument('--rows', type=int, default=1000000)
+    p.set_defaults(func=bench_money)
+
+    p = sub.add_parser('durability', help="atomic saves and group commit vs plain writes")
+    p.add_argument('--products', type=int, default=100000)
+    p.add_argument('--threads', type=int, default=8)
+    p.add_argument('--orders', type=int, default=200, help="checkouts per thread")
+    p.add_argument('--window', type=float, default=0.0,
+                   help="GROUP_COMMIT_WINDOW, seconds to wait for more threads before an fsync")
+    p.set_defaults(func=bench_durability)
+
+    p = sub.add_parser('storage', help="CSV files vs SQLite: load, search, checkout, reports")
+    p.add_argument('--products', type=int, default=100000)
+    p.add_argument('--rows', type=int, default=1000000)
+    p.add_argument('--days', type=int, default=365)
+    p.add_argument('--queries', type=int, default=200)
+    p.add_argument('--checkouts', type=int, default=200)
+    p.set_defaults(func=bench_storage)
+
+    p = sub.add_parser('metrics', help="what the metrics timers and counters cost")
+    p.add_argument('--calls', type=int, default=200000)
+    p.add_argument('--products', type=int, default=10000)
+    p.add_argument('--checkouts', type=int, default=2000)
+    p.set_defaults(func=bench_metrics)
+
+    p = sub.add_parser('batch', help="headless batch checkouts: orders/sec by batch size")
+    p.add_argument('--orders', type=int, default=5000)
+    p.add_argument('--products', type=int, default=10000)
+    p.add_argument('--sizes', type=int, nargs='+', default=[1, 16, 64, 256])
+    p.set_defaults(func=bench_batch)
+
+    p = sub.add_parser('server', help="requests/sec and latency against `main.py --serve`")
+    p.add_argument('--clients', type=int, default=8)
+    p.add_argument('--requests', type=int, default=500, help="requests per client")
+    p.add_argument('--products', type=int, default=10000)
+    p.set_defaults(func=bench_server)
+
+    p = sub.add_parser('server-stress', help="checkouts and reports against one server at once, checked")
+    p.add_argument('--buyers', type=int, default=6)
+    p.add_argument('--readers', type=int, default=6)
+    p.add_argument('--orders', type=int, default=300, help="checkouts per buyer")
+    p.add_argument('--products', type=int, default=50)
+    p.set_defaults(func=bench_server_stress)
+
+    p = sub.add_parser('check', help="scenarios that went wrong once (reorder points, imports...)")
+    p.set_defaults(func=bench_check)
+
+    p = sub.add_parser('suite', help="time every core backend operation, save/compare JSON results")
+    p.add_argument('--scale', choices=SUITE_SCALES, default='small',
+                   help="small = 1k SKUs/10k rows, medium = 100k/1M, large = 1M/10M")
+    p.add_argument('--products', type=int, help="override the scale's product count")
+    p.add_argument('--rows', type=int, help="override the scale's sale rows")
+    p.add_argument('--days', type=int, default=90)
+    p.add_argument('--queries', type=int, default=200)
+    p.add_argument('--bills', type=int, default=1000)
+    p.add_argument('--repeat', type=int, default=5, help="runs per operation (the best one counts)")
+    p.add_argument('--save', metavar='JSON', help="write the results here")
+    p.add_argument('--compare', metavar='JSON', help="compare with results saved earlier")
+    p.add_argument('--threshold', type=float, default=SUITE_THRESHOLD,
+                   help="how much slower (0.2 = 20%%) counts as a regression")
+    p.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
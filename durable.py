@@ -0,0 +1,214 @@
+# durable.py
+"""
+Writing files so a crash or a power cut can't eat them.
+
+- atomic_writer: write a new copy next to the file, fsync it and rename it
+  over the old one. Whoever reads the file sees the old copy or the new
+  one, never half of each.
+- seal() / sealed_length(): a checksum at the end of each group of CSV
+  lines we append (one sale in the sales log), so after a crash we can
+  tell which groups made it to disk whole and cut off the rest.
+- GroupCommit: lets several threads that wrote at about the same time
+  share one fsync instead of queueing up for one each.
+"""
+
+import contextlib
+import csv
+import os
+import threading
+import time
+import zlib
+
+def fsync_dir(path):
+    """fsync the folder a file is in, so a rename in it survives a crash"""
+    if os.name == 'nt':
+        return   # Windows can't open folders, and its renames are durable anyway
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+@contextlib.contextmanager
+def atomic_writer(path, mode='w', sync=True, **open_args):
+    """
+    with atomic_writer(path) as f: ... - f is a temp file that replaces path
+    once the block finishes. If the block raises, path isn't touched.
+    sync=False skips the fsyncs (fine for caches we can rebuild).
+    """
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, mode, **open_args) as f:
+            yield f
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    if sync:
+        fsync_dir(path)
+
+# --- Checksummed line groups ---
+# Every line in a group has an extra last column. It's empty except on the
+# group's last line, where it holds the CRC32 of the whole group up to and
+# including the comma in front of it.
+
+def checksum(data):
+    return f"{zlib.crc32(data):08x}"
+
+def seal(text):
+    """Fill in the checksum on a group of CSV lines whose last column is still empty"""
+    cut = text.rindex(',') + 1
+    return text[:cut] + checksum(text[:cut].encode('utf-8')) + text[cut:]
+
+def _fields(line):
+    try:
+        return next(csv.reader([line.decode('utf-8')]))
+    except (UnicodeDecodeError, csv.Error, StopIteration):
+        return None
+
+def _is_boundary(line, columns, header):
+    """Does a group (or an old unsealed line) end with this line?"""
+    if line.startswith(header):
+        return True
+    fields = _fields(line.rstrip(b'\r\n'))
+    return fields is not None and (len(fields) == columns - 1 or
+                                   (len(fields) == columns and fields[-1] != ''))
+
+def sealed_length(data, columns, header, start=0):
+    """
+    How much of data (from start, which has to be where a group begins) is
+    whole, checked groups. Lines with one column fewer than `columns` are
+    from before we sealed anything and count on their own; the header line
+    (starts with `header`) too. Everything after the first torn or broken
+    group is bad.
+    """
+    good = group_start = pos = start
+    while pos < len(data):
+        nl = data.find(b'\n', pos)
+        if nl < 0:
+            break   # half a line
+        line_end = nl + 1
+        body = data[pos:line_end].rstrip(b'\r\n')
+        if body.startswith(header):
+            good = group_start = line_end
+            pos = line_end
+            continue
+        fields = _fields(body)
+        if fields is None:
+            break
+        if len(fields) == columns - 1:
+            good = group_start = line_end
+        elif len(fields) == columns and fields[-1] == '':
+            pass   # the group carries on
+        elif len(fields) == columns:
+            cut = pos + body.rindex(b',') + 1
+            if checksum(data[group_start:cut]) != fields[-1]:
+                break
+            good = group_start = line_end
+        else:
+            break
+        pos = line_end
+    return good
+
+def repair_tail(path, columns, header, window=65536):
+    """
+    Cut a torn or broken group off the end of an appended file.
+    Only the end of the file gets read (more if one group is huge).
+    Returns how many bytes got cut.
+    """
+    with open(path, 'r+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        while True:
+            base = max(0, size - window)
+            f.seek(base)
+            data = f.read()
+            start = 0
+            if base:
+                # Find a line that ends a group, the checking starts after it
+                start = None
+                pos = data.find(b'\n') + 1   # skip the line we landed in the middle of
+                while pos and pos < len(data):
+                    nl = data.find(b'\n', pos)
+                    if nl < 0:
+                        break
+                    if _is_boundary(data[pos:nl + 1], columns, header):
+                        start = nl + 1
+                        break
+                    pos = nl + 1
+                if start is None:
+                    window *= 4
+                    continue
+            good = base + sealed_length(data, columns, header, start)
+            if good < size:
+                f.truncate(good)
+                f.flush()
+                os.fsync(f.fileno())
+            return size - good
+
+def repair_partial_line(path):
+    """Cut a half-written last line off a file of lines. Returns bytes cut."""
+    with open(path, 'r+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, size - 65536))
+        data = f.read()
+        if not data or data.endswith(b'\n'):
+            return 0
+        nl = data.rfind(b'\n')
+        if nl < 0 and size > len(data):
+            return 0   # one enormous line, leave it be
+        good = size - len(data) + nl + 1
+        f.truncate(good)
+        f.flush()
+        os.fsync(f.fileno())
+        return size - good
+
+class GroupCommit:
+    """
+    Write your stuff (no fsync), then call commit(): it returns once
+    everything written before the call is on disk.
+    While one thread is busy running sync() the others pile up behind it,
+    and the next sync() covers all of them in one go. window is how long
+    (seconds) a thread waits for company before it syncs.
+    """
+
+    def __init__(self, sync, window=0.0):
+        self._sync = sync
+        self.window = window
+        self._cond = threading.Condition()
+        self._requested = 0   # commit() calls so far
+        self._done = 0        # commit() calls that are on disk
+        self._running = False
+        self.syncs = 0
+
+    def commit(self):
+        with self._cond:
+            self._requested += 1
+            ticket = self._requested
+            while self._done < ticket:
+                if not self._running:
+                    self._running = True
+                    break
+                self._cond.wait()
+            else:
+                return   # somebody else's sync covered us
+
+        done = self._done
+        try:
+            if self.window:
+                time.sleep(self.window)
+            with self._cond:
+                target = self._requested
+            self._sync()
+            self.syncs += 1
+            done = target
+        finally:
+            with self._cond:
+                self._done = max(self._done, done)
+                self._running = False
+                self._cond.notify_all()
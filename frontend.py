@@ -17,10 +17,10 @@ I added some emojis to make it less boring lol.
 Might add colors someday if I figure out how.
 """
 
-import os
-import csv
-from datetime import datetime
-from backend import BILLS_FOLDER, save_bill_file
+from datetime import datetime, timedelta
+from backend import (
+    save_receipt, available_stock, reserve_stock, get_version
+)
 
 def get_float_input(prompt):
     """Keep asking until they give me a proper number"""
@@ -38,13 +38,30 @@ def get_int_input(prompt):
         except ValueError:
             print("I need a whole number here, please.")
 
+def get_optional_count_input(prompt):
+    """A whole number, 0 or more - or None if they just press Enter"""
+    while True:
+        answer = input(prompt).strip()
+        if not answer:
+            return None
+        try:
+            value = int(answer)
+        except ValueError:
+            print("I need a whole number here, please.")
+            continue
+        if value < 0:
+            print("That can't be less than 0.")
+            continue
+        return value
+
 def show_product_menu():
     print("\n--- PRODUCT STUFF ---")
     print("1. Add new product")
     print("2. Change product details")
     print("3. Remove product")
     print("4. Look up products")
-    print("5. Go back")
+    print("5. Bulk import / export")
+    print("6. Go back")
     return input("What do you want to do? ")
 
 def show_order_menu():
@@ -57,9 +74,42 @@ def show_reports_menu():
     print("\n--- REPORTS & STATS ---")
     print("1. See how much we made on a day")
     print("2. Check what's running low")
-    print("3. Back to main menu")
+    print("3. What to reorder (by how fast things sell)")
+    print("4. Top sellers")
+    print("5. Back to main menu")
     return input("Your choice: ")
 
+def ask_sales_window():
+    """
+    Which days a report should cover. Returns (start, end) as 'YYYY-MM-DD'
+    strings, (None, None) for all time, or None if they typed rubbish.
+    """
+    print("1. All time")
+    print("2. Today")
+    print("3. Last 7 days")
+    print("4. Pick the dates")
+    choice = input("Which days? (default 1): ").strip() or '1'
+    today = datetime.now()
+    
+    if choice == '1':
+        return None, None
+    if choice == '2':
+        return today.strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d')
+    if choice == '3':
+        return (today - timedelta(days=6)).strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d')
+    if choice == '4':
+        start = input("From (YYYY-MM-DD): ").strip()
+        end = input("To (YYYY-MM-DD): ").strip()
+        try:
+            datetime.strptime(start, '%Y-%m-%d')
+            datetime.strptime(end, '%Y-%m-%d')
+        except ValueError:
+            print("Invalid date format! Use YYYY-MM-DD")
+            return None
+        return start, end
+    print("Huh? Please pick 1-4")
+    return None
+
 def display_inventory(inventory):
     if not inventory:
         print("Nothing in stock right now. So empty...")
@@ -80,6 +130,29 @@ def display_search_results(results):
     for pid, item in results:
         print(f"{pid:12} {item['name']:20} {item['price']:8.2f} {item['stock']:10}")
 
+def show_bulk_menu():
+    print("\n--- BULK IMPORT / EXPORT ---")
+    print("1. Import products from a CSV")
+    print("2. Apply stock adjustments from a CSV")
+    print("3. Export products to a CSV")
+    print("4. Go back")
+    return input("What do you want to do? ")
+
+def display_bulk_errors(errors, limit=20):
+    """Show the rows a bulk import skipped (just the first few if there's loads)"""
+    if not errors:
+        return
+    print(f"\n{len(errors)} rows had problems:")
+    for line, problem in errors[:limit]:
+        print(f"  line {line}: {problem}")
+    if len(errors) > limit:
+        print(f"  ...and {len(errors) - limit} more")
+
+def alert_low_stock(pid, item, reorder_point):
+    """Goes off when a product drops to its reorder point"""
+    print(f"\n⚠️  Running low: {item['name']} ({pid}) is down to {item['stock']} "
+          f"(reorder at {reorder_point})")
+
 def display_low_stock(products):
     if not products:
         print("Everything looks good! Nothing running dangerously low.")
@@ -90,8 +163,26 @@ def display_low_stock(products):
     for pid, item in products:
         print(f"{pid:12} {item['name']:20} {item['stock']:12}")
 
-def collect_cart_items(inventory):
-    """Let people add stuff to their cart"""
+def display_reorder_suggestions(inventory, suggestions):
+    """Products that'll run out before a delivery could get here, soonest first"""
+    if not suggestions:
+        print("Nothing needs ordering yet, stock will last.")
+        return
+    
+    print(f"\n{'ID':12} {'Product Name':20} {'Stock':>6} {'Sold/day':>9} {'Days left':>10} {'Order':>7}")
+    print("-" * 68)
+    for pid, stock, velocity, cover, order in suggestions:
+        name = inventory[pid]['name'] if pid in inventory else "(deleted product)"
+        days_left = f"{cover:10.1f}" if cover < 10000 else f"{'lots':>10}"
+        print(f"{pid:12} {name[:20]:20} {stock:6} {velocity:9.1f} {days_left} {order:7}")
+
+def collect_cart_items(inventory, versions=None):
+    """
+    Let people add stuff to their cart.
+    Each item gets reserved so other tills can't sell it from under us.
+    If you pass a versions dict, it gets filled with the version of each
+    product we added (hand it to checkout to catch edits from other tills).
+    """
     cart = {}
     
     while True:
@@ -103,8 +194,8 @@ def collect_cart_items(inventory):
             print("Hmm, don't have that product ID. Check your spelling?")
             continue
             
-        available = inventory[pid]['stock']
-        if available == 0:
+        available = available_stock(inventory, pid) - cart.get(pid, 0)
+        if available <= 0:
             print(f"Sorry, {inventory[pid]['name']} is all sold out!")
             continue
             
@@ -121,6 +212,14 @@ def collect_cart_items(inventory):
         if qty > available:
             print(f"Whoa there! We only have {available} of those.")
             continue
+        
+        reserved, message = reserve_stock(inventory, pid, qty)
+        if not reserved:
+            print(message)
+            continue
+        
+        if versions is not None and pid not in versions:
+            versions[pid] = get_version(inventory, pid)
             
         # Add to cart (or update quantity if already in cart)
         if pid in cart:
@@ -132,32 +231,24 @@ def collect_cart_items(inventory):
         
     return cart
 
-def prompt_save_bill(bill_text):
-    """Ask if they want to save the receipt"""
+def prompt_save_bill(receipt):
+    """Ask if they want to save the receipt (it gets written in the background)"""
+    formats = {'1': 'txt', '2': 'csv', '3': 'json'}
     while True:
         print("\nWant to save this receipt?")
         print("1 - Save as text file")
-        print("2 - Save as CSV (why though?)")
-        print("3 - Nah, don't save it")
+        print("2 - Save as CSV (one row per item)")
+        print("3 - Save as JSON")
+        print("4 - Nah, don't save it")
         
         choice = input("Your pick: ")
         
-        if choice == '1':
-            filename = os.path.join(BILLS_FOLDER, f"receipt_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
-            save_bill_file(filename, bill_text)
-            print(f"Saved as {filename}")
-            break
-        elif choice == '2':
-            filename = os.path.join(BILLS_FOLDER, f"receipt_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
-            lines = bill_text.splitlines()
-            with open(filename, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                for line in lines:
-                    writer.writerow([line])
-            print(f"Saved as {filename} (CSV format is weird for receipts but whatever)")
+        if choice in formats:
+            filename = save_receipt(receipt, formats[choice])
+            print(f"Saving as {filename}")
             break
-        elif choice == '3':
+        elif choice == '4':
             print("Okay, not saving it.")
             break
         else:
-            print("Just pick 1, 2, or 3 please.")
\ No newline at end of file
+            print("Just pick 1, 2, 3 or 4 please.")
\ No newline at end of file
@@ -0,0 +1,193 @@
+# inventory.py
+"""
+Compact inventory storage.
+A dict of dicts costs a few hundred bytes per product, which adds up with a
+big catalog. Inventory keeps the same look from the outside
+(inventory[pid]['stock'] -= 1 still works) but stores products either as
+__slots__ records or as plain typed arrays.
+"""
+
+from array import array
+from collections.abc import MutableMapping
+
+FIELDS = ('name', 'price', 'stock')
+
+class _ProductFields:
+    """The dict-style bits shared by Product and _Row"""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key not in FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in FIELDS else default
+
+    def keys(self):
+        return FIELDS
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def to_dict(self):
+        return {'name': self['name'], 'price': self['price'], 'stock': self['stock']}
+
+    def __eq__(self, other):
+        try:
+            return all(self[key] == other[key] for key in FIELDS)
+        except (KeyError, TypeError):
+            return NotImplemented
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+class Product(_ProductFields):
+    """One product. Works like the old {'name', 'price', 'stock'} dict."""
+
+    __slots__ = FIELDS
+
+    def __init__(self, name, price, stock):
+        self.name = name
+        self.price = price
+        self.stock = stock
+
+class _Row(_ProductFields):
+    """A product living in the arrays - reads and writes go straight through"""
+
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    @property
+    def name(self):
+        return self._store._names[self._row]
+
+    @name.setter
+    def name(self, value):
+        self._store._names[self._row] = value
+
+    @property
+    def price(self):
+        return self._store._prices[self._row]
+
+    @price.setter
+    def price(self, value):
+        self._store._prices[self._row] = value
+
+    @property
+    def stock(self):
+        return self._store._stock[self._row]
+
+    @stock.setter
+    def stock(self, value):
+        self._store._stock[self._row] = value
+
+class Inventory(MutableMapping):
+    """
+    Product ID -> product, keeping insertion order like a dict does.
+
+    storage='slots'  - one small Product object per product (the default)
+    storage='arrays' - parallel arrays: array('d') prices, array('q') stock,
+                       a list of names and an ID -> row index. Smallest option.
+    """
+
+    STORAGES = ('slots', 'arrays')
+
+    def __init__(self, storage='slots', products=None):
+        if storage not in self.STORAGES:
+            raise ValueError(f"Unknown inventory storage '{storage}', use one of {self.STORAGES}")
+        self.storage = storage
+        self._products = {}   # slots: pid -> Product, arrays: pid -> row number
+        if storage == 'arrays':
+            self._pids = []
+            self._names = []
+            self._prices = array('d')
+            self._stock = array('q')
+            self._holes = 0   # deleted rows waiting for a compact
+        if products:
+            self.update(products)
+
+    def __len__(self):
+        return len(self._products)
+
+    def clear(self):
+        self._products = {}
+        if self.storage == 'arrays':
+            self._pids = []
+            self._names = []
+            self._prices = array('d')
+            self._stock = array('q')
+            self._holes = 0
+
+    def __contains__(self, pid):
+        return pid in self._products
+
+    def __iter__(self):
+        if self.storage == 'slots':
+            return iter(self._products)
+        return (pid for pid in self._pids if pid is not None)
+
+    def __getitem__(self, pid):
+        if self.storage == 'slots':
+            return self._products[pid]
+        return _Row(self, self._products[pid])
+
+    def __setitem__(self, pid, product):
+        self.put(pid, product['name'], product['price'], product['stock'])
+
+    def put(self, pid, name, price, stock):
+        """Add or overwrite a product without building a dict for it first"""
+        price, stock = float(price), int(stock)
+        if self.storage == 'slots':
+            existing = self._products.get(pid)
+            if existing is None:
+                self._products[pid] = Product(name, price, stock)
+            else:
+                existing.name, existing.price, existing.stock = name, price, stock
+            return
+
+        row = self._products.get(pid)
+        if row is None:
+            self._products[pid] = len(self._pids)
+            self._pids.append(pid)
+            self._names.append(name)
+            self._prices.append(price)
+            self._stock.append(stock)
+        else:
+            self._names[row] = name
+            self._prices[row] = price
+            self._stock[row] = stock
+
+    def __delitem__(self, pid):
+        if self.storage == 'slots':
+            del self._products[pid]
+            return
+
+        row = self._products.pop(pid)
+        # Leave a hole so the order stays put, and tidy up once there are lots
+        self._pids[row] = None
+        self._names[row] = None
+        self._holes += 1
+        if self._holes > 1024 and self._holes * 2 > len(self._pids):
+            self._compact()
+
+    def _compact(self):
+        keep = [row for row, pid in enumerate(self._pids) if pid is not None]
+        self._pids = [self._pids[row] for row in keep]
+        self._names = [self._names[row] for row in keep]
+        self._prices = array('d', (self._prices[row] for row in keep))
+        self._stock = array('q', (self._stock[row] for row in keep))
+        self._products = {pid: row for row, pid in enumerate(self._pids)}
+        self._holes = 0
+
+    def __repr__(self):
+        return f"Inventory({self.storage!r}, {len(self)} products)"
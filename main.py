@@ -7,19 +7,36 @@ It's not perfect but it works for my small shop
 
 from backend import (
     load_inventory, add_new_product, modify_product, remove_product, 
-    find_products, reduce_stock, log_sale, get_daily_sales, 
-    get_low_stock_products, create_bill_text
+    find_products, checkout, get_daily_sales, 
+    get_low_stock_products, compact_journal, rebuild_sales_summary,
+    migrate_sales_log, BILLS_FOLDER, PRODUCTS_FILE, PRODUCTS_STORE_FILE, get_version,
+    release_reservations, get_top_selling_products, on_low_stock, get_reorder_list,
+    get_reorder_point, get_reorder_suggestions, flush_receipts, rerender_receipts, import_products, apply_stock_adjustments, export_products,
+    migrate_to_sqlite, SQLITE_FILE, compress_sales_log, get_active_promotions, PROMOTIONS_FILE, migrate_receipts, get_saved_receipt, list_saved_receipts
 )
+from product_store import import_products_csv, export_products_csv
+import metrics
 from frontend import (
-    get_float_input, get_int_input, show_product_menu, show_order_menu,
+    get_float_input, get_int_input, get_optional_count_input, show_product_menu, show_order_menu,
     show_reports_menu, display_inventory, display_search_results, 
-    display_low_stock, collect_cart_items, prompt_save_bill
+    display_low_stock, collect_cart_items, prompt_save_bill, show_bulk_menu,
+    display_bulk_errors, ask_sales_window, display_top_sellers, alert_low_stock,
+    display_reorder_suggestions
 )
 from datetime import datetime
+import argparse
+import contextlib
+import json
+import os
+import sys
 
 def main():
     print("Starting up Shop Manager...")
     inventory = load_inventory()
+    # Old versions kept every sale in one sales.csv - move those into the daily files
+    migrate_sales_log(inventory)
+    # Shout as soon as a sale takes something down to its reorder point
+    on_low_stock(inventory, alert_low_stock)
     print("Ready!\n")
     
     while True:
@@ -64,10 +81,12 @@ def main():
                         print("That product doesn't exist!")
                         continue
                     
+                    version = get_version(inventory, pid)
                     print(f"\nCurrent details:")
                     print(f"  Name: {inventory[pid]['name']}")
                     print(f"  Price: {inventory[pid]['price']:.2f}")
                     print(f"  Stock: {inventory[pid]['stock']}")
+                    print(f"  Reorder at: {get_reorder_point(pid)}")
                     
                     new_name = input("\nNew name (press Enter to keep current): ").strip()
                     new_name = new_name if new_name else None
@@ -78,7 +97,11 @@ def main():
                     new_stock_input = input("New stock quantity (press Enter to keep current): ").strip()
                     new_stock = int(new_stock_input) if new_stock_input else None
                     
-                    success, message = modify_product(inventory, pid, new_name, new_price, new_stock)
+                    reorder_point = get_optional_count_input("Reorder when stock gets down to (press Enter to keep current): ")
+                    
+                    success, message = modify_product(inventory, pid, new_name, new_price, new_stock,
+                                                      expected_version=version,
+                                                      reorder_point=reorder_point)
                     print(message)
                     
                 elif sub_choice == '3':
@@ -106,10 +129,14 @@ def main():
                     display_search_results(results)
                     
                 elif sub_choice == '5':
+                    # Bulk stuff from/to CSV files
+                    bulk_products(inventory)
+                    
+                elif sub_choice == '6':
                     # Go back
                     break
                 else:
-                    print("Huh? Please pick 1-5")
+                    print("Huh? Please pick 1-6")
         
         elif choice == '2':
             # Order processing
@@ -129,10 +156,12 @@ def main():
                     
                     # Build the cart
                     print("\nLet's add items to your cart:")
-                    cart = collect_cart_items(inventory)
+                    versions = {}
+                    cart = collect_cart_items(inventory, versions)
                     
                     if not cart:
                         print("Cart is empty, nothing to checkout.")
+                        release_reservations()
                         continue
                     
                     # Apply discount?
@@ -143,23 +172,23 @@ def main():
                             print("Invalid discount, ignoring...")
                             discount = 0
                     
-                    # Generate and show bill
-                    bill_text, total = create_bill_text(inventory, cart, discount)
+                    # Update inventory and log the sale in one go
+                    print("\nUpdating inventory...")
+                    success, message, receipt = checkout(inventory, cart, discount,
+                                                         expected_versions=versions)
+                    if not success:
+                        print(message)
+                        release_reservations()
+                        continue
+                    
                     print("\n" + "="*60)
                     print("FINAL RECEIPT")
                     print("="*60)
-                    print(bill_text)
-                    
-                    # Update inventory and log sale
-                    print("\nUpdating inventory...")
-                    for pid, qty in cart.items():
-                        reduce_stock(inventory, pid, qty)
-                    
-                    log_sale(cart, total)
-                    print("Sale recorded!")
+                    print(receipt)
+                    print(message)
                     
                     # Offer to save receipt
-                    prompt_save_bill(bill_text)
+                    prompt_save_bill(receipt)
                     
                 elif sub_choice == '2':
                     break
@@ -189,22 +218,40 @@ def main():
                 elif sub_choice == '2':
                     # Low stock alert
                     print("\n--- LOW STOCK REPORT ---")
-                    try:
-                        threshold = int(input("Alert threshold (default 5): ") or "5")
-                    except ValueError:
-                        threshold = 5
-                        print("Using default threshold of 5")
-                    
-                    low_stock = get_low_stock_products(inventory, threshold)
+                    threshold_input = input("Alert threshold (press Enter to use each product's reorder point): ").strip()
+                    if threshold_input:
+                        try:
+                            low_stock = get_low_stock_products(inventory, int(threshold_input))
+                        except ValueError:
+                            print("That's not a number!")
+                            continue
+                    else:
+                        low_stock = get_reorder_list(inventory)
                     display_low_stock(low_stock)
                     
                 elif sub_choice == '3':
+                    # Reorder suggestions, going by how fast things sell
+                    print("\n--- WHAT TO REORDER ---")
+                    display_reorder_suggestions(inventory, get_reorder_suggestions(inventory, 50))
+                    
+                elif sub_choice == '4':
+                    # Best sellers
+                    print("\n--- TOP SELLERS ---")
+                    window = ask_sales_window()
+                    if window is None:
+                        continue
+                    top_sellers = get_top_selling_products(10, *window)
+                    display_top_sellers(inventory, top_sellers)
+                    
+                elif sub_choice == '5':
                     break
                 else:
-                    print("Please pick 1-3")
+                    print("Please pick 1-5")
         
         elif choice == '4':
-            # Exit
+            # Exit - fold the journal back into products.csv before leaving
+            compact_journal(inventory)
+            flush_receipts()
             print("\nThanks for using My Shop Manager!")
             print("Have a great day! 👋")
             break
@@ -212,5 +259,169 @@ def main():
         else:
             print("Not sure what that means. Please pick 1, 2, 3, or 4.")
 
+def bulk_products(inventory):
+    """The bulk import / export menu"""
+    choice = show_bulk_menu().strip()
+    
+    if choice in ('1', '2'):
+        path = input("CSV file to read: ").strip()
+        if not os.path.exists(path):
+            print("Can't find that file!")
+            return
+        bulk = import_products if choice == '1' else apply_stock_adjustments
+        # Check it first so nothing half-happens by surprise
+        success, message, errors = bulk(inventory, path, dry_run=True)
+        print(message)
+        display_bulk_errors(errors)
+        if not success or input("Go ahead? (y/n): ").lower() != 'y':
+            return
+        success, message, errors = bulk(inventory, path)
+        print(message)
+        
+    elif choice == '3':
+        path = input("CSV file to write: ").strip()
+        search_term = input("Only products matching (press Enter for all): ").strip()
+        max_stock = input("Only with stock at or below (press Enter for any): ").strip()
+        try:
+            count = export_products(inventory, path, search_term or None,
+                                    max_stock=int(max_stock) if max_stock else None)
+            print(f"Wrote {count} products to {path}")
+        except (OSError, ValueError) as e:
+            print(f"Export failed: {e}")
+
+def run_bulk_command(args):
+    """--import-products / --adjust-stock / --export-products, no menus"""
+    if args.export_products == '-':
+        # The CSV goes to stdout, so the loading chatter has to go elsewhere
+        with contextlib.redirect_stdout(sys.stderr):
+            inventory = load_inventory()
+    else:
+        inventory = load_inventory()
+    if args.export_products:
+        count = export_products(inventory, args.export_products, args.search,
+                                args.min_stock, args.max_stock)
+        if args.export_products != '-':
+            print(f"Wrote {count} products to {args.export_products}")
+        return True
+    
+    if args.import_products:
+        success, message, errors = import_products(inventory, args.import_products, args.dry_run)
+    else:
+        success, message, errors = apply_stock_adjustments(inventory, args.adjust_stock, args.dry_run)
+    print(message)
+    display_bulk_errors(errors, limit=len(errors))
+    return success and not errors
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="My Shop Manager")
+    parser.add_argument('--rebuild-sales-summary', action='store_true',
+                        help="recalculate the report totals from the sales log and exit")
+    parser.add_argument('--import-product-store', action='store_true',
+                        help=f"build {PRODUCTS_STORE_FILE} from {PRODUCTS_FILE} and exit")
+    parser.add_argument('--export-product-store', action='store_true',
+                        help=f"write {PRODUCTS_FILE} from {PRODUCTS_STORE_FILE} and exit")
+    parser.add_argument('--import-products', metavar='CSV',
+                        help="add/update products from a CSV ('-' for stdin) and exit")
+    parser.add_argument('--adjust-stock', metavar='CSV',
+                        help="apply stock adjustments from a CSV ('-' for stdin) and exit")
+    parser.add_argument('--export-products', metavar='CSV',
+                        help="write products to a CSV ('-' for stdout) and exit")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="with --import-products/--adjust-stock: only check the file")
+    parser.add_argument('--search', help="with --export-products: only products matching this")
+    parser.add_argument('--min-stock', type=int, help="with --export-products: stock at least this")
+    parser.add_argument('--max-stock', type=int, help="with --export-products: stock at most this")
+    parser.add_argument('--rerender-receipts', choices=['txt', 'csv', 'json'],
+                        help="write receipt files for past bills from the sales log and exit")
+    parser.add_argument('--receipt', metavar='BILL_ID', help="print a saved receipt and exit")
+    parser.add_argument('--list-receipts', action='store_true',
+                        help="list the receipts in the archive (use --from/--to for a date range) and exit")
+    parser.add_argument('--migrate-receipts', action='store_true',
+                        help=f"pack the receipt files in {BILLS_FOLDER} into the receipt archive and exit")
+    parser.add_argument('--delete-originals', action='store_true',
+                        help="with --migrate-receipts: delete the files once they're archived")
+    parser.add_argument('--from', dest='date_from', metavar='YYYY-MM-DD',
+                        help="with --rerender-receipts/--list-receipts: first day")
+    parser.add_argument('--to', dest='date_to', metavar='YYYY-MM-DD',
+                        help="with --rerender-receipts/--list-receipts: last day")
+    parser.add_argument('--promotions', action='store_true',
+                        help=f"list the promotions in {PROMOTIONS_FILE} that are on right now and exit")
+    parser.add_argument('--compress-sales-log', action='store_true',
+                        help="compress the old sales day files now and exit")
+    parser.add_argument('--migrate-to-sqlite', action='store_true',
+                        help=f"copy the products and sales log into {SQLITE_FILE} and exit")
+    parser.add_argument('--batch', metavar='FILE',
+                        help="check out orders from JSON lines or CSV ('-' for stdin), no menus")
+    parser.add_argument('--batch-format', choices=['jsonl', 'csv'],
+                        help="with --batch: input format (default: by the file's extension)")
+    parser.add_argument('--batch-size', type=int, default=64,
+                        help="with --batch: orders per fsync (default 64)")
+    parser.add_argument('--serve', action='store_true',
+                        help="run the HTTP/JSON server instead of the menus")
+    parser.add_argument('--profile', metavar='OPERATION',
+                        help="cProfile the first call of one operation (e.g. checkout) to OPERATION.prof")
+    parser.add_argument('--host', default='127.0.0.1', help="address to serve on (default 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8080, help="port to serve on (default 8080)")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    if args.profile:
+        metrics.profile_next(args.profile, f"{args.profile}.prof")
+    if args.rebuild_sales_summary:
+        summary = rebuild_sales_summary()
+        print(f"Sales summary rebuilt: {len(summary['days'])} days, "
+              f"{len(summary['products'])} products")
+    elif args.import_product_store:
+        count = import_products_csv(PRODUCTS_FILE, PRODUCTS_STORE_FILE)
+        print(f"Wrote {count} products to {PRODUCTS_STORE_FILE}")
+    elif args.export_product_store:
+        count = export_products_csv(PRODUCTS_STORE_FILE, PRODUCTS_FILE)
+        print(f"Wrote {count} products to {PRODUCTS_FILE}")
+    elif args.import_products or args.adjust_stock or args.export_products:
+        # Exit code 1 if anything got skipped, so scripts notice
+        raise SystemExit(0 if run_bulk_command(args) else 1)
+    elif args.rerender_receipts:
+        count = rerender_receipts(load_inventory(), args.rerender_receipts, args.date_from, args.date_to)
+        print(f"Wrote {count} receipts to {BILLS_FOLDER}")
+    elif args.receipt:
+        content = get_saved_receipt(args.receipt)
+        if content is None:
+            print(f"No saved receipt for bill {args.receipt}")
+            raise SystemExit(1)
+        print(content)
+    elif args.list_receipts:
+        for date, bill_id, fmt in list_saved_receipts(args.date_from, args.date_to):
+            print(f"{date}  {bill_id}  {fmt}")
+    elif args.migrate_receipts:
+        archived, skipped = migrate_receipts(args.delete_originals)
+        print(f"Archived {archived} receipts ({skipped} were already there or unreadable)")
+    elif args.promotions:
+        active = get_active_promotions()
+        for rule in active:
+            print(f"{rule.id or '-':15} {rule.label:30} {', '.join(rule.products)}")
+        print(f"{len(active)} promotions on right now")
+    elif args.compress_sales_log:
+        if not compress_sales_log()[0]:
+            print("No sales days old enough to compress")
+    elif args.migrate_to_sqlite:
+        if migrate_to_sqlite():
+            print("Set PRODUCT_STORE and SALES_STORE to 'sqlite' in backend.py to use it")
+    elif args.batch:
+        from batch import run_batch
+        # stdout is for the results, the rest goes to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            inventory = load_inventory()
+            migrate_sales_log(inventory)
+        totals = run_batch(inventory, args.batch, args.batch_format, batch_size=args.batch_size)
+        with contextlib.redirect_stdout(sys.stderr):
+            compact_journal(inventory)
+        print(json.dumps(totals), file=sys.stderr)
+        raise SystemExit(1 if totals['bad_lines'] else 0)
+    elif args.serve:
+        from server import serve
+        inventory = load_inventory()
+        migrate_sales_log(inventory)
+        serve(inventory, args.host, args.port)
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,236 @@
+# metrics.py
+"""
+How long things take and how often they go wrong, measured while the shop
+runs - until now a failed save was only a printed warning.
+
+- @timed('checkout') on a function, or `with timer('checkout'):` around a
+  block: a latency histogram per operation, plus an error count when it raises.
+- count('saves_total', file='products'): plain counters, with labels.
+- snapshot(): everything as a dict. prometheus_text(): the same in
+  Prometheus' text format (the server has it at GET /metrics).
+- profile() / profile_next('checkout'): cProfile one flow.
+
+With ENABLED = False every timer and counter is a single if-check.
+"""
+
+import bisect
+import contextlib
+import cProfile
+import functools
+import io
+import pstats
+import threading
+import time
+
+ENABLED = True
+PREFIX = 'shop_'
+# Histogram buckets (upper bounds, seconds)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = {}      # (name, ((label, value), ...)) -> total
+_histograms = {}    # operation -> _Histogram
+_profile_next = {}  # operation -> where to save the profile (None = print it)
+
+class _Histogram:
+    __slots__ = ('buckets', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)   # the last one is "bigger than all of them"
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Roughly: the upper bound of the bucket the q-th observation fell in"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+def count(name, amount=1, **labels):
+    """Add amount to a counter"""
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def _histogram(operation):
+    with _lock:
+        histogram = _histograms.get(operation)
+        if histogram is None:
+            histogram = _histograms[operation] = _Histogram()
+        return histogram
+
+def observe(operation, seconds):
+    """Record one run of an operation that took `seconds`"""
+    if not ENABLED:
+        return
+    histogram = _histograms.get(operation) or _histogram(operation)
+    with _lock:
+        histogram.observe(seconds)
+
+@contextlib.contextmanager
+def timer(operation):
+    """with timer('report'): ... - times the block (and counts it as an error if it raises)"""
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        count('errors_total', operation=operation)
+        raise
+    finally:
+        observe(operation, time.perf_counter() - start)
+
+def timed(operation):
+    """Decorator version of timer(). This is the one on the hot paths, so it's kept lean."""
+    def decorate(func):
+        histogram = _histogram(operation)   # looked up once, not on every call
+        perf_counter = time.perf_counter
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            if _profile_next and operation in _profile_next:
+                return _profiled_call(operation, func, args, kwargs)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                count('errors_total', operation=operation)
+                raise
+            finally:
+                elapsed = perf_counter() - start
+                with _lock:
+                    histogram.observe(elapsed)
+        return wrapper
+    return decorate
+
+# --- Profiling ---
+
+@contextlib.contextmanager
+def profile(path=None, limit=25):
+    """
+    with profile(): ... - cProfile just this block. The slowest functions
+    (by cumulative time) get printed, or with a path the whole profile gets
+    saved there for pstats / snakeviz.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if path:
+            profiler.dump_stats(path)
+        else:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+            print(out.getvalue())
+
+def profile_next(operation, path=None):
+    """Profile the next call of a @timed operation (e.g. 'checkout'), once"""
+    with _lock:
+        _profile_next[operation] = path
+
+def _profiled_call(operation, func, args, kwargs):
+    with _lock:
+        if operation not in _profile_next:
+            path, armed = None, False   # another thread got there first
+        else:
+            path, armed = _profile_next.pop(operation), True
+    if not armed:
+        return timed(operation)(func)(*args, **kwargs)
+    start = time.perf_counter()
+    try:
+        with profile(path):
+            return func(*args, **kwargs)
+    finally:
+        observe(operation, time.perf_counter() - start)
+        if path:
+            print(f"Profile of {operation} saved to {path}")
+
+# --- Reading them back ---
+
+def snapshot():
+    """
+    {'counters': {name: total or {labels: total}},
+     'operations': {operation: {count, total, mean, max, p50, p95, p99 (seconds), buckets}}}
+    """
+    with _lock:
+        counters = {}
+        for (name, labels), total in sorted(_counters.items()):
+            if labels:
+                counters.setdefault(name, {})[','.join(f"{k}={v}" for k, v in labels)] = total
+            else:
+                counters[name] = total
+        operations = {}
+        for operation, h in sorted(_histograms.items()):
+            if not h.count:
+                continue
+            operations[operation] = {
+                'count': h.count,
+                'total': h.sum,
+                'mean': h.sum / h.count if h.count else 0.0,
+                'max': h.max,
+                'p50': h.quantile(0.50),
+                'p95': h.quantile(0.95),
+                'p99': h.quantile(0.99),
+                'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], h.buckets)),
+            }
+    return {'counters': counters, 'operations': operations}
+
+def _label_text(labels):
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}' if labels else ''
+
+def prometheus_text():
+    """Everything in Prometheus' text exposition format"""
+    lines = []
+    with _lock:
+        seen = set()
+        for (name, labels), total in sorted(_counters.items()):
+            if name not in seen:
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                seen.add(name)
+            lines.append(f"{PREFIX}{name}{_label_text(labels)} {total}")
+        name = f"{PREFIX}operation_seconds"
+        if any(h.count for h in _histograms.values()):
+            lines.append(f"# HELP {name} How long backend operations take")
+            lines.append(f"# TYPE {name} histogram")
+        for operation, h in sorted(_histograms.items()):
+            if not h.count:
+                continue
+            cumulative = 0
+            for bound, n in zip([str(b) for b in BUCKETS] + ['+Inf'], h.buckets):
+                cumulative += n
+                lines.append(f'{name}_bucket{{operation="{operation}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{operation="{operation}"}} {h.sum}')
+            lines.append(f'{name}_count{{operation="{operation}"}} {h.count}')
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    with _lock:
+        _counters.clear()
+        for histogram in _histograms.values():
+            histogram.clear()   # @timed functions hang on to theirs
+        _profile_next.clear()
@@ -0,0 +1,65 @@
+# money.py
+"""
+Money as whole cents.
+Adding up floats like 0.1 + 0.2 drifts by fractions of a cent, and over a
+day of sales that showed up when cashing up. So bills, the sales log and
+the reports all do their sums in integer cents and only turn them back into
+money amounts for showing them.
+
+Rounding rule: halves round up (away from zero), same as on a calculator.
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+
+_CENT = Decimal('0.01')
+
+def to_cents(amount):
+    """A money amount (float, int, str or Decimal) as whole cents, halves rounded up"""
+    if isinstance(amount, float):   # prices are, so this goes first
+        cents = amount * 100
+        rounded = round(cents)
+        if abs(cents - rounded) < 0.5 - 1e-6:
+            return rounded
+        # Right on (or next to) half a cent - let Decimal decide which way it goes
+        amount = repr(amount)
+    elif isinstance(amount, int):
+        return amount * 100
+    return int(Decimal(amount).quantize(_CENT, rounding=ROUND_HALF_UP) * 100)
+
+def parse_cents(text):
+    """
+    Cents from an amount we wrote ourselves (at most 2 decimals), e.g. the
+    sales log. Much quicker than to_cents() and exact for those.
+    """
+    return round(float(text) * 100)
+
+def to_amount(cents):
+    """Cents back to a money amount, for showing it or JSON"""
+    return cents / 100
+
+def format_cents(cents):
+    """Cents as text with exactly two decimals, e.g. 1234 -> '12.34'"""
+    sign = '-' if cents < 0 else ''
+    whole, part = divmod(abs(cents), 100)
+    return f"{sign}{whole}.{part:02d}"
+
+def percent_of(cents, percent):
+    """percent (e.g. 12.5) of an amount in cents, halves rounded up"""
+    basis_points = round(percent * 100)   # hundredths of a percent
+    value = abs(cents) * basis_points
+    share = (value + 5000) // 10000
+    return share if cents >= 0 else -share
+
+def spread(total, weights):
+    """
+    Split total cents over the weights, in proportion. The leftover cents
+    from rounding go on the last one, so the parts always add up to total.
+    """
+    weight_sum = sum(weights)
+    if not weight_sum:
+        parts = [0] * len(weights)
+    else:
+        parts = [(total * weight * 2 + weight_sum) // (weight_sum * 2) for weight in weights]
+    if parts:
+        parts[-1] = total - sum(parts[:-1])
+    return parts
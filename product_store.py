@@ -0,0 +1,307 @@
+# product_store.py
+"""
+Fixed-width binary product file that gets opened with mmap.
+Reading products.csv row by row takes ages with a big catalog, so this
+format lets us open the file instantly and only read the products we
+actually touch. Stock changes get written straight into the product's
+record instead of rewriting the whole file.
+
+Layout: a 32 byte header, then one 121 byte record per product:
+    live flag (1) | product ID (32) | name (64) | price (double) | stock (int64) | version (8)
+Deleted products just get their live flag cleared. Every change bumps a
+counter in the header, so other tills can tell they have catching up to do. version is the token
+backend.get_version() hands out, so every till sees the same one. Files
+from before it was there (format 1) get upgraded when they're opened.
+"""
+
+import csv
+import mmap
+import os
+import struct
+from collections.abc import MutableMapping
+
+from durable import atomic_writer
+from inventory import _ProductFields
+
+MAGIC = b'SHOPDAT1'
+HEADER = struct.Struct('<8sHHIQQ')    # magic, version, record size, changes, records, live
+RECORD = struct.Struct('<B32s64sdq8s')  # live, product ID, name, price, stock, version token
+PID_WIDTH = 32
+NAME_WIDTH = 64
+TOKEN_WIDTH = 8
+VERSION = 2
+_RECORD_V1 = struct.Struct('<B32s64sdq')  # format 1, no version token
+
+# Offsets of the fields inside a record
+_PID_AT = 1
+_NAME_AT = _PID_AT + PID_WIDTH
+_PRICE_AT = _NAME_AT + NAME_WIDTH
+_STOCK_AT = _PRICE_AT + 8
+_TOKEN_AT = _STOCK_AT + 8
+_PRICE = struct.Struct('<d')
+_STOCK = struct.Struct('<q')
+_CHANGES_AT = 12   # the change counter's place in the header (it wraps around)
+_CHANGES = struct.Struct('<I')
+
+def _encode_pid(pid):
+    raw = pid.encode('utf-8')
+    if len(raw) > PID_WIDTH:
+        raise ValueError(f"Product ID '{pid}' is too long (max {PID_WIDTH} bytes)")
+    return raw
+
+def _encode_name(name):
+    """Names longer than the field get cut (on a character boundary)"""
+    raw = name.encode('utf-8')
+    if len(raw) > NAME_WIDTH:
+        raw = raw[:NAME_WIDTH].decode('utf-8', 'ignore').encode('utf-8')
+    return raw
+
+def _decode(raw):
+    return raw.rstrip(b'\0').decode('utf-8')
+
+def _upgrade(path):
+    """Rewrite a format 1 file in the current layout, every product's version blank"""
+    with open(path, 'rb') as src, atomic_writer(path, 'wb') as out:
+        _, _, _, _, records, live = HEADER.unpack(src.read(HEADER.size))
+        out.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0, records, live))
+        blank = bytes(TOKEN_WIDTH)
+        for _ in range(records):
+            out.write(src.read(_RECORD_V1.size) + blank)
+
+def create_store(path):
+    """Make an empty product file"""
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0, 0, 0))
+
+class _MappedRow(_ProductFields):
+    """One product record inside the mapped file. Setting a field writes it to disk."""
+
+    __slots__ = ('_store', '_offset')
+
+    def __init__(self, store, offset):
+        self._store = store
+        self._offset = offset
+
+    @property
+    def name(self):
+        start = self._offset + _NAME_AT
+        return _decode(self._store._mm[start:start + NAME_WIDTH])
+
+    @name.setter
+    def name(self, value):
+        start = self._offset + _NAME_AT
+        self._store._mm[start:start + NAME_WIDTH] = _encode_name(value).ljust(NAME_WIDTH, b'\0')
+        self._store._touched()
+
+    @property
+    def price(self):
+        return _PRICE.unpack_from(self._store._mm, self._offset + _PRICE_AT)[0]
+
+    @price.setter
+    def price(self, value):
+        _PRICE.pack_into(self._store._mm, self._offset + _PRICE_AT, float(value))
+        self._store._touched()
+
+    @property
+    def stock(self):
+        return _STOCK.unpack_from(self._store._mm, self._offset + _STOCK_AT)[0]
+
+    @stock.setter
+    def stock(self, value):
+        _STOCK.pack_into(self._store._mm, self._offset + _STOCK_AT, int(value))
+        self._store._touched()
+
+class MappedInventory(MutableMapping):
+    """
+    Inventory backed by the mmap'd product file.
+    Opening is instant; the product ID -> record index only gets built the
+    first time somebody looks a product up. Every change is written in place,
+    so there's nothing to save - call sync() to push it to disk.
+    """
+
+    persists_in_place = True
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            head = f.read(HEADER.size)
+        if len(head) == HEADER.size and HEADER.unpack(head)[:3] == (MAGIC, 1, _RECORD_V1.size):
+            _upgrade(path)
+        self._file = open(path, 'r+b')
+        self._mm = None
+        self._map()
+        magic, version, record_size, self._changes, self._records, self._live = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.close()
+            raise ValueError(f"{path} isn't a product file we understand")
+        self._index = None
+
+    def _map(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+
+    def _offset(self, recno):
+        return HEADER.size + recno * RECORD.size
+
+    def _write_header(self):
+        self._changes = (self._changes + 1) & 0xFFFFFFFF
+        HEADER.pack_into(self._mm, 0, MAGIC, VERSION, RECORD.size, self._changes, self._records, self._live)
+
+    def _touched(self):
+        """Bump the change counter after writing to a record"""
+        self._changes = (self._changes + 1) & 0xFFFFFFFF
+        _CHANGES.pack_into(self._mm, _CHANGES_AT, self._changes)
+
+    def _build_index(self):
+        mm = self._mm
+        index = {}
+        offset = HEADER.size
+        for recno in range(self._records):
+            if mm[offset]:
+                index[_decode(mm[offset + _PID_AT:offset + _NAME_AT])] = recno
+            offset += RECORD.size
+        self._index = index
+        return index
+
+    def _lookup(self, pid):
+        index = self._index if self._index is not None else self._build_index()
+        return index[pid]
+
+    def __len__(self):
+        return self._live
+
+    def __contains__(self, pid):
+        try:
+            self._lookup(pid)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        if self._index is not None:
+            return iter(list(self._index))
+        return self._scan()
+
+    def _scan(self):
+        """Walk the records in order without building the index"""
+        mm = self._mm
+        for recno in range(self._records):
+            offset = self._offset(recno)
+            if mm[offset]:
+                yield _decode(mm[offset + _PID_AT:offset + _NAME_AT])
+
+    def __getitem__(self, pid):
+        return _MappedRow(self, self._offset(self._lookup(pid)))
+
+    def __setitem__(self, pid, product):
+        self.put(pid, product['name'], product['price'], product['stock'])
+
+    def put(self, pid, name, price, stock):
+        try:
+            recno = self._lookup(pid)
+        except KeyError:
+            recno = None
+
+        if recno is not None:
+            row = _MappedRow(self, self._offset(recno))
+            row.name, row.price, row.stock = name, price, stock
+            return
+
+        record = RECORD.pack(1, _encode_pid(pid), _encode_name(name), float(price), int(stock), b'')
+        self._file.seek(self._offset(self._records))
+        self._file.write(record)
+        self._file.flush()
+        self._map()
+        self._index[pid] = self._records
+        self._records += 1
+        self._live += 1
+        self._write_header()
+
+    def __delitem__(self, pid):
+        recno = self._lookup(pid)
+        self._mm[self._offset(recno)] = 0
+        del self._index[pid]
+        self._live -= 1
+        self._write_header()
+
+    def version(self, pid):
+        start = self._offset(self._lookup(pid)) + _TOKEN_AT
+        return _decode(self._mm[start:start + TOKEN_WIDTH])
+
+    def set_version(self, pid, token):
+        start = self._offset(self._lookup(pid)) + _TOKEN_AT
+        self._mm[start:start + TOKEN_WIDTH] = token.encode('ascii')[:TOKEN_WIDTH].ljust(TOKEN_WIDTH, b'\0')
+        self._touched()
+
+    def refresh(self):
+        """
+        Notice what other processes changed. True if they changed anything
+        (added, removed or edited products), so the caller's indexes are stale.
+        """
+        _, _, _, changes, records, live = HEADER.unpack_from(self._mm, 0)
+        if records != self._records or live != self._live:
+            self._map()   # the file might have grown
+            self._records, self._live = records, live
+            self._index = None
+        if changes == self._changes:
+            return False
+        self._changes = changes
+        return True
+
+    def sync(self):
+        """Make sure everything we wrote is actually on disk"""
+        self._mm.flush()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def __repr__(self):
+        return f"MappedInventory({self.path!r}, {len(self)} products)"
+
+def import_products_csv(csv_path, store_path):
+    """Build a product file from products.csv. Returns how many products went in."""
+    positions = {}   # product ID -> where its record went
+    with open(csv_path, 'r', newline='') as src, atomic_writer(store_path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0, 0, 0))
+        for row in csv.DictReader(src):
+            pid = row.get('Product ID')
+            if not pid or not row.get('Name'):
+                continue
+            record = RECORD.pack(1, _encode_pid(pid), _encode_name(row['Name']),
+                                 float(row['Price']), int(row['Stock Quantity']),
+                                 (row.get('Version') or '').encode('ascii', 'ignore')[:TOKEN_WIDTH])
+            if pid in positions:
+                # Same as load_inventory: the last row for an ID wins
+                out.seek(positions[pid])
+                out.write(record)
+                out.seek(0, os.SEEK_END)
+            else:
+                positions[pid] = out.tell()
+                out.write(record)
+        count = len(positions)
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0, count, count))
+    return count
+
+def export_products_csv(store_path, csv_path):
+    """Write the product file back out as products.csv. Returns how many products."""
+    store = MappedInventory(store_path)
+    try:
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Product ID', 'Name', 'Price', 'Stock Quantity'])
+            mm = store._mm
+            count = 0
+            for recno in range(store._records):
+                offset = store._offset(recno)
+                live, pid, name, price, stock, _ = RECORD.unpack_from(mm, offset)
+                if live:
+                    writer.writerow([_decode(pid), _decode(name), price, stock])
+                    count += 1
+    finally:
+        store.close()
+    return count
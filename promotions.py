@@ -0,0 +1,190 @@
+# promotions.py
+"""
+Promotions: price cuts on single products, on top of the whole-bill
+discount the cashier types in. They live in PROMOTIONS_FILE (backend.py),
+a JSON list of rules like these:
+
+    {"id": "TEA-20", "kind": "markdown", "products": ["P001"], "percent": 20}
+    {"id": "TEA-NOW", "kind": "markdown", "products": ["P001"], "price": 3.50}
+    {"id": "SOAP-3FOR2", "kind": "bogo", "products": ["P002", "P003"], "buy": 2, "get": 1}
+    {"id": "RICE-BULK", "kind": "bulk", "products": ["P004"], "tiers": [[10, 4.50], [50, 4.00]]}
+
+- markdown: percent off, or a new price
+- bogo: buy `buy`, get `get` more at `percent` off (100 = free, the default)
+- bulk: buying at least N makes the unit price drop to the tier's price
+
+Any rule can have a time window: "start" / "end" ('YYYY-MM-DD' or
+'YYYY-MM-DD HH:MM:SS', both included) and "hours": "16:00-18:00" for a
+daily happy hour. "name" is what goes on the receipt, otherwise it's made
+up from the rule.
+
+The rules get compiled into tables keyed by product ID when the file is
+loaded (ones that are already over get dropped), so pricing a cart only
+looks at the rules for the products in it. Per line the customer gets the
+lowest unit price out of the markdowns and bulk tiers, and then the best
+buy-X-get-Y on top of that - they don't stack within a kind.
+"""
+
+import json
+from bisect import bisect_right
+
+from money import format_cents, percent_of, to_cents
+
+KINDS = ('markdown', 'bogo', 'bulk')
+
+def _stamp(value, end=False):
+    """'YYYY-MM-DD[ HH:MM:SS]' as a full timestamp string (comparable as text)"""
+    value = str(value).strip()
+    if len(value) == 10:
+        value += ' 23:59:59' if end else ' 00:00:00'
+    if len(value) != 19 or value[4] != '-' or value[13] != ':':
+        raise ValueError(f"bad time '{value}', use YYYY-MM-DD or YYYY-MM-DD HH:MM:SS")
+    return value
+
+class _Rule:
+    """One compiled rule. unit_price() / free_discount() do the maths, in cents."""
+
+    __slots__ = ('id', 'kind', 'products', 'label', 'start', 'end', 'hours',
+                 'percent', 'price', 'buy', 'get', 'tier_qty', 'tier_price')
+
+    def __init__(self, rule):
+        self.id = str(rule.get('id') or '')
+        self.kind = rule.get('kind')
+        if self.kind not in KINDS:
+            raise ValueError(f"kind has to be one of {', '.join(KINDS)}")
+        products = rule.get('products') or ([rule['product']] if rule.get('product') else [])
+        if not products:
+            raise ValueError("no products")
+        self.products = [str(pid) for pid in products]
+        self.start = _stamp(rule['start']) if rule.get('start') else None
+        self.end = _stamp(rule['end'], end=True) if rule.get('end') else None
+        self.hours = None
+        if rule.get('hours'):
+            start, _, end = str(rule['hours']).partition('-')
+            self.hours = (start.strip().zfill(5), end.strip().zfill(5))
+        self.percent = float(rule.get('percent', 100 if self.kind == 'bogo' else 0))
+        self.price = to_cents(rule['price']) if rule.get('price') is not None else None
+        self.buy = int(rule.get('buy', 0))
+        self.get = int(rule.get('get', 0))
+        self.tier_qty = []
+        self.tier_price = []
+
+        if self.kind == 'markdown':
+            if self.price is None and not 0 < self.percent <= 100:
+                raise ValueError("a markdown needs a price, or a percent between 0 and 100")
+            label = f"Now {format_cents(self.price)}" if self.price is not None else f"{self.percent:g}% off"
+        elif self.kind == 'bogo':
+            if self.buy < 1 or self.get < 1 or not 0 < self.percent <= 100:
+                raise ValueError("buy and get have to be at least 1, percent between 0 and 100")
+            deal = 'free' if self.percent == 100 else f"{self.percent:g}% off"
+            label = f"Buy {self.buy} get {self.get} {deal}"
+        else:
+            tiers = sorted((int(qty), to_cents(price)) for qty, price in rule.get('tiers') or [])
+            if not tiers or tiers[0][0] < 1:
+                raise ValueError("bulk needs tiers: [[minimum quantity, unit price], ...]")
+            self.tier_qty = [qty for qty, _ in tiers]
+            self.tier_price = [price for _, price in tiers]
+            label = "Bulk " + ", ".join(f"{qty}+ {format_cents(price)}" for qty, price in tiers)
+        self.label = str(rule.get('name') or label)
+
+    def active(self, stamp):
+        """Is it on at stamp ('YYYY-MM-DD HH:MM:SS')?"""
+        if self.start and stamp < self.start:
+            return False
+        if self.end and stamp > self.end:
+            return False
+        if self.hours:
+            start, end = self.hours
+            time = stamp[11:16]
+            if start <= end:
+                return start <= time < end
+            return time >= start or time < end   # runs past midnight
+        return True
+
+    def unit_price(self, unit_cents, qty):
+        """Markdowns and bulk tiers: the price per unit with this rule"""
+        if self.kind == 'markdown':
+            if self.price is not None:
+                return min(self.price, unit_cents)
+            return unit_cents - percent_of(unit_cents, self.percent)
+        n = bisect_right(self.tier_qty, qty)
+        return min(self.tier_price[n - 1], unit_cents) if n else unit_cents
+
+    def free_discount(self, unit_cents, qty):
+        """Buy X get Y: cents off a line of qty at unit_cents"""
+        free = qty // (self.buy + self.get) * self.get
+        return percent_of(unit_cents * free, self.percent) if free else 0
+
+class PromotionEngine:
+    """
+    The rules, compiled into two tables keyed by product ID: the ones that
+    change the unit price (markdowns, bulk) and the buy-X-get-Y ones.
+    Rules that don't make sense get skipped and listed in `errors`.
+    """
+
+    def __init__(self, rules=(), now=None):
+        self.rules = []
+        self.errors = []
+        self._unit_rules = {}   # product ID -> [rule]
+        self._bogo_rules = {}   # product ID -> [rule]
+        for n, rule in enumerate(rules, start=1):
+            try:
+                compiled = _Rule(rule)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                self.errors.append((n, rule.get('id') if isinstance(rule, dict) else None, str(e)))
+                continue
+            if now and compiled.end and compiled.end < now:
+                continue   # already over
+            self.rules.append(compiled)
+            table = self._bogo_rules if compiled.kind == 'bogo' else self._unit_rules
+            for pid in compiled.products:
+                table.setdefault(pid, []).append(compiled)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def price_line(self, pid, qty, unit_cents, stamp):
+        """(cents off, what for) for one cart line, (0, None) when nothing applies"""
+        unit, label = unit_cents, None
+        for rule in self._unit_rules.get(pid, ()):
+            if rule.active(stamp):
+                price = rule.unit_price(unit_cents, qty)
+                if price < unit:
+                    unit, label = price, rule.label
+        off = (unit_cents - unit) * qty
+        best, bogo_label = 0, None
+        for rule in self._bogo_rules.get(pid, ()):
+            if rule.active(stamp):
+                free = rule.free_discount(unit, qty)
+                if free > best:
+                    best, bogo_label = free, rule.label
+        if best:
+            off += best
+            label = f"{label}, {bogo_label}" if label else bogo_label
+        return off, label
+
+    def price_cart(self, lines, when):
+        """
+        lines is [(pid, qty, unit cents)]. Returns a (cents off, label) per
+        line, or None if no promotion touched the cart.
+        """
+        if not self.rules:
+            return None
+        stamp = when.strftime('%Y-%m-%d %H:%M:%S')
+        discounts = [self.price_line(pid, qty, unit_cents, stamp) for pid, qty, unit_cents in lines]
+        return discounts if any(off for off, _ in discounts) else None
+
+    def active(self, when):
+        """The rules that are on at `when` (a datetime)"""
+        stamp = when.strftime('%Y-%m-%d %H:%M:%S')
+        return [rule for rule in self.rules if rule.active(stamp)]
+
+def load_rules(path):
+    """The list of rule dicts in a promotions file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        rules = json.load(f)
+    if isinstance(rules, dict):
+        rules = rules.get('rules', [])
+    if not isinstance(rules, list):
+        raise ValueError("expected a list of rules")
+    return rules
@@ -0,0 +1,314 @@
+# receipt_archive.py
+"""
+Receipts packed into a few big files instead of one small file each.
+After a few busy months the receipts folder had hundreds of thousands of
+files in it, and finding one meant walking the whole folder.
+
+    receipts/archive/
+        seg-000001.dat    receipts one after another, a new segment every SEGMENT_BYTES
+        index.csv         bill ID, format, date -> segment, offset, length (append-only)
+        archive.lock      several tills can add receipts at once
+
+Each record is a small header (with a CRC32), the receipt's key and its
+content, zlib-compressed when that makes it smaller. The index is loaded
+into a dict when the archive opens, so getting a receipt back is a dict
+lookup plus one read; listing a date range only looks at those days.
+
+Receipts can always be rendered again from the sales log, so nothing here
+gets fsynced on every add. A crash can tear the last record, which gets
+cut off (and anything the index missed gets re-indexed) next time the
+archive is opened.
+"""
+
+import csv
+import io
+import os
+import re
+import struct
+import threading
+import zlib
+from datetime import datetime
+
+from durable import fsync_dir, repair_partial_line
+from locking import FileLock
+
+SEGMENT_BYTES = 64 * 1024 * 1024
+FORMATS = ('txt', 'csv', 'json')
+
+# magic, flags, format, key length, data length, CRC32 of key + data
+_HEADER = struct.Struct('<2sBBHII')
+_MAGIC = b'RA'
+_COMPRESSED = 1
+
+_DATE = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+_FILE_NAME = re.compile(r'^receipt_(.+)\.(txt|csv|json)$')
+
+def _segment_name(number):
+    return f"seg-{number:06d}.dat"
+
+class ReceiptArchive:
+    """Append-only receipt store, see the top of this file"""
+
+    def __init__(self, folder, segment_bytes=SEGMENT_BYTES, compress=True):
+        self.folder = folder
+        self.segment_bytes = segment_bytes
+        self.compress = compress
+        os.makedirs(folder, exist_ok=True)
+        self.index_path = os.path.join(folder, 'index.csv')
+        self._lock = FileLock(os.path.join(folder, 'archive.lock'))
+        self._entries = {}   # (bill ID, format) -> (date, segment, offset, length)
+        self._by_day = {}    # 'YYYY-MM-DD' -> [(bill ID, format)]
+        self._index_offset = 0
+        self._read_lock = threading.Lock()
+        with self._lock:
+            self._recover()
+
+    # --- The index ---
+
+    def _add_entry(self, bill_id, fmt, date, segment, offset, length):
+        key = (bill_id, fmt)
+        if key not in self._entries:
+            self._by_day.setdefault(date[:10], []).append(key)
+        self._entries[key] = (date, segment, offset, length)
+
+    def _catch_up(self):
+        """Read index lines other tills (or we) added since last time"""
+        with self._read_lock:
+            try:
+                f = open(self.index_path, 'rb')
+            except FileNotFoundError:
+                return
+            with f:
+                f.seek(self._index_offset)
+                data = f.read()
+            end = data.rfind(b'\n') + 1   # a line still being written waits for next time
+            for row in csv.reader(io.StringIO(data[:end].decode('utf-8'), newline='')):
+                if len(row) == 6:
+                    self._add_entry(row[0], row[1], row[2], int(row[3]), int(row[4]), int(row[5]))
+            self._index_offset += end
+
+    def _append_index(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(rows)
+        with open(self.index_path, 'a', newline='', encoding='utf-8') as f:
+            f.write(buffer.getvalue())
+
+    # --- Segments ---
+
+    def _segments(self):
+        numbers = []
+        for name in os.listdir(self.folder):
+            if name.startswith('seg-') and name.endswith('.dat'):
+                try:
+                    numbers.append(int(name[4:-4]))
+                except ValueError:
+                    continue
+        return sorted(numbers)
+
+    def _segment_path(self, number):
+        return os.path.join(self.folder, _segment_name(number))
+
+    def _read_record(self, f):
+        """(key, format, data) of the record at f's position, None if it's torn or broken"""
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return None
+        magic, flags, fmt_code, key_length, data_length, crc = _HEADER.unpack(header)
+        if magic != _MAGIC or fmt_code >= len(FORMATS):
+            return None
+        body = f.read(key_length + data_length)
+        if len(body) < key_length + data_length or zlib.crc32(body) != crc:
+            return None
+        data = body[key_length:]
+        if flags & _COMPRESSED:
+            data = zlib.decompress(data)
+        return body[:key_length].decode('utf-8'), FORMATS[fmt_code], data
+
+    def _recover(self):
+        """
+        Called holding the archive lock. Cuts a torn line off the index and
+        a torn record off the segments, and indexes whatever records made
+        it into a segment but not into the index.
+        """
+        if os.path.exists(self.index_path):
+            repair_partial_line(self.index_path)
+        self._catch_up()
+        indexed_ends = {}
+        for _, segment, offset, length in self._entries.values():
+            indexed_ends[segment] = max(indexed_ends.get(segment, 0), offset + length)
+        missed = []
+        for number in self._segments():
+            path = self._segment_path(number)
+            good = indexed_ends.get(number, 0)
+            if os.path.getsize(path) <= good:
+                continue
+            with open(path, 'r+b') as f:
+                size = f.seek(0, os.SEEK_END)
+                f.seek(good)
+                while good < size:
+                    record = self._read_record(f)
+                    if record is None:
+                        break
+                    key, fmt, _ = record
+                    bill_id, date = key.rsplit('|', 1)
+                    missed.append([bill_id, fmt, date, number, good, f.tell() - good])
+                    good = f.tell()
+                if good < size:
+                    f.truncate(good)
+                    print(f"Receipt archive: cut a half-written receipt off {path}")
+        if missed:
+            self._append_index(missed)
+            self._catch_up()
+
+    # --- Adding and reading ---
+
+    def _pack(self, bill_id, fmt, date, content):
+        data = content.encode('utf-8')
+        flags = 0
+        if self.compress:
+            packed = zlib.compress(data, 6)
+            if len(packed) < len(data):
+                data, flags = packed, _COMPRESSED
+        # The key goes in the record too, so the index can be rebuilt from the segments
+        key = f"{bill_id}|{date}".encode('utf-8')
+        body = key + data
+        return _HEADER.pack(_MAGIC, flags, FORMATS.index(fmt), len(key), len(data), zlib.crc32(body)) + body
+
+    def add(self, bill_id, fmt, date, content):
+        """
+        Store one receipt (content as text) under its bill ID and format.
+        date is 'YYYY-MM-DD HH:MM:SS'. Adding the same receipt again replaces it.
+        """
+        self.add_many([(bill_id, fmt, date, content)])
+
+    def add_many(self, receipts):
+        """add() for a list of (bill ID, format, date, content), with one lock and one index write"""
+        records = [(bill_id, fmt, date, self._pack(bill_id, fmt, date, content))
+                   for bill_id, fmt, date, content in receipts]
+        with self._lock:
+            segments = self._segments()
+            number = segments[-1] if segments else 1
+            index_rows = []
+            f = open(self._segment_path(number), 'ab')
+            try:
+                offset = f.seek(0, os.SEEK_END)
+                for bill_id, fmt, date, record in records:
+                    if offset and offset + len(record) > self.segment_bytes:
+                        f.close()
+                        number += 1
+                        f = open(self._segment_path(number), 'ab')
+                        offset = 0
+                    f.write(record)
+                    index_rows.append([bill_id, fmt, date, number, offset, len(record)])
+                    offset += len(record)
+            finally:
+                f.close()
+            self._append_index(index_rows)
+            self._catch_up()
+
+    def _find(self, bill_id, fmt):
+        for name in ([fmt] if fmt else FORMATS):
+            entry = self._entries.get((bill_id, name))
+            if entry is not None:
+                return name, entry
+        return None, None
+
+    def get(self, bill_id, fmt=None):
+        """The receipt's content, in fmt (or whichever format it was saved in). None if it isn't here."""
+        fmt, entry = self._find(bill_id, fmt)
+        if entry is None:
+            self._catch_up()   # maybe another till just added it
+            fmt, entry = self._find(bill_id, fmt)
+            if entry is None:
+                return None
+        _, segment, offset, length = entry
+        with open(self._segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            record = self._read_record(f)
+        if record is None:
+            raise ValueError(f"Receipt {bill_id} is damaged in {_segment_name(segment)}")
+        return record[2].decode('utf-8')
+
+    def list(self, start=None, end=None):
+        """[(date, bill ID, format)] between start and end (days, both included), oldest first"""
+        self._catch_up()
+        found = []
+        for day in sorted(self._by_day):
+            if (start and day < start) or (end and day > end):
+                continue
+            found.extend((self._entries[key][0], *key) for key in self._by_day[day])
+        found.sort()
+        return found
+
+    def __contains__(self, bill_id):
+        return self._find(bill_id, None)[1] is not None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def sync(self):
+        """fsync the newest segment and the index (only the migration bothers)"""
+        with self._lock:
+            segments = self._segments()
+            for path in ([self._segment_path(segments[-1])] if segments else []) + [self.index_path]:
+                if os.path.exists(path):
+                    with open(path, 'ab') as f:
+                        os.fsync(f.fileno())
+            fsync_dir(self.index_path)
+
+def _receipt_date(content, path):
+    """When a receipt file is from: the date printed on it, else the name, else the file's time"""
+    match = _DATE.search(content[:1000])
+    if match:
+        return match.group(0)
+    match = re.search(r'(\d{8})[_-](\d{6})', os.path.basename(path))
+    if match:
+        try:
+            return datetime.strptime(''.join(match.groups()), '%Y%m%d%H%M%S').strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d %H:%M:%S')
+
+def migrate_receipt_files(folder, archive, delete=False):
+    """
+    Move receipt_<bill>.<txt|csv|json> files from folder into the archive.
+    Files get deleted only with delete=True, and only once the archive is
+    fsynced. Receipts already in the archive are skipped (and still
+    deleted). Returns (archived, skipped).
+    """
+    archived = skipped = 0
+    done = []
+    pending = []
+    for entry in os.scandir(folder):
+        match = _FILE_NAME.match(entry.name)
+        if not match or not entry.is_file():
+            continue
+        bill_id, fmt = match.groups()
+        if archive._find(bill_id, fmt)[1] is not None:
+            skipped += 1
+            done.append(entry.path)
+            continue
+        try:
+            with open(entry.path, 'r', encoding='utf-8', newline='') as f:
+                content = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Skipping {entry.path}: {e}")
+            skipped += 1
+            continue
+        pending.append((bill_id, fmt, _receipt_date(content, entry.path), content))
+        done.append(entry.path)
+        if len(pending) >= 1000:
+            archive.add_many(pending)
+            archived += len(pending)
+            pending = []
+    if pending:
+        archive.add_many(pending)
+        archived += len(pending)
+    archive.sync()
+    if delete:
+        for path in done:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Couldn't delete {path}: {e}")
+    return archived, skipped
@@ -0,0 +1,226 @@
+# receipts.py
+"""
+Receipts: what's on them, how they look (text, CSV or JSON) and saving
+them to disk without making the cashier wait.
+The layout bits get put together once when this file loads instead of
+for every line of every receipt.
+"""
+
+import csv
+import io
+import json
+import os
+import queue
+import threading
+
+import metrics
+from money import format_cents, percent_of, to_amount
+
+WIDTH = 50
+NAME_WIDTH = 20
+
+# The text layout, ready to go
+_RULE = "=" * WIDTH
+_THIN_RULE = "-" * WIDTH
+_TITLE = f"RECEIPT\n{_RULE}\nDate: "
+_COLUMNS = f"\n{'Item':{NAME_WIDTH}} {'Qty':>4} {'Price':>9} {'Total':>10}\n{_THIN_RULE}"
+_LINE = f"{{:{NAME_WIDTH}}} {{:4}} {{:9.2f}} {{:10.2f}}".format
+_SUM = "{:>43} {:10.2f}".format
+_DISCOUNT = "{:>43} -{:10.2f}".format
+_LINE_DISCOUNT = "  {:41} -{:10.2f}".format
+_FOOTER = f"{_RULE}\nThank you for your business!"
+
+ARCHIVE_BATCH = 256   # most queued receipts that go into the archive in one write
+
+CSV_COLUMNS = ['Bill ID', 'Date', 'Product ID', 'Name', 'Quantity', 'Unit Price', 'Line Total', 'Discount %',
+               'Promotion', 'Promotion Discount']
+
+def _short_name(name):
+    return name[:NAME_WIDTH - 3] + "..." if len(name) > NAME_WIDTH else name
+
+class Receipt:
+    """
+    One bill: when, what was bought (product ID, name, quantity, unit price
+    in cents) and the discount. str() gives the printed receipt.
+    line_discounts, if any promotions applied, has a (cents off, label)
+    per item; the bill's discount % comes off what's left after them.
+    Pass total_cents when it's already known (e.g. from the sales log),
+    otherwise it's worked out from the items and the discount.
+    """
+
+    def __init__(self, bill_id, when, items, discount_percent=0, total_cents=None, line_discounts=None):
+        self.bill_id = bill_id
+        self.when = when
+        self.items = items
+        self.discount_percent = discount_percent
+        self.line_discounts = line_discounts
+        self.subtotal_cents = sum(price * qty for _, _, qty, price in items)
+        self.promotion_cents = sum(off for off, _ in line_discounts) if line_discounts else 0
+        after_promotions = self.subtotal_cents - self.promotion_cents
+        if total_cents is None:
+            self.discount_cents = percent_of(after_promotions, discount_percent) if discount_percent > 0 else 0
+            self.total_cents = after_promotions - self.discount_cents
+        else:
+            self.discount_cents = after_promotions - total_cents
+            self.total_cents = total_cents
+        self._text = None
+        self._date = None
+
+    @property
+    def date(self):
+        if self._date is None:
+            self._date = self.when.strftime('%Y-%m-%d %H:%M:%S')
+        return self._date
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = render_text(self)
+        return self._text
+
+    def __str__(self):
+        return self.text
+
+    def line_discount(self, n):
+        """(cents off, label) for item n, (0, None) without a promotion"""
+        return self.line_discounts[n] if self.line_discounts else (0, None)
+
+    def to_dict(self):
+        items = []
+        for n, (pid, name, qty, price) in enumerate(self.items):
+            item = {'id': pid, 'name': name, 'quantity': qty, 'unit_price': to_amount(price),
+                    'total': to_amount(price * qty)}
+            off, label = self.line_discount(n)
+            if off:
+                item.update(promotion=label, promotion_discount=to_amount(off))
+            items.append(item)
+        return {
+            'bill_id': self.bill_id,
+            'date': self.date,
+            'items': items,
+            'subtotal': to_amount(self.subtotal_cents),
+            'promotions': to_amount(self.promotion_cents),
+            'discount_percent': self.discount_percent,
+            'discount': to_amount(self.discount_cents),
+            'total': to_amount(self.total_cents),
+        }
+
+def render_text(receipt):
+    """The printed receipt"""
+    parts = [_TITLE, receipt.date]
+    if receipt.bill_id:
+        parts += ["\nBill: ", receipt.bill_id]
+    parts.append("\n")
+    parts.append(_COLUMNS)
+    line_discounts = receipt.line_discounts
+    for n, (_, name, qty, price) in enumerate(receipt.items):
+        parts += ["\n", _LINE(_short_name(name), qty, price / 100, price * qty / 100)]
+        if line_discounts and line_discounts[n][0]:
+            off, label = line_discounts[n]
+            parts += ["\n", _LINE_DISCOUNT(label[:41], off / 100)]
+    parts += ["\n", _THIN_RULE, "\n", _SUM('Subtotal:', receipt.subtotal_cents / 100)]
+    if receipt.promotion_cents:
+        parts += ["\n", _DISCOUNT('Promotions:', receipt.promotion_cents / 100)]
+    if receipt.discount_percent > 0:
+        parts += ["\n", _DISCOUNT(f"Discount ({receipt.discount_percent}%):", receipt.discount_cents / 100)]
+    parts += ["\n", _SUM('Total:', receipt.total_cents / 100), "\n", _FOOTER]
+    return ''.join(parts)
+
+def render_csv(receipt):
+    """One row per item, so it opens properly in a spreadsheet"""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(CSV_COLUMNS)
+    for n, (pid, name, qty, price) in enumerate(receipt.items):
+        off, label = receipt.line_discount(n)
+        writer.writerow([receipt.bill_id, receipt.date, pid, name, qty, format_cents(price),
+                         format_cents(price * qty), receipt.discount_percent,
+                         label or '', format_cents(off) if off else ''])
+    return out.getvalue()
+
+def render_json(receipt):
+    return json.dumps(receipt.to_dict(), indent=2)
+
+RENDERERS = {'txt': render_text, 'csv': render_csv, 'json': render_json}
+
+def receipt_filename(folder, receipt, fmt):
+    """Named after the bill ID, so two receipts in the same second can't clash"""
+    return os.path.join(folder, f"receipt_{receipt.bill_id}.{fmt}")
+
+def _write_file(filename, content):
+    # newline='' so the CSV keeps its own line endings
+    with open(filename, 'w', encoding='utf-8', newline='') as f:
+        f.write(content)
+
+class ReceiptWriter:
+    """
+    Writes receipts on a background thread. save() (a file per receipt)
+    and archive() (into a ReceiptArchive) hand the receipt over and return
+    straight away; flush() waits until everything handed over is written.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.failed = 0
+
+    def save(self, receipt, folder, fmt='txt'):
+        if fmt not in RENDERERS:
+            raise ValueError(f"Unknown receipt format '{fmt}', use one of {', '.join(RENDERERS)}")
+        filename = receipt_filename(folder, receipt, fmt)
+        self._ensure_started()
+        self._queue.put((_write_file, filename, receipt, fmt))
+        return filename
+
+    def archive(self, receipt, archive, fmt='txt'):
+        """Like save(), but into the archive. Returns where it'll be, for showing."""
+        if fmt not in RENDERERS:
+            raise ValueError(f"Unknown receipt format '{fmt}', use one of {', '.join(RENDERERS)}")
+        self._ensure_started()
+        self._queue.put((None, archive, receipt, fmt))
+        return f"{archive.folder} (bill {receipt.bill_id}, {fmt})"
+
+    def flush(self):
+        if self._thread is not None:
+            self._queue.join()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='receipt-writer', daemon=True)
+                self._thread.start()
+
+    def _failed(self, receipts, error):
+        self.failed += len(receipts)
+        metrics.count('save_failures_total', len(receipts), file='receipt')
+        print(f"Failed to save receipt {', '.join(r.bill_id for r in receipts)}: {error}")
+
+    def _run(self):
+        while True:
+            # Take whatever's queued up, so the archive gets them in one write
+            jobs = [self._queue.get()]
+            while len(jobs) < ARCHIVE_BATCH:
+                try:
+                    jobs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            archived = {}   # id(archive) -> (archive, [(bill ID, format, date, content)], [receipt])
+            for write, target, receipt, fmt in jobs:
+                try:
+                    content = RENDERERS[fmt](receipt)
+                    if write is None:
+                        entry = archived.setdefault(id(target), (target, [], []))
+                        entry[1].append((receipt.bill_id, fmt, receipt.date, content))
+                        entry[2].append(receipt)
+                    else:
+                        write(target, content)
+                except Exception as e:
+                    self._failed([receipt], e)
+            for archive, receipts, originals in archived.values():
+                try:
+                    archive.add_many(receipts)
+                except Exception as e:
+                    self._failed(originals, e)
+            for _ in jobs:
+                self._queue.task_done()
@@ -0,0 +1,171 @@
+# reorder.py
+"""
+Reorder analytics: how fast every product sells, how many days the stock
+on hand will last, and how much to order. The low stock report only looks
+at the stock left, so it can't tell a slow seller with 20 left from a fast
+one that'll be gone by tonight.
+
+The sales summary already has units sold per product per day. Those go
+into one days x products matrix (NumPy if it's installed, otherwise a
+typed array per day), and every figure below gets worked out for the
+whole catalog at once - column sums over the matrix instead of a loop per
+product:
+
+    velocity        units/day over the last `window` days
+    days of cover   stock / velocity (inf when it isn't selling)
+    reorder point   velocity * lead time + safety stock, where the safety
+                    stock is SERVICE_Z standard deviations of daily sales
+                    over the lead time
+    suggested order enough to get back up to reorder point + `cover_days`
+                    of sales, once stock is at or below the reorder point
+"""
+
+import math
+import operator
+from array import array
+from datetime import datetime, timedelta
+from itertools import repeat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SERVICE_Z = 1.65   # safety stock in standard deviations (~95% of lead times don't run out)
+_CHUNK_DAYS = 32   # matrix rows squared at a time, so it's never all copied at once
+_CHUNK_PRODUCTS = 4096   # same idea for the columns without NumPy
+
+def _day_range(end, days):
+    last = datetime.strptime(end, '%Y-%m-%d')
+    return [(last - timedelta(days=n)).strftime('%Y-%m-%d') for n in range(days - 1, -1, -1)]
+
+class SalesMatrix:
+    """
+    Units sold, one row per day (oldest first) and one column per product.
+    `rows` is a 2-D NumPy array, or without NumPy a list of array('l').
+    """
+
+    def __init__(self, products, days, rows):
+        self.products = products
+        self.days = days
+        self.rows = rows
+
+    @classmethod
+    def from_summary(cls, summary_days, products, end, days):
+        """
+        The `days` days up to and including `end` out of the sales
+        summary's {'YYYY-MM-DD': {'products': {pid: quantity}}}. Columns
+        follow `products`; sales of anything not in there are left out.
+        """
+        columns = {pid: n for n, pid in enumerate(products)}
+        day_list = _day_range(end, days)
+        if numpy is not None:
+            rows = numpy.zeros((days, len(products)), dtype=numpy.int32)
+        else:
+            empty = array('l', bytes(array('l').itemsize * len(products)))
+        built = []
+        for n, day in enumerate(day_list):
+            sold = summary_days.get(day, {}).get('products', {})
+            where = map(columns.get, sold, repeat(-1, len(sold)))   # -1 = not a product we have
+            if numpy is not None:
+                if sold:
+                    where = numpy.fromiter(where, dtype=numpy.int64, count=len(sold))
+                    qty = numpy.fromiter(sold.values(), dtype=numpy.int32, count=len(sold))
+                    keep = where >= 0
+                    rows[n, where[keep]] = qty[keep]
+            else:
+                row = array('l', empty)
+                for column, qty in zip(where, sold.values()):
+                    if column >= 0:
+                        row[column] = qty
+                built.append(row)
+        return cls(products, day_list, rows if numpy is not None else built)
+
+    def __len__(self):
+        return len(self.days)
+
+    def column_stats(self, window):
+        """(total, sum of squares) per product over the last `window` days"""
+        if numpy is not None:
+            recent = self.rows[-window:] if window else self.rows[:0]
+            totals = recent.sum(axis=0, dtype=numpy.int64)
+            squares = numpy.zeros(len(self.products), dtype=numpy.int64)
+            for start in range(0, len(recent), _CHUNK_DAYS):
+                chunk = recent[start:start + _CHUNK_DAYS].astype(numpy.int64)
+                squares += (chunk * chunk).sum(axis=0)
+            return totals, squares
+        recent = self.rows[-window:] if window else []
+        if not recent:
+            zeros = [0] * len(self.products)
+            return zeros, zeros
+        totals = []
+        squares = []
+        # A slice of the products at a time, so the columns never all exist at once
+        for start in range(0, len(self.products), _CHUNK_PRODUCTS):
+            columns = list(zip(*[row[start:start + _CHUNK_PRODUCTS] for row in recent]))
+            totals.extend(map(sum, columns))
+            squares.extend(sum(map(operator.mul, column, column)) for column in columns)
+        return totals, squares
+
+class ReorderAnalysis:
+    """
+    The figures for every product (parallel sequences, in `products`
+    order). needing_order() picks out the ones to do something about.
+    """
+
+    def __init__(self, products, stock, velocity, cover, reorder_point, suggested):
+        self.products = products
+        self.stock = stock
+        self.velocity = velocity
+        self.cover = cover
+        self.reorder_point = reorder_point
+        self.suggested = suggested
+
+    def __len__(self):
+        return len(self.products)
+
+    def needing_order(self, limit=None):
+        """
+        [(pid, stock, velocity, days of cover, suggested order)] for the
+        products with something to order, the ones running out soonest first
+        """
+        if numpy is not None and isinstance(self.suggested, numpy.ndarray):
+            picked = numpy.flatnonzero(self.suggested > 0)
+            picked = picked[numpy.argsort(self.cover[picked], kind='stable')][:limit]
+            picked = picked.tolist()
+        else:
+            picked = [n for n, qty in enumerate(self.suggested) if qty > 0]
+            picked.sort(key=self.cover.__getitem__)
+            picked = picked[:limit]
+        return [(self.products[n], int(self.stock[n]), float(self.velocity[n]),
+                 float(self.cover[n]), int(self.suggested[n])) for n in picked]
+
+def analyze(matrix, stock, window, lead_time, cover_days, selling_days=None):
+    """
+    Work out the figures for every product in the matrix. stock lines up
+    with matrix.products. selling_days caps the window for a shop that
+    hasn't been open that long (otherwise its velocity comes out too low).
+    """
+    window = min(window, len(matrix))
+    days = max(1, min(window, selling_days or window))
+    totals, squares = matrix.column_stats(window)
+    if numpy is not None:
+        stock = numpy.asarray(stock, dtype=numpy.int64)
+        velocity = totals / days
+        spread = numpy.sqrt(numpy.maximum(squares / days - velocity * velocity, 0.0))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            cover = numpy.where(velocity > 0, stock / velocity, numpy.inf)
+        reorder_point = velocity * lead_time + SERVICE_Z * spread * math.sqrt(lead_time)
+        wanted = numpy.ceil(reorder_point + velocity * cover_days - stock)
+        suggested = numpy.where((velocity > 0) & (stock <= reorder_point),
+                                numpy.maximum(wanted, 0), 0).astype(numpy.int64)
+        return ReorderAnalysis(matrix.products, stock, velocity, cover, reorder_point, suggested)
+
+    velocity = [total / days for total in totals]
+    root_lead = math.sqrt(lead_time)
+    reorder_point = [v * lead_time + SERVICE_Z * math.sqrt(max(sq / days - v * v, 0.0)) * root_lead
+                     for v, sq in zip(velocity, squares)]
+    cover = [s / v if v > 0 else math.inf for s, v in zip(stock, velocity)]
+    suggested = [max(math.ceil(point + v * cover_days - s), 0) if v > 0 and s <= point else 0
+                 for s, v, point in zip(stock, velocity, reorder_point)]
+    return ReorderAnalysis(matrix.products, stock, velocity, cover, reorder_point, suggested)
@@ -0,0 +1,149 @@
+# search.py
+"""
+Search index for the product lookup.
+Scanning every product on every search got slow once the catalog got big,
+so this keeps a little n-gram index next to the inventory instead.
+"""
+
+import heapq
+
+GRAM_SIZE = 3  # we index every 3 letter chunk of IDs and names
+
+def _grams(text):
+    """Every substring of length GRAM_SIZE in the text"""
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+class SearchIndex:
+    """
+    Lowercase trigram index over product IDs and names.
+    A search term is only ever checked against products that contain all of
+    its trigrams, so we skip almost the whole catalog on most searches.
+    Terms shorter than a trigram match most of the catalog anyway, so those
+    just go over the lowercased keys.
+    Gives exactly the same matches as the old substring scan.
+    """
+
+    def __init__(self, inventory=None):
+        self._postings = {}   # gram -> set of product IDs
+        self._keys = {}       # product ID -> (lowercase ID, lowercase name)
+        self._order = {}      # product ID -> position, so results keep inventory order
+        self._next_pos = 0
+
+        if inventory:
+            for pid, item in inventory.items():
+                self.add(pid, item['name'])
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, pid):
+        return pid in self._keys
+
+    def add(self, pid, name):
+        if pid in self._keys:
+            self.update(pid, name)
+            return
+        self._order[pid] = self._next_pos
+        self._next_pos += 1
+        self._index(pid, name)
+
+    def update(self, pid, name):
+        """Re-index a product (e.g. it got renamed) without moving it in the order"""
+        if pid not in self._keys:
+            self.add(pid, name)
+            return
+        if self._keys[pid][1] == name.lower():
+            return  # only the price or stock changed
+        self._unindex(pid)
+        self._index(pid, name)
+
+    def remove(self, pid):
+        if pid not in self._keys:
+            return
+        self._unindex(pid)
+        del self._order[pid]
+
+    def _index(self, pid, name):
+        keys = (pid.lower(), name.lower())
+        self._keys[pid] = keys
+        for gram in _grams(keys[0]) | _grams(keys[1]):
+            self._postings.setdefault(gram, set()).add(pid)
+
+    def _unindex(self, pid):
+        keys = self._keys.pop(pid)
+        for gram in _grams(keys[0]) | _grams(keys[1]):
+            pids = self._postings.get(gram)
+            if pids is not None:
+                pids.discard(pid)
+                if not pids:
+                    del self._postings[gram]
+
+    def _candidates(self, term):
+        if len(term) == GRAM_SIZE:
+            # Exactly one trigram, no need to double check
+            return self._postings.get(term, set()), False
+
+        posting_lists = []
+        for i in range(len(term) - GRAM_SIZE + 1):
+            pids = self._postings.get(term[i:i + GRAM_SIZE])
+            if not pids:
+                return set(), False
+            posting_lists.append(pids)
+        posting_lists.sort(key=len)
+        return set.intersection(*posting_lists), True
+
+    def _rank(self, pid, term):
+        """Lower is better: exact ID, exact name, prefix, word prefix, anywhere"""
+        pid_lower, name_lower = self._keys[pid]
+        if pid_lower == term:
+            score = 0
+        elif name_lower == term:
+            score = 1
+        elif pid_lower.startswith(term) or name_lower.startswith(term):
+            score = 2
+        elif (' ' + term) in name_lower:
+            score = 3
+        else:
+            score = 4
+        return (score, self._order[pid])
+
+    def search(self, search_term, limit=None, rank=False):
+        """
+        Product IDs whose ID or name contains the search term (case-insensitive).
+        Results come back in inventory order unless rank=True, which puts
+        exact and prefix matches first. limit caps how many we return.
+        """
+        term = search_term.lower()
+        keys = self._keys
+
+        if len(term) < GRAM_SIZE:
+            # Too short for the index, this matches most of the catalog anyway
+            matches = [pid for pid in self._order
+                       if term in keys[pid][0] or term in keys[pid][1]]
+            in_order = True
+        else:
+            candidates, need_check = self._candidates(term)
+            if need_check:
+                matches = [pid for pid in candidates
+                           if term in keys[pid][0] or term in keys[pid][1]]
+            else:
+                matches = candidates
+            in_order = False
+
+        if rank:
+            key = lambda pid: self._rank(pid, term)
+            if limit is not None and limit < len(matches):
+                return heapq.nsmallest(limit, matches, key=key)
+            return sorted(matches, key=key)
+
+        if not in_order:
+            if len(matches) * 8 > len(self._order):
+                # Lots of hits: walking the catalog in order beats sorting them
+                match_set = matches if isinstance(matches, set) else set(matches)
+                matches = [pid for pid in self._order if pid in match_set]
+            elif limit is not None and limit < len(matches):
+                return heapq.nsmallest(limit, matches, key=self._order.__getitem__)
+            else:
+                matches = sorted(matches, key=self._order.__getitem__)
+
+        return matches if limit is None else matches[:limit]
@@ -0,0 +1,286 @@
+# server.py
+"""
+Local HTTP/JSON server so more than one cashier (or a web shop) can use
+the same backend. Start it with `python main.py --serve`.
+
+The inventory stays loaded in memory. Checkouts from all the connections
+get queued up and written in batches - one fsync for the whole batch
+instead of one per order - and nobody gets an answer before their sale is
+safely on disk. Other requests read at the same time as each other, and
+only wait for the writer while it's changing things, not for its fsync.
+
+    GET  /products?limit=&offset=      list products
+    GET  /products/<id>                one product
+    GET  /search?q=&limit=&rank=1      search by name or ID
+    POST /checkout                     {"cart": {"id": qty}, "discount": 0}
+                                       200 sold, 409 not sold, 500 with "ok": null
+                                       if it was sold but couldn't be confirmed on
+                                       disk (don't ring that one up again)
+    GET  /reports/daily?date=YYYY-MM-DD
+    GET  /reports/low-stock?threshold=   (leave it out for reorder points)
+    GET  /reports/top?limit=5&start=&end=
+    GET  /metrics                      timings and counters, Prometheus text format
+    GET  /metrics.json                 the same as JSON (metrics.snapshot())
+"""
+
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import backend
+import metrics
+from locking import ReadWriteLock
+
+MAX_BATCH = 64          # most checkouts we write in one go
+REFRESH_INTERVAL = 1.0  # seconds between checks for changes made by tills (and for a new day)
+
+def _count(query, key, default=None):
+    """A count from the query string (limit, offset...), which can't be negative"""
+    if key not in query:
+        return default
+    value = int(query[key])
+    if value < 0:
+        raise ValueError(f"{key} can't be negative")
+    return value
+
+def _product_json(pid, item):
+    return {'id': pid, 'name': item['name'], 'price': item['price'], 'stock': item['stock']}
+
+class _PendingCheckout:
+    def __init__(self, cart, discount):
+        self.cart = cart
+        self.discount = discount
+        self.done = threading.Event()
+        self.result = None
+
+class ShopService:
+    """The shared state behind every request: the inventory plus the checkout writer"""
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+        self.lock = ReadWriteLock()   # requests read, the writer and maintenance threads write
+        backend.get_stock_index(inventory)   # build it now, not on the first request
+        self._checkouts = queue.Queue()
+        self._stopping = threading.Event()
+        self._writer = threading.Thread(target=self._write_checkouts, daemon=True)
+        self._writer.start()
+        self._maintenance = threading.Thread(target=self._maintain, daemon=True)
+        self._maintenance.start()
+
+    def read(self):
+        """The lock for reading: `with service.read():` around anything that looks at the data"""
+        return self.lock.reading()
+
+    def checkout(self, cart, discount):
+        """
+        backend.checkout()'s (success, message, receipt), except success is
+        None when the sale went through but the fsync after it failed.
+        """
+        pending = _PendingCheckout(cart, discount)
+        self._checkouts.put(pending)
+        pending.done.wait()
+        return pending.result
+
+    def close(self):
+        """Stop the writer and maintenance threads (after the checkouts already queued)"""
+        self._stopping.set()
+        self._checkouts.put(None)
+        self._writer.join()
+        self._maintenance.join()
+
+    def _write_checkouts(self):
+        while True:
+            batch = [self._checkouts.get()]
+            while len(batch) < MAX_BATCH and batch[-1] is not None:
+                try:
+                    batch.append(self._checkouts.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:   # close()
+                batch.pop()
+                if not batch:
+                    return
+                self._checkouts.put(None)
+
+            with backend.data_lock():
+                with self.lock.writing():
+                    for pending in batch:
+                        try:
+                            pending.result = backend.checkout(self.inventory, pending.cart,
+                                                              pending.discount, sync=False)
+                        except Exception as e:
+                            pending.result = (False, f"Checkout failed: {e}", None)
+                # Reads can carry on while we wait for the disk. Nothing gets undone
+                # if the fsync fails, so they aren't seeing anything that goes away.
+                try:
+                    backend.flush_pending_writes(self.inventory)
+                except Exception as e:
+                    # The stock is down and the sales are in the log, they just might
+                    # not be on disk. Saying they failed would get them sold again.
+                    for pending in batch:
+                        if pending.result[0]:
+                            receipt = pending.result[2]
+                            pending.result = (None, f"The sale went through but couldn't be confirmed "
+                                                    f"on disk ({e}). Check bill {receipt.bill_id} "
+                                                    f"before ringing it up again.", receipt)
+
+            for pending in batch:
+                pending.done.set()
+
+    def _maintain(self):
+        """
+        Catch up on other tills' changes every REFRESH_INTERVAL, and once the
+        day changes compress the sales days that got old enough. It holds
+        the locks like a batch of checkouts would, so no request has to do it.
+        """
+        day = datetime.now().strftime('%Y-%m-%d')
+        while not self._stopping.wait(REFRESH_INTERVAL):
+            try:
+                with backend.data_lock(), self.lock.writing():
+                    backend.refresh_inventory(self.inventory)
+            except Exception as e:
+                print(f"Warning: Couldn't catch up on the other tills' changes: {e}")
+            today = datetime.now().strftime('%Y-%m-%d')
+            if today != day:
+                day = today
+                with backend.data_lock(), self.lock.writing():
+                    backend.compress_sales_log()
+
+class ShopRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive, so clients don't reconnect every request
+    disable_nagle_algorithm = True  # headers and body go out separately, don't sit on the body
+
+    def log_message(self, format, *args):
+        pass  # way too chatty under load
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message):
+        self._send(status, {'error': message})
+
+    def _send_text(self, status, text, content_type='text/plain; charset=utf-8'):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        service = self.server.service
+        try:
+            if url.path == '/products':
+                limit = _count(query, 'limit', 100)
+                offset = _count(query, 'offset', 0)
+                with service.read():
+                    products = [_product_json(pid, item) for n, (pid, item)
+                                in enumerate(service.inventory.items())
+                                if offset <= n < offset + limit]
+                self._send(200, {'products': products, 'total': len(service.inventory)})
+
+            elif url.path.startswith('/products/'):
+                pid = unquote(url.path[len('/products/'):])
+                with service.read():
+                    if pid not in service.inventory:
+                        return self._error(404, f"No product '{pid}'")
+                    product = _product_json(pid, service.inventory[pid])
+                self._send(200, product)
+
+            elif url.path == '/search':
+                limit = _count(query, 'limit')
+                rank = query.get('rank', '0') not in ('0', '', 'false')
+                with service.read():
+                    results = backend.find_products(service.inventory, query.get('q', ''), limit, rank)
+                    results = [_product_json(pid, item) for pid, item in results]
+                self._send(200, {'results': results})
+
+            elif url.path == '/reports/daily':
+                date_string = query.get('date', datetime.now().strftime('%Y-%m-%d'))
+                datetime.strptime(date_string, '%Y-%m-%d')
+                with service.read():
+                    total = backend.get_daily_sales(date_string)
+                self._send(200, {'date': date_string, 'total': total})
+
+            elif url.path == '/reports/low-stock':
+                # No threshold = each product's own reorder point
+                threshold = int(query['threshold']) if 'threshold' in query else None
+                with service.read():
+                    if threshold is None:
+                        low = backend.get_reorder_list(service.inventory)
+                    else:
+                        low = backend.get_low_stock_products(service.inventory, threshold)
+                    low = [_product_json(pid, item) for pid, item in low]
+                self._send(200, {'threshold': threshold, 'products': low})
+
+            elif url.path == '/reports/top':
+                limit = _count(query, 'limit', 5)
+                with service.read():
+                    top = backend.get_top_selling_products(limit, query.get('start'), query.get('end'))
+                self._send(200, {'products': [{'id': pid, 'quantity': qty} for pid, qty in top]})
+
+            elif url.path == '/metrics':
+                self._send_text(200, metrics.prometheus_text(), 'text/plain; version=0.0.4; charset=utf-8')
+
+            elif url.path == '/metrics.json':
+                self._send(200, metrics.snapshot())
+
+            else:
+                self._error(404, "Unknown endpoint")
+        except ValueError as e:
+            self._error(400, f"Bad request: {e}")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/checkout':
+            return self._error(404, "Unknown endpoint")
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            order = json.loads(self.rfile.read(length) or b'{}')
+            cart = {str(pid): int(qty) for pid, qty in order.get('cart', {}).items()}
+            discount = float(order.get('discount', 0))
+        except (ValueError, TypeError, AttributeError) as e:   # e.g. {"discount": null}
+            return self._error(400, f"Bad order: {e}")
+        if not 0 <= discount <= 100:
+            return self._error(400, "Discount has to be between 0 and 100")
+
+        success, message, receipt = self.server.service.checkout(cart, discount)
+        status = 200 if success else 409 if success is not None else 500
+        self._send(status, {
+            'ok': success,
+            'message': message,
+            'bill': receipt.text if receipt else None,
+            'receipt': receipt.to_dict() if receipt else None,
+        })
+
+def make_server(inventory, host='127.0.0.1', port=8080):
+    server = ThreadingHTTPServer((host, port), ShopRequestHandler)
+    server.daemon_threads = True
+    server.service = ShopService(inventory)
+    return server
+
+def serve(inventory, host='127.0.0.1', port=8080):
+    """Run the server until Ctrl+C"""
+    server = make_server(inventory, host, port)
+    print(f"Serving the shop on http://{host}:{server.server_address[1]} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping...")
+    finally:
+        server.server_close()
+        server.service.close()
+        with backend.data_lock(), server.service.lock.writing():
+            backend.compact_journal(inventory)
@@ -0,0 +1,336 @@
+# sqlite_store.py
+"""
+Products and the sales log in one SQLite database (SQLITE_FILE in
+backend.py), for when the CSV files get too big or too many tills share
+them. Turn it on with PRODUCT_STORE = 'sqlite' and SALES_STORE = 'sqlite';
+`python main.py --migrate-to-sqlite` copies the CSV data over.
+
+- WAL mode, so tills can read while another one writes, and
+  synchronous=FULL so a committed sale survives a power cut.
+- Product ID is the primary key; sales are indexed by day and product ID.
+  Money in the sales table is in whole cents. Each product row has the
+  version token backend.get_version() hands out, so every till sees it.
+- Writes go into a transaction that stays open until sync(). With both
+  stores on the same database a checkout (sale rows + stock) is one
+  transaction, and the server's batches are one transaction per batch.
+  Call sync() before letting go of the data lock, or the other tills
+  will sit waiting for the write lock.
+
+The SQL below is kept as constants and the connection keeps its compiled
+statements around, so every statement only gets prepared once.
+"""
+
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+import metrics
+from inventory import _ProductFields
+from storage import SalesLog, SaleRow
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    product_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    price REAL NOT NULL,
+    stock INTEGER NOT NULL,
+    version TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS sales (
+    id INTEGER PRIMARY KEY,
+    day TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    bill_id TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    unit_cents INTEGER NOT NULL,
+    line_cents INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sales_by_day ON sales (day);
+CREATE INDEX IF NOT EXISTS sales_by_product ON sales (product_id);
+CREATE TABLE IF NOT EXISTS sales_days (
+    day TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+_GET_PRODUCT = "SELECT name, price, stock FROM products WHERE product_id = ?"
+_HAS_PRODUCT = "SELECT 1 FROM products WHERE product_id = ?"
+_ALL_PRODUCTS = "SELECT product_id, name, price, stock FROM products ORDER BY rowid"
+_PRODUCT_IDS = "SELECT product_id FROM products ORDER BY rowid"
+_COUNT_PRODUCTS = "SELECT COUNT(*) FROM products"
+_PUT_PRODUCT = """INSERT INTO products (product_id, name, price, stock) VALUES (?, ?, ?, ?)
+    ON CONFLICT (product_id) DO UPDATE SET name = excluded.name, price = excluded.price, stock = excluded.stock"""
+_DELETE_PRODUCT = "DELETE FROM products WHERE product_id = ?"
+_SET_FIELD = {field: f"UPDATE products SET {field} = ? WHERE product_id = ?"
+              for field in ('name', 'price', 'stock', 'version')}
+_GET_VERSION = "SELECT version FROM products WHERE product_id = ?"
+_PRODUCT_COLUMNS = "PRAGMA table_info(products)"
+_DATA_VERSION = "PRAGMA data_version"   # changes when another connection commits
+_ADD_VERSION_COLUMN = "ALTER TABLE products ADD COLUMN version TEXT NOT NULL DEFAULT ''"
+
+_ADD_SALE = """INSERT INTO sales (day, timestamp, bill_id, product_id, quantity, unit_cents, line_cents)
+    VALUES (?, ?, ?, ?, ?, ?, ?)"""
+_LAST_ID = "SELECT last_insert_rowid()"
+_DAY_VERSION = "SELECT version FROM sales_days WHERE day = ?"
+_SET_DAY_VERSION = """INSERT INTO sales_days (day, version) VALUES (?, ?)
+    ON CONFLICT (day) DO UPDATE SET version = excluded.version"""
+_DROP_DAY = "DELETE FROM sales_days WHERE day = ?"
+_UNDO_SALE = "DELETE FROM sales WHERE day = ? AND id > ?"
+_ALL_DAYS = "SELECT day, version FROM sales_days"
+_SALES_BETWEEN = """SELECT timestamp, bill_id, product_id, quantity, unit_cents, line_cents
+    FROM sales WHERE day BETWEEN ? AND ? ORDER BY day, id"""
+_DAY_TOTAL = "SELECT COALESCE(SUM(line_cents), 0) FROM sales WHERE day = ?"
+_DAY_PRODUCTS = "SELECT product_id, SUM(quantity) FROM sales WHERE day = ? GROUP BY product_id"
+
+class SQLiteDatabase:
+    """
+    One connection, shared by the product and sales stores (and by the
+    server's threads - the lock makes them take turns).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                    check_same_thread=False, cached_statements=256)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = FULL")
+        self.conn.executescript(SCHEMA)
+        if 'version' not in [row[1] for row in self.conn.execute(_PRODUCT_COLUMNS)]:
+            self.conn.execute(_ADD_VERSION_COLUMN)   # a database from before versions
+
+    def write(self, sql, params=()):
+        """Run a change inside the open transaction (starting one if needed)"""
+        with self.lock:
+            if not self.conn.in_transaction:
+                self.conn.execute("BEGIN IMMEDIATE")
+            return self.conn.execute(sql, params)
+
+    def write_many(self, sql, rows):
+        with self.lock:
+            if not self.conn.in_transaction:
+                self.conn.execute("BEGIN IMMEDIATE")
+            return self.conn.executemany(sql, rows)
+
+    def one(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchone()
+
+    def all(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def stream(self, sql, params=(), chunk=2000):
+        """Rows a chunk at a time, so a big query doesn't all land in memory"""
+        with self.lock:
+            cursor = self.conn.execute(sql, params)
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(chunk)
+            if not rows:
+                return
+            yield from rows
+
+    def commit(self):
+        with self.lock:
+            if self.conn.in_transaction:
+                self.conn.execute("COMMIT")
+                metrics.count('commits_total', file='sqlite')
+
+    def rollback(self):
+        with self.lock:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.conn.close()
+
+class _SQLiteRow(_ProductFields):
+    """One product, as it was when it got looked up. Setting a field updates the row."""
+
+    __slots__ = ('_db', '_pid', '_values')
+
+    def __init__(self, db, pid, values):
+        self._db = db
+        self._pid = pid
+        self._values = list(values)
+
+    def _set(self, n, field, value):
+        self._db.write(_SET_FIELD[field], (value, self._pid))
+        self._values[n] = value
+
+    @property
+    def name(self):
+        return self._values[0]
+
+    @name.setter
+    def name(self, value):
+        self._set(0, 'name', value)
+
+    @property
+    def price(self):
+        return self._values[1]
+
+    @price.setter
+    def price(self, value):
+        self._set(1, 'price', float(value))
+
+    @property
+    def stock(self):
+        return self._values[2]
+
+    @stock.setter
+    def stock(self, value):
+        self._set(2, 'stock', int(value))
+
+class SQLiteInventory(MutableMapping):
+    """
+    Inventory backed by the products table. Works like MappedInventory:
+    every change goes straight to the database, so there's nothing to save -
+    sync() commits.
+    """
+
+    persists_in_place = True
+
+    def __init__(self, database):
+        self.database = database
+        self._data_version = database.one(_DATA_VERSION)[0]
+
+    def __len__(self):
+        return self.database.one(_COUNT_PRODUCTS)[0]
+
+    def __contains__(self, pid):
+        return self.database.one(_HAS_PRODUCT, (pid,)) is not None
+
+    def __iter__(self):
+        return iter([pid for pid, in self.database.all(_PRODUCT_IDS)])
+
+    def __getitem__(self, pid):
+        values = self.database.one(_GET_PRODUCT, (pid,))
+        if values is None:
+            raise KeyError(pid)
+        return _SQLiteRow(self.database, pid, values)
+
+    def items(self):
+        """Everything in one query instead of one per product"""
+        return [(pid, _SQLiteRow(self.database, pid, values))
+                for pid, *values in self.database.all(_ALL_PRODUCTS)]
+
+    def values(self):
+        return [row for _, row in self.items()]
+
+    def __setitem__(self, pid, product):
+        self.put(pid, product['name'], product['price'], product['stock'])
+
+    def put(self, pid, name, price, stock):
+        self.database.write(_PUT_PRODUCT, (pid, name, float(price), int(stock)))
+
+    def put_many(self, products):
+        """[(pid, name, price, stock)] in one go, for imports"""
+        self.database.write_many(_PUT_PRODUCT, ((pid, name, float(price), int(stock))
+                                                for pid, name, price, stock in products))
+
+    def __delitem__(self, pid):
+        if self.database.write(_DELETE_PRODUCT, (pid,)).rowcount == 0:
+            raise KeyError(pid)
+
+    def version(self, pid):
+        row = self.database.one(_GET_VERSION, (pid,))
+        if row is None:
+            raise KeyError(pid)
+        return row[0]
+
+    def set_version(self, pid, token):
+        self.database.write(_SET_FIELD['version'], (token, pid))
+
+    def refresh(self):
+        """
+        Nothing's cached, every read goes to the database - but True if
+        another till committed something since we last looked, so the
+        caller's indexes are stale.
+        """
+        version = self.database.one(_DATA_VERSION)[0]
+        if version == self._data_version:
+            return False
+        self._data_version = version
+        return True
+
+    def sync(self):
+        self.database.commit()
+
+    def close(self):
+        self.database.close()
+
+    def __repr__(self):
+        return f"SQLiteInventory({self.database.path!r}, {len(self)} products)"
+
+class SQLiteSalesLog(SalesLog):
+    """
+    The sales table. A day's version is the ID of its newest row, kept in
+    sales_days so listing the days doesn't have to go through every sale.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, database):
+        self.database = database
+
+    def _version(self, day):
+        row = self.database.one(_DAY_VERSION, (day,))
+        return row[0] if row else 0
+
+    def append(self, day, rows, sync=True):
+        return self.append_many(day, [rows], sync)
+
+    def append_many(self, day, sales, sync=True):
+        """Several sales for one day in one statement (migrations)"""
+        db = self.database
+        with db.lock:
+            before = self._version(day)
+            db.write_many(_ADD_SALE, [(day, *row) for rows in sales for row in rows])
+            after = db.one(_LAST_ID)[0]
+            db.write(_SET_DAY_VERSION, (day, after))
+            if sync:
+                db.commit()
+        return before, after
+
+    def undo(self, day, version):
+        db = self.database
+        with db.lock:
+            db.write(_UNDO_SALE, (day, version))
+            if version:
+                db.write(_SET_DAY_VERSION, (day, version))
+            else:
+                db.write(_DROP_DAY, (day,))
+
+    def sync(self):
+        self.database.commit()
+
+    def days(self):
+        return dict(self.database.all(_ALL_DAYS))
+
+    def rows(self, start=None, end=None):
+        for row in self.database.stream(_SALES_BETWEEN, (start or '', end or '9999')):
+            yield SaleRow(*row)
+
+    def summarize_day(self, day):
+        db = self.database
+        with db.lock:
+            # One read transaction, so another till's sale can't land halfway through
+            started = not db.conn.in_transaction
+            if started:
+                db.conn.execute("BEGIN")
+            try:
+                version = self._version(day)
+                cents = db.one(_DAY_TOTAL, (day,))[0]
+                products = dict(db.all(_DAY_PRODUCTS, (day,)))
+            finally:
+                if started:
+                    db.conn.execute("COMMIT")
+        return {'size': version, 'cents': cents, 'products': products}
+
+    def close(self):
+        self.database.close()
@@ -0,0 +1,95 @@
+# stock_index.py
+"""
+Keeps track of which products are running low, so the low stock report
+doesn't have to look at every product and a sale can warn us the moment
+something drops to its reorder point.
+"""
+
+from bisect import bisect_left, bisect_right, insort
+
+class StockIndex:
+    """
+    Every product in order of how much stock it has, plus the ones sitting
+    at or below their reorder point (each product can have its own, the
+    rest use default_point).
+    Call update() whenever a product's stock changes - it returns True when
+    that change just took the product down to its reorder point.
+    """
+
+    def __init__(self, inventory=None, reorder_points=None, default_point=5):
+        self.default_point = default_point
+        self._points = dict(reorder_points or {})
+        self._stock = {}    # product ID -> stock the last time we looked
+        self._sorted = []   # (stock, product ID), lowest first
+        self._low = {}      # product IDs at/below their reorder point (a dict, for the order)
+
+        if inventory:
+            for pid, item in inventory.items():
+                self._stock[pid] = item['stock']
+                if self._is_low(pid, item['stock']):
+                    self._low[pid] = None
+            self._sorted = sorted((stock, pid) for pid, stock in self._stock.items())
+
+    def __len__(self):
+        return len(self._stock)
+
+    def __contains__(self, pid):
+        return pid in self._stock
+
+    def reorder_point(self, pid):
+        return self._points.get(pid, self.default_point)
+
+    def _is_low(self, pid, stock):
+        return stock <= self._points.get(pid, self.default_point)
+
+    def update(self, pid, stock):
+        """Note a product's new stock. True if it just went down to its reorder point."""
+        old = self._stock.get(pid)
+        if old == stock:
+            return False
+        if old is not None:
+            del self._sorted[bisect_left(self._sorted, (old, pid))]
+        insort(self._sorted, (stock, pid))
+        self._stock[pid] = stock
+
+        if not self._is_low(pid, stock):
+            self._low.pop(pid, None)
+            return False
+        if pid in self._low:
+            return False  # it was low already
+        self._low[pid] = None
+        return True
+
+    def remove(self, pid):
+        old = self._stock.pop(pid, None)
+        if old is not None:
+            del self._sorted[bisect_left(self._sorted, (old, pid))]
+        self._low.pop(pid, None)
+
+    def set_reorder_point(self, pid, point):
+        """Change one product's reorder point (None = back to the default)"""
+        if point is None:
+            self._points.pop(pid, None)
+        else:
+            self._points[pid] = point
+        if pid in self._stock:
+            if self._is_low(pid, self._stock[pid]):
+                self._low.setdefault(pid, None)
+            else:
+                self._low.pop(pid, None)
+
+    def set_reorder_points(self, points):
+        """Swap in a whole new set of reorder points, only moving the products whose point changed"""
+        changed = [pid for pid in set(self._points) | set(points)
+                   if self._points.get(pid) != points.get(pid)]
+        for pid in changed:
+            self.set_reorder_point(pid, points.get(pid))
+
+    def at_or_below(self, threshold):
+        """Product IDs with stock <= threshold, lowest stock first"""
+        end = bisect_right(self._sorted, (threshold, '\U0010ffff'))
+        return [pid for _, pid in self._sorted[:end]]
+
+    def low(self):
+        """Product IDs at or below their own reorder point, lowest stock first"""
+        return sorted(self._low, key=self._stock.__getitem__)
@@ -0,0 +1,540 @@
+# storage.py
+"""
+Where the sales log lives. backend.py only talks to a SalesLog, so the
+day files (CsvSalesLog, the default) and SQLite (sqlite_store.py) are
+interchangeable - pick one with SALES_STORE in backend.py.
+
+A sale row going in is [timestamp, bill ID, product ID, quantity,
+unit cents, line cents]; rows coming out are SaleRow tuples.
+"""
+
+import collections
+import csv
+import gzip
+import io
+import json
+import lzma
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import metrics
+from durable import atomic_writer, fsync_dir, repair_tail, seal
+from money import format_cents, parse_cents
+
+# Checksum is only filled in on a sale's last row, see durable.seal()
+SALES_HEADER = ['Timestamp', 'Bill ID', 'Product ID', 'Quantity', 'Unit Price', 'Line Total', 'Checksum']
+
+# Money in cents, see money.py
+SaleRow = collections.namedtuple('SaleRow', 'timestamp bill_id product_id quantity unit_cents line_cents')
+
+# How old day files get compressed: file ending, how to open it, settings for writing
+COMPRESSIONS = {'gzip': ('.csv.gz', gzip.open, {'compresslevel': 6}),
+                'lzma': ('.csv.xz', lzma.open, {'preset': 6})}
+
+class SalesLog:
+    """
+    What every sales log does. Each day has a version that changes
+    whenever that day's sales do, which is how the sales summary knows
+    what it has to re-read.
+    """
+
+    name = None
+
+    def append(self, day, rows, sync=True):
+        """
+        Add one sale's rows to a day. sync=False leaves them for sync().
+        Returns the day's (version before, version after).
+        """
+        raise NotImplementedError
+
+    def undo(self, day, version):
+        """Take a day back to the version append() said it had before"""
+        raise NotImplementedError
+
+    def sync(self):
+        """Get everything appended with sync=False onto disk"""
+        raise NotImplementedError
+
+    def days(self):
+        """{'YYYY-MM-DD': version} for every day with sales"""
+        raise NotImplementedError
+
+    def rows(self, start=None, end=None):
+        """SaleRows between start and end (days, both included), oldest first"""
+        raise NotImplementedError
+
+    def summarize_day(self, day):
+        """{'size': version, 'cents': revenue, 'products': {pid: quantity}} for one day"""
+        raise NotImplementedError
+
+    def summarize_days(self, days, workers=1, min_bytes=0):
+        """
+        summarize_day() for a bunch of days: (day, summary) pairs in the
+        order given, one day at a time so memory doesn't grow with the
+        number of days. Days that can't be read are left out (with a
+        warning). Logs that can spread the work over `workers` processes
+        do so once there's min_bytes to read.
+        """
+        for day in days:
+            try:
+                summary = self.summarize_day(day)
+            except Exception as e:
+                print(f"Had trouble reading sales data for {day}: {e}")
+                continue
+            yield day, summary
+
+    def recover(self, days):
+        """Fix up what a crash left behind in the newest `days` days. Returns how many needed it."""
+        return 0
+
+    def rotate(self, today):
+        """
+        Tidy away days too old to still change (logs that do that, see
+        CsvSalesLog). Returns (days, bytes before, bytes after).
+        """
+        return 0, 0, 0
+
+    def close(self):
+        pass
+
+def _write_sale_rows(f, rows):
+    """
+    One sale's rows out to a day file, with the cents written as money
+    amounts. The last row gets a checksum over the whole sale, so a sale
+    that only half made it to disk can be spotted (see recover()).
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([row[0], row[1], row[2], row[3], format_cents(row[4]),
+                                  format_cents(row[5]), ''] for row in rows)
+    f.write(seal(buffer.getvalue()))
+
+def _sale_rows(reader):
+    for row in reader:
+        if len(row) < 6:
+            continue
+        try:
+            yield SaleRow(row[0], row[1], row[2], int(row[3]), parse_cents(row[4]), parse_cents(row[5]))
+        except ValueError:
+            continue   # broken, or a header line
+
+def read_sales_file(f):
+    """The good rows of one open day file (the header and broken lines get skipped)"""
+    reader = csv.reader(f)
+    next(reader, None)
+    return _sale_rows(reader)
+
+def _summarize_range(path, start, end, size):
+    """
+    Worker process: (cents, {pid: quantity}) for the lines of a day file
+    that start at or after byte `start` and before `end`. The line running
+    over `end` belongs to this range; the one running into `start` to the
+    range before. Nothing past `size` gets read.
+    """
+    with open(path, 'rb') as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()   # finish the line the range before started
+        begin = f.tell()
+        data = f.read(max(0, end - begin))
+        if end < size and data and not data.endswith(b'\n'):
+            data += f.readline()
+    return _add_up([data])
+
+def _add_up(chunks):
+    """
+    (cents, {pid: quantity}) for day file data coming in as bytes, each
+    chunk whole lines. Only the product ID, quantity and line total get
+    looked at, and splitting the line on commas is a lot quicker than the
+    csv module or making a SaleRow per line. Chunks with a quote in them
+    (a product ID with a comma, say) still go through csv.
+    """
+    cents = 0
+    products = {}
+    raw = {}   # product ID, still as bytes -> quantity
+    get = raw.get
+    for data in chunks:
+        if b'"' in data:
+            for row in _sale_rows(csv.reader(io.StringIO(data.decode('utf-8', 'replace'), newline=''))):
+                cents += row.line_cents
+                products[row.product_id] = products.get(row.product_id, 0) + row.quantity
+            continue
+        for line in data.split(b'\n'):
+            fields = line.split(b',')
+            try:
+                qty = int(fields[3])
+                line_cents = round(float(fields[5]) * 100)   # parse_cents(), inlined
+            except (ValueError, IndexError):
+                continue   # broken, a header line or the empty bit after the last newline
+            cents += line_cents
+            pid = fields[2]
+            raw[pid] = get(pid, 0) + qty
+    for pid, qty in raw.items():
+        pid = pid.decode('utf-8', 'replace')
+        products[pid] = products.get(pid, 0) + qty
+    return cents, products
+
+def _line_chunks(f, size=1 << 20):
+    """A binary file a chunk of whole lines at a time"""
+    for data in iter(lambda: f.read(size), b''):
+        if not data.endswith(b'\n'):
+            data += f.readline()
+        yield data
+
+def _days_before(day, days):
+    return (datetime.strptime(day, '%Y-%m-%d') - timedelta(days=days)).strftime('%Y-%m-%d')
+
+def _chunks(source, target=None, size=1 << 20):
+    """Binary file source a chunk at a time, copying it to target on the way past"""
+    for data in iter(lambda: source.read(size), b''):
+        if target is not None:
+            target.write(data)
+        yield data
+
+def _describe(chunks):
+    """The manifest bits for a day file's contents: size, sale rows, first and last sale time"""
+    size = lines = 0
+    head = tail = b''
+    for data in chunks:
+        size += len(data)
+        lines += data.count(b'\n')
+        if len(head) < 4096:
+            head += data[:4096]
+        tail = (tail + data)[-4096:]
+    if tail and not tail.endswith(b'\n'):
+        lines += 1
+    head_lines = head.split(b'\n')
+    header = head.startswith(SALES_HEADER[0].encode())
+    first_line = head_lines[1 if header else 0]
+    last_line = tail.rstrip(b'\n').rsplit(b'\n', 1)[-1]
+    rows = lines - header
+    return {'size': size, 'rows': rows,
+            'first': first_line.split(b',', 1)[0].decode('utf-8', 'replace') if rows else None,
+            'last': last_line.split(b',', 1)[0].decode('utf-8', 'replace') if rows else None}
+
+def _summarize_cold(path):
+    """Worker process: (cents, {pid: quantity}) for a whole compressed day file"""
+    with _open_cold(path, 'rb') as f:
+        return _add_up(_line_chunks(f))
+
+def _open_cold(path, mode='rt'):
+    """A compressed day file, opened for streaming through (as text unless mode says 'rb')"""
+    for ending, opener, _ in COMPRESSIONS.values():
+        if path.endswith(ending):
+            if mode == 'rb':
+                return opener(path, 'rb')
+            return opener(path, mode, newline='', encoding='utf-8')
+    raise ValueError(f"Don't know how {path} is compressed")
+
+class CsvSalesLog(SalesLog):
+    """
+    One CSV file per day: folder/YYYY-MM-DD.csv. A day's version is the
+    size of its file. Reports only open the files inside their date range.
+
+    With compress_after set, day files older than that many days move to
+    the cold tier, folder/cold/, compressed (gzip or lzma). They stop
+    changing once they're that old, so cold/manifest.json keeps each one's
+    size (still its version), row count and first/last sale time, and
+    that's what tells queries which cold files there are - they only
+    open the ones inside their date range, decompressing as they read.
+    A sale for a cold day (the clock went back?) warms it up again first.
+    """
+
+    name = 'csv'
+
+    def __init__(self, folder, compress_after=None, compression='gzip'):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{compression}', use one of {', '.join(COMPRESSIONS)}")
+        self.folder = folder
+        self.compress_after = compress_after
+        self.compression = compression
+        self.cold_folder = os.path.join(folder, 'cold')
+        self.manifest_path = os.path.join(self.cold_folder, 'manifest.json')
+        self._manifest = None
+        self._manifest_mtime = None
+        self._pending = set()   # files written with sync=False
+        self._lock = threading.Lock()
+
+    def path(self, day):
+        return os.path.join(self.folder, f"{day}.csv")
+
+    def partitions(self):
+        """All the daily sales files we have, as {'YYYY-MM-DD': path} (cold ones included)"""
+        partitions = {day: os.path.join(self.cold_folder, entry['file'])
+                      for day, entry in self.manifest().items()}
+        partitions.update(self._hot_partitions())
+        return partitions
+
+    def _hot_partitions(self):
+        partitions = {}
+        try:
+            names = os.listdir(self.folder)
+        except OSError:
+            return partitions
+        for name in names:
+            if name.endswith('.csv') and len(name) == 14:
+                partitions[name[:-4]] = os.path.join(self.folder, name)
+        return partitions
+
+    # --- The cold tier ---
+
+    def manifest(self):
+        """{'YYYY-MM-DD': {file, size, bytes, rows, first, last}} for the cold days, re-read when it changes"""
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if self._manifest is None or mtime != self._manifest_mtime:
+            if mtime is None and not os.path.isdir(self.cold_folder):
+                self._manifest, self._manifest_mtime = {}, None
+            elif mtime is None:
+                self._rebuild_manifest()   # lost it, but there are cold files
+            else:
+                try:
+                    with open(self.manifest_path, 'r') as f:
+                        self._manifest = json.load(f)['days']
+                    self._manifest_mtime = mtime
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Warning: {self.manifest_path} is broken ({e}), rebuilding it")
+                    self._rebuild_manifest()
+        return self._manifest
+
+    def _save_manifest(self, manifest):
+        with atomic_writer(self.manifest_path) as f:
+            json.dump({'days': dict(sorted(manifest.items()))}, f, indent=1)
+        self._manifest = manifest
+        self._manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+
+    def _rebuild_manifest(self):
+        """Go through every cold file again (only if the manifest got lost)"""
+        manifest = {}
+        try:
+            names = sorted(os.listdir(self.cold_folder))
+        except OSError:
+            return manifest
+        for name in names:
+            for ending, opener, _ in COMPRESSIONS.values():
+                if name.endswith(ending):
+                    path = os.path.join(self.cold_folder, name)
+                    try:
+                        with opener(path, 'rb') as f:
+                            entry = _describe(_chunks(f))
+                    except (OSError, EOFError, lzma.LZMAError) as e:
+                        print(f"Warning: Couldn't read {path}: {e}")
+                        continue
+                    manifest[name[:10]] = dict(file=name, bytes=os.path.getsize(path), **entry)
+        self._save_manifest(manifest)
+        return manifest
+
+    def rotate(self, today):
+        """
+        Move the day files more than compress_after days before today
+        (a 'YYYY-MM-DD') into the cold tier. Call it holding the data lock,
+        and not from the checkout path - it can take a while (backend.py
+        does it on startup and server.py when the day changes).
+        Each one gets compressed and fsynced and goes in the manifest
+        before the plain file is removed, so a crash part way leaves both
+        and the plain one is still the one that counts.
+        """
+        if self.compress_after is None:
+            return 0, 0, 0
+        ending, opener, options = COMPRESSIONS[self.compression]
+        manifest = dict(self.manifest())
+        cutoff = _days_before(today, self.compress_after)
+        moved = before = after = 0
+        for day, path in sorted(self._hot_partitions().items()):
+            if day >= cutoff:
+                continue
+            os.makedirs(self.cold_folder, exist_ok=True)
+            name = day + ending
+            cold_path = os.path.join(self.cold_folder, name)
+            try:
+                with open(path, 'rb') as source, atomic_writer(cold_path, 'wb') as f:
+                    with opener(f, 'wb', **options) as packed:
+                        entry = _describe(_chunks(source, packed))
+                manifest[day] = dict(file=name, bytes=os.path.getsize(cold_path), **entry)
+                self._save_manifest(manifest)
+                os.remove(path)
+            except (OSError, lzma.LZMAError) as e:
+                print(f"Warning: Couldn't compress {path}: {e}")
+                continue
+            moved += 1
+            before += entry['size']
+            after += manifest[day]['bytes']
+        if moved:
+            fsync_dir(self.path(today))
+            metrics.count('sales_days_compressed_total', moved)
+        return moved, before, after
+
+    def _warm_up(self, day):
+        """Put a cold day back as a plain file, so it can be appended to"""
+        manifest = dict(self.manifest())
+        entry = manifest.get(day)
+        if entry is None:
+            return
+        cold_path = os.path.join(self.cold_folder, entry['file'])
+        with _open_cold(cold_path) as source, atomic_writer(self.path(day), newline='', encoding='utf-8') as f:
+            for chunk in iter(lambda: source.read(1 << 20), ''):
+                f.write(chunk)
+        del manifest[day]
+        self._save_manifest(manifest)
+        os.remove(cold_path)
+
+    def _open_day(self, day, mode='rt'):
+        """
+        (file, version) for reading a day, as text or with mode='rb' as
+        bytes: the plain file, or else the cold one. version is None for a
+        plain file (it's how far you read), a cold one's comes from the manifest.
+        """
+        try:
+            if mode == 'rb':
+                return open(self.path(day), 'rb'), None
+            return open(self.path(day), 'r', newline=''), None
+        except FileNotFoundError:
+            entry = self.manifest().get(day)
+            if entry is None:
+                raise
+            return _open_cold(os.path.join(self.cold_folder, entry['file']), mode), entry['size']
+
+    # --- Reading and writing ---
+
+    def append(self, day, rows, sync=True):
+        """All the rows for one sale go in a single append to the day's file"""
+        path = self.path(day)
+        os.makedirs(self.folder, exist_ok=True)
+        if day in self.manifest() and not os.path.exists(path):
+            self._warm_up(day)
+        with open(path, 'a', newline='', encoding='utf-8') as f:
+            f.seek(0, os.SEEK_END)
+            start = f.tell()
+            if start == 0:
+                csv.writer(f).writerow(SALES_HEADER)
+            _write_sale_rows(f, rows)
+            f.flush()
+            end = f.tell()
+            if sync:
+                os.fsync(f.fileno())
+                metrics.count('fsyncs_total', file='sales')
+            else:
+                with self._lock:
+                    self._pending.add(path)
+        if start == 0:
+            fsync_dir(path)   # a new day file, make sure its name sticks too
+        metrics.count('bytes_written_total', end - start, file='sales')
+        return start, end
+
+    def undo(self, day, version):
+        """Cut the day's file back to the size it had"""
+        path = self.path(day)
+        if version == 0:
+            os.remove(path)
+            return
+        with open(path, 'r+') as f:
+            f.truncate(version)
+
+    def sync(self):
+        with self._lock:
+            paths = list(self._pending)
+            self._pending.clear()
+        try:
+            for path in paths:
+                if os.path.exists(path):   # a failed sale might have removed it
+                    with open(path, 'ab') as f:
+                        os.fsync(f.fileno())
+                    metrics.count('fsyncs_total', file='sales')
+        except Exception:
+            # Still not on disk, leave them for the next try
+            with self._lock:
+                self._pending.update(paths)
+            raise
+
+    def days(self):
+        versions = {day: entry['size'] for day, entry in self.manifest().items()}
+        for day, path in self._hot_partitions().items():
+            try:
+                versions[day] = os.path.getsize(path)
+            except OSError:
+                continue
+        return versions
+
+    def rows(self, start=None, end=None):
+        for day in sorted(self.partitions()):
+            if (start and day < start) or (end and day > end):
+                continue
+            try:
+                f, _ = self._open_day(day)
+                with f:
+                    yield from read_sales_file(f)
+            except (OSError, EOFError, lzma.LZMAError) as e:
+                print(f"Had trouble reading sales data for {day}: {e}")
+
+    def summarize_day(self, day):
+        f, size = self._open_day(day, 'rb')
+        with f:
+            cents, products = _add_up(_line_chunks(f))
+            if size is None:
+                size = f.tell()
+        return {'size': size, 'cents': cents, 'products': products}
+
+    def summarize_days(self, days, workers=1, min_bytes=0):
+        """
+        Big scans get cut into newline-aligned byte ranges (a big day file
+        into several) that a pool of processes parses side by side; their
+        totals get added up per day at the end. Small ones go one day at a
+        time like summarize_day().
+        Sales appended while this runs aren't counted, and the day's version
+        is the size it had when we started, so they get picked up next time.
+        """
+        sizes = {}
+        cold = self.manifest()
+        for day in days:
+            try:
+                sizes[day] = os.path.getsize(self.path(day))
+            except OSError as e:
+                if day in cold:
+                    sizes[day] = cold[day]['size']
+                else:
+                    print(f"Had trouble reading sales data for {day}: {e}")
+        total = sum(sizes.values())
+        if workers <= 1 or total < min_bytes:
+            yield from super().summarize_days(sizes, workers, min_bytes)
+            return
+
+        step = max(1 << 20, total // (workers * 4))   # a few ranges per worker, so they finish together
+        hot = self._hot_partitions()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # A compressed file can't be split up, so each cold day is one job
+            jobs = [(day, size, [pool.submit(_summarize_range, self.path(day), start,
+                                             min(start + step, size), size)
+                                 for start in range(0, size, step)] if day in hot else
+                                [pool.submit(_summarize_cold, os.path.join(self.cold_folder, cold[day]['file']))])
+                    for day, size in sizes.items()]
+            for day, size, parts in jobs:
+                summary = {'size': size, 'cents': 0, 'products': {}}
+                totals = summary['products']
+                try:
+                    for part in parts:
+                        cents, products = part.result()
+                        summary['cents'] += cents
+                        for pid, qty in products.items():
+                            totals[pid] = totals.get(pid, 0) + qty
+                except Exception as e:
+                    print(f"Had trouble reading sales data for {day}: {e}")
+                    continue
+                yield day, summary
+
+    def recover(self, days):
+        """Cut sales that only half made it to disk off the end of the newest day files"""
+        fixed = 0
+        header = (SALES_HEADER[0] + ',').encode('utf-8')
+        for day, path in sorted(self._hot_partitions().items())[-days:]:
+            try:
+                cut = repair_tail(path, len(SALES_HEADER), header)
+            except OSError as e:
+                print(f"Warning: Couldn't check {path}: {e}")
+                continue
+            if cut:
+                print(f"Recovered {path}: dropped {cut} bytes of a sale that never finished")
+                fixed += 1
+        return fixed